@@ -1,25 +1,54 @@
 import os
 import io
+import re
+import time
+import uuid
 import json
 import csv
 import base64
 import logging
+import hashlib
+import posixpath
+import threading
+import zipfile
+from collections import OrderedDict
+from contextlib import closing
 from datetime import datetime, timedelta
-from flask import Flask, request, render_template, redirect, send_from_directory, url_for, flash, send_file, jsonify
-from werkzeug.utils import secure_filename
-from PIL import Image, ImageDraw, ImageFont
+import click
+from flask import Flask, Request, request, render_template, redirect, url_for, flash, send_file, jsonify, abort
+from werkzeug.utils import secure_filename, safe_join
 import numpy as np
-import cv2
-import face_recognition
 from config import Config
+import recognition
+import gallery
+import thumbnails
+import chunked_upload
+import changefeed
+import export
+import student_index
+import roster_import
+import storage as storage_backends
+from profiling import init_profiling
+from persistence import VersionConflict
 
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class AppRequest(Request):
+    @property
+    def max_content_length(self):
+        # roster imports carry whole photo archives (multipart files are spooled
+        # to disk); the form posts two files of up to ROSTER_IMPORT_MAX_BYTES
+        if self.endpoint == 'import_students_route':
+            return 2 * app.config.get('ROSTER_IMPORT_MAX_BYTES', 2 * 1024 * 1024 * 1024)
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = AppRequest
 app.config.from_object(Config)
+init_profiling(app)
 
 # Configuration loaded from Config
 UPLOAD_FOLDER = app.config.get('UPLOAD_FOLDER', 'uploads')
@@ -28,77 +57,230 @@ KNOWN_FACES_FOLDER = app.config.get('KNOWN_FACES_FOLDER', 'known_faces')
 ATTENDANCE_DATA_FOLDER = app.config.get('ATTENDANCE_DATA_FOLDER', 'attendance_data')
 ALLOWED_EXTENSIONS = app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg'})
 MATCH_THRESHOLD = app.config.get('MATCH_THRESHOLD', 0.6)
-
-# Create necessary directories
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DATA_FOLDER, exist_ok=True)
-os.makedirs(KNOWN_FACES_FOLDER, exist_ok=True)
-os.makedirs(ATTENDANCE_DATA_FOLDER, exist_ok=True)
+TILED_DETECTION = app.config.get('TILED_DETECTION', 'auto')
+TILED_DETECTION_MIN_DIM = app.config.get('TILED_DETECTION_MIN_DIM', 3000)
+CLASS_MANIFEST = os.path.join(DATA_FOLDER, '.manifest.json')
+ANNOTATED_FOLDER = os.path.join('static', 'annotated')
+OVERALL_ATTENDANCE_CSV = os.path.join(ATTENDANCE_DATA_FOLDER, 'overall_attendance.csv')
+API_CACHE_SIZE = app.config.get('API_CACHE_SIZE', 64)
+ROSTER_PAGE_SIZE = app.config.get('ROSTER_PAGE_SIZE', 50)
+ROSTER_MAX_PAGE_SIZE = app.config.get('ROSTER_MAX_PAGE_SIZE', 200)
+HISTORY_PAGE_SIZE = app.config.get('HISTORY_PAGE_SIZE', 20)
+THUMBNAIL_CACHE_FOLDER = app.config.get('THUMBNAIL_CACHE_FOLDER', os.path.join('cache', 'thumbnails'))
+THUMBNAIL_SIZES = app.config.get('THUMBNAIL_SIZES', (64, 128, 256))
+THUMBNAIL_MAX_AGE = app.config.get('THUMBNAIL_MAX_AGE', 30 * 24 * 3600)
+COMPACT_GALLERY = app.config.get('COMPACT_GALLERY')
+GALLERY_CACHE_FOLDER = app.config.get('GALLERY_CACHE_FOLDER', os.path.join('cache', 'gallery'))
+TEMPLATES_PER_STUDENT = app.config.get('TEMPLATES_PER_STUDENT', 3)
+TEMPLATE_MAX_SPREAD = app.config.get('TEMPLATE_MAX_SPREAD', 0.6)
+TEMPLATE_MAX_CANDIDATES = app.config.get('TEMPLATE_MAX_CANDIDATES', 12)
+RECOGNITION_PROFILES = app.config.get('RECOGNITION_PROFILES', {})
+ENROLLMENT_PROFILE = app.config.get('ENROLLMENT_PROFILE', 'accurate')
+ATTENDANCE_PROFILE = app.config.get('ATTENDANCE_PROFILE', 'balanced')
+ENROLLMENT_CACHE_FOLDER = app.config.get('ENROLLMENT_CACHE_FOLDER', os.path.join('cache', 'enrollment'))
+ENROLLMENT_CACHE_MAX_AGE = app.config.get('ENROLLMENT_CACHE_MAX_AGE', 24 * 3600)
+IMPORT_WORKERS = app.config.get('IMPORT_WORKERS', 2)
+IMPORT_BATCH_SIZE = app.config.get('IMPORT_BATCH_SIZE', 32)
+ROSTER_IMPORT_MAX_BYTES = app.config.get('ROSTER_IMPORT_MAX_BYTES', 2 * 1024 * 1024 * 1024)
+QUALITY_GATE = {
+    "min_face_px": app.config.get('QUALITY_MIN_FACE_PX', 20),
+    "min_sharpness": app.config.get('QUALITY_MIN_SHARPNESS', 20.0),
+    "max_yaw": app.config.get('QUALITY_MAX_YAW', 0.35),
+} if app.config.get('QUALITY_GATING', True) else None
+CHUNKED_UPLOAD_FOLDER = app.config.get('CHUNKED_UPLOAD_FOLDER', os.path.join('cache', 'uploads'))
+CHUNKED_UPLOAD_CHUNK_SIZE = app.config.get('CHUNKED_UPLOAD_CHUNK_SIZE', 512 * 1024)
+CHUNKED_UPLOAD_MAX_AGE = app.config.get('CHUNKED_UPLOAD_MAX_AGE', 24 * 3600)
+CHANGE_FEED_FOLDER = app.config.get('CHANGE_FEED_FOLDER', os.path.join(DATA_FOLDER, 'changes'))
+CHANGE_FEED_SEGMENT_EVENTS = app.config.get('CHANGE_FEED_SEGMENT_EVENTS', 1000)
+CHANGE_FEED_PAGE_SIZE = app.config.get('CHANGE_FEED_PAGE_SIZE', 500)
+CHANGE_FEED_MAX_PAGE_SIZE = app.config.get('CHANGE_FEED_MAX_PAGE_SIZE', 5000)
+CHANGE_FEED_KEEP_DAYS = app.config.get('CHANGE_FEED_KEEP_DAYS', 90)
+STUDENT_INDEX_PATH = app.config.get('STUDENT_INDEX_PATH', os.path.join('cache', 'student_index.sqlite3'))
+STUDENT_INDEX_THRESHOLD = app.config.get('STUDENT_INDEX_THRESHOLD', 75)
+
+# Load dlib models at import time only when asked to (e.g. recognition workers);
+# everything else loads them lazily on the first recognition request
+if app.config.get('PRELOAD_RECOGNITION'):
+    recognition.warm_up()
+
+# Every read and write of app state goes through this (see storage.py);
+# backends create parent "directories" on write
+storage = storage_backends.from_config(app.config)
 
 # Helper Functions
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def get_profile(name):
+    """Settings of a named recognition profile (legacy defaults if unknown)."""
+    profile = RECOGNITION_PROFILES.get(name)
+    if profile is None:
+        logger.warning(f"Unknown recognition profile '{name}', using defaults")
+        return dict(recognition.LEGACY_ENCODING, detector='hog', upsample=1)
+    return profile
+
+def encoding_profile(name):
+    """What is stored next to a student's encodings to describe how they were made."""
+    profile = get_profile(name)
+    return {"name": name, "landmarks": profile['landmarks'], "jitters": profile['jitters']}
+
+def encode_enrollment_photo(image):
+    """Encoding of the first face in an enrollment photo, or None."""
+    profile = get_profile(ENROLLMENT_PROFILE)
+    face_locations = recognition.detect_faces(image, model=profile['detector'], upsample=profile['upsample'])
+    if not face_locations:
+        return None
+    _, encodings, _ = recognition.encode_faces(
+        image, face_locations[:1], landmark_model=profile['landmarks'], num_jitters=profile['jitters'])
+    return encodings[0].tolist() if encodings else None
+
+def record_changes(events):
+    """Append events to the change feed (see changefeed.py).
+
+    The change itself is already saved, so a feed failure is not raised;
+    it is marked in the feed instead, and the student index rebuilds from
+    the session history on its next sync.
+    """
+    try:
+        changefeed.append(storage, CHANGE_FEED_FOLDER, events, CHANGE_FEED_SEGMENT_EVENTS)
+    except Exception as e:
+        logger.error(f"Could not record {len(events)} changes in the change feed: {e}")
+        try:
+            changefeed.mark_lost(storage, CHANGE_FEED_FOLDER, events)
+        except Exception as e:
+            logger.error(f"Could not mark the lost changes in the change feed: {e}")
+
+def roster_changes(class_data, before, after):
+    """student.added/updated/removed events between two {student_id: name} rosters of a class."""
+    events = []
+    def event(kind, student_id, name):
+        events.append({"type": kind, "class_name": class_data['name'], "safe_name": class_data['safe_name'],
+                       "student_id": student_id, "name": name})
+    for student_id, name in after.items():
+        if student_id not in before:
+            event("student.added", student_id, name)
+        elif before[student_id] != name:
+            event("student.updated", student_id, name)
+    for student_id, name in before.items():
+        if student_id not in after:
+            event("student.removed", student_id, name)
+    return events
+
+def allowed_file(filename, extensions=None):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in (extensions or ALLOWED_EXTENSIONS)
+
+def upload_limits(kind):
+    """(extensions, max bytes) accepted by /uploads for a form's data-upload-kind, None if unknown."""
+    if kind == 'image':
+        return ALLOWED_EXTENSIONS, app.config.get('MAX_CONTENT_LENGTH') or 16 * 1024 * 1024
+    if kind == 'roster':
+        return {'csv', 'zip'}, ROSTER_IMPORT_MAX_BYTES
+    return None
+
+def request_files(field):
+    """Files posted under `field`, plus finished chunked uploads named in `<field>_upload`."""
+    files = [f for f in request.files.getlist(field) if f and f.filename]
+    for upload_id in request.form.getlist(f"{field}_upload"):
+        upload = chunked_upload.open_upload(storage, CHUNKED_UPLOAD_FOLDER, upload_id)
+        if upload is not None:
+            files.append(upload)
+    return files
 
 def get_safe_name(name):
     return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).rstrip().replace(' ', '_')
 
+def prerender_thumbnails(photo_path):
+    """Face-cropped thumbnails for an enrollment photo (models are loaded here anyway)"""
+    try:
+        thumbnails.prerender_thumbnails(storage.local_path(photo_path), THUMBNAIL_CACHE_FOLDER, THUMBNAIL_SIZES)
+    except Exception as e:
+        logger.warning(f"Could not render thumbnails for {photo_path}: {e}")
+
+def backfill_face_thumbnails(class_names=None):
+    """Face-crop template photos that only have centre-cropped thumbnails; returns (rendered, checked).
+
+    Photos in which no face is found keep their centre crop and are checked
+    again on the next run.
+    """
+    rendered = checked = 0
+    for safe_class_name in class_names or get_all_classes():
+        class_data = get_class(safe_class_name)
+        if not class_data:
+            continue
+        for student in class_data['students']:
+            for photo in student.get('photos', []):
+                photo_path = os.path.join(KNOWN_FACES_FOLDER, class_data['safe_name'], photo)
+                checked += 1
+                try:
+                    local_path = storage.local_path(photo_path)
+                    if all(thumbnails.has_face_variant(local_path, size, THUMBNAIL_CACHE_FOLDER)
+                           for size in THUMBNAIL_SIZES):
+                        continue
+                except FileNotFoundError:
+                    continue
+                prerender_thumbnails(photo_path)
+                rendered += 1
+    return rendered, checked
+
+@app.cli.command('prerender-thumbnails')
+@click.argument('classes', nargs=-1)
+def prerender_thumbnails_command(classes):
+    """Render face-cropped thumbnails for photos that only have centre crops."""
+    rendered, checked = backfill_face_thumbnails([get_safe_name(name) for name in classes])
+    print(f"Rendered thumbnails for {rendered} of {checked} photos")
+
 # Attendance Summary Functions (NEW)
 def ensure_attendance_csv_exists():
     """Make sure CSV exists with header"""
-    os.makedirs(os.path.dirname("attendance_data/overall_attendance.csv"), exist_ok=True)
-    csv_file = "attendance_data/overall_attendance.csv"
-    if not os.path.exists(csv_file):
-        with open(csv_file, "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["date", "class_name", "total_students", "present"])
+    csv_file = OVERALL_ATTENDANCE_CSV
+    if not storage.exists(csv_file):
+        with storage.lock(csv_file):
+            if not storage.exists(csv_file):
+                storage.write_csv(csv_file, [["date", "class_name", "total_students", "present"]])
 
 def log_attendance(class_name, total_students, present):
     """Add/Update today's record for a class"""
     ensure_attendance_csv_exists()
     today = datetime.now().date().isoformat()
-    csv_file = "attendance_data/overall_attendance.csv"
+    csv_file = OVERALL_ATTENDANCE_CSV
     rows = []
     updated = False
     
-    # read old data
-    with open(csv_file, "r") as f:
-        reader = csv.DictReader(f)
+    # read-modify-write under the ledger lock so concurrent workers don't lose rows
+    with storage.lock(csv_file):
+        reader = csv.DictReader(io.StringIO(storage.read_text(csv_file)))
         for row in reader:
             if row["date"] == today and row["class_name"] == class_name:
                 row["total_students"] = str(total_students)
                 row["present"] = str(present)
                 updated = True
             rows.append(row)
-    
-    # if not updated, add new row
-    if not updated:
-        rows.append({
-            "date": today,
-            "class_name": class_name,
-            "total_students": total_students,
-            "present": present
-        })
-    
-    # rewrite file
-    with open(csv_file, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=["date","class_name","total_students","present"])
-        writer.writeheader()
-        writer.writerows(rows)
+        
+        # if not updated, add new row
+        if not updated:
+            rows.append({
+                "date": today,
+                "class_name": class_name,
+                "total_students": total_students,
+                "present": present
+            })
+        
+        storage.write_csv(csv_file, rows, fieldnames=["date","class_name","total_students","present"])
+
+    record_changes([{"type": "ledger.updated", "class_name": class_name, "safe_name": get_safe_name(class_name),
+                     "date": today, "total_students": total_students, "present": present}])
+    invalidate_api_cache(get_safe_name(class_name))
 
 def get_today_summary():
     """Return total present/total students"""
     ensure_attendance_csv_exists()
     today = datetime.now().date().isoformat()
-    csv_file = "attendance_data/overall_attendance.csv"
+    csv_file = OVERALL_ATTENDANCE_CSV
     total_students, total_present = 0, 0
     
-    with open(csv_file, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["date"] == today:
-                total_students += int(row["total_students"])
-                if row["present"] != "":
-                    total_present += int(row["present"])
+    reader = csv.DictReader(io.StringIO(storage.read_text(csv_file)))
+    for row in reader:
+        if row["date"] == today:
+            total_students += int(row["total_students"])
+            if row["present"] != "":
+                total_present += int(row["present"])
     
     return total_present, total_students
 
@@ -107,16 +289,16 @@ def get_performance():
     ensure_attendance_csv_exists()
     today = datetime.now().date().isoformat()
     yesterday = (datetime.now().date() - timedelta(days=1)).isoformat()
-    csv_file = "attendance_data/overall_attendance.csv"
+    csv_file = OVERALL_ATTENDANCE_CSV
     
+    rows = list(csv.DictReader(io.StringIO(storage.read_text(csv_file))))
+
     def calc_percentage(day):
         total_s, total_p = 0, 0
-        with open(csv_file, "r") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row["date"] == day and row["present"] != "":
-                    total_s += int(row["total_students"])
-                    total_p += int(row["present"])
+        for row in rows:
+            if row["date"] == day and row["present"] != "":
+                total_s += int(row["total_students"])
+                total_p += int(row["present"])
         return (total_p/total_s*100) if total_s > 0 else 0
     
     today_perc = calc_percentage(today)
@@ -126,30 +308,183 @@ def get_performance():
     status = "Improved" if change > 0 else "Declined"
     return today_perc, status, round(abs(change), 1)
 
+# Dashboard API caching
+# Responses are keyed by a data version built from the storage versions
+# (mtimes or ETags) of the files they are computed from, so writes made by any worker invalidate them.
+# Cache keys are (kind,) or (kind, safe_class_name, ...) tuples.
+_api_cache = OrderedDict()
+_api_cache_lock = threading.Lock()
+
+def file_version(path):
+    return storage.version(path)
+
+def class_file_path(class_name):
+    return os.path.join(DATA_FOLDER, f"{get_safe_name(class_name)}.json")
+
+def invalidate_api_cache(safe_class_name=None):
+    """Drop this worker's cached API responses (called after every write).
+
+    With a class, only that class's responses and the overview go; the
+    others are still checked against their data version when served.
+    """
+    with _api_cache_lock:
+        if safe_class_name is None:
+            _api_cache.clear()
+            return
+        for cache_key in list(_api_cache):
+            if cache_key[0] == "class-overview" or cache_key[1:2] == (safe_class_name,):
+                del _api_cache[cache_key]
+
+def cached_json_response(cache_key, version, build):
+    """Serve build() as JSON with an ETag derived from the data version.
+
+    Answers If-None-Match with 304 and reuses the serialized body while the
+    data version is unchanged.
+    """
+    etag = hashlib.sha1(f"{cache_key}|{version}".encode()).hexdigest()[:24]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        with _api_cache_lock:
+            cached = _api_cache.get(cache_key)
+            if cached and cached[0] == version:
+                _api_cache.move_to_end(cache_key)
+        if cached and cached[0] == version:
+            body = cached[1]
+        else:
+            body = json.dumps(build())
+            with _api_cache_lock:
+                _api_cache[cache_key] = (version, body)
+                _api_cache.move_to_end(cache_key)
+                while len(_api_cache) > API_CACHE_SIZE:
+                    _api_cache.popitem(last=False)
+        response = app.response_class(body, mimetype='application/json')
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+# Class Manifest
+# data/.manifest.json holds one small entry per class so that listing and
+# counting never has to load class files (and their encodings).
+_manifest_cache = {'version': None, 'classes': {}}
+
+def manifest_entry(class_data):
+    students = class_data.get('students', [])
+    return {
+        'name': class_data.get('name', class_data['safe_name']),
+        'safe_name': class_data['safe_name'],
+        'student_count': len(students),
+        'encoded_count': sum(1 for s in students if s.get('encodings')),
+        'updated_at': class_data.get('updated_at')
+    }
+
+def write_class_manifest(classes):
+    storage.write_json(CLASS_MANIFEST, {'classes': classes}, indent=2, sort_keys=True)
+
+def rebuild_class_manifest():
+    """Recreate the manifest from the class JSON files in DATA_FOLDER"""
+    with storage.lock(CLASS_MANIFEST):
+        classes = {}
+        for filename in storage.list(DATA_FOLDER):
+            if filename.endswith('.json') and not filename.startswith('.'):
+                try:
+                    class_data = storage.read_json(os.path.join(DATA_FOLDER, filename))
+                    class_data.setdefault('safe_name', filename[:-5])
+                    classes[class_data['safe_name']] = manifest_entry(class_data)
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Skipping {filename} in manifest rebuild: {e}")
+        write_class_manifest(classes)
+    return classes
+
+def load_class_manifest():
+    """Return {safe_name: entry}; rebuilt from the class files if missing"""
+    version = file_version(CLASS_MANIFEST)
+    if version == "0":
+        return rebuild_class_manifest()
+    if _manifest_cache['version'] == version:
+        return _manifest_cache['classes']
+
+    try:
+        classes = storage.read_json(CLASS_MANIFEST)['classes']
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Class manifest unreadable, rebuilding: {e}")
+        return rebuild_class_manifest()
+
+    _manifest_cache['version'] = version
+    _manifest_cache['classes'] = classes
+    return classes
+
+def update_class_manifest(safe_class_name, class_data=None):
+    """Replace (or with class_data=None, remove) one class entry"""
+    load_class_manifest()
+    with storage.lock(CLASS_MANIFEST):
+        try:
+            classes = storage.read_json(CLASS_MANIFEST)['classes']
+        except (OSError, ValueError, KeyError):
+            classes = {}
+        if class_data is None:
+            classes.pop(safe_class_name, None)
+        else:
+            classes[safe_class_name] = manifest_entry(class_data)
+        write_class_manifest(classes)
+
+def get_class_summaries():
+    """Manifest entries for every class, sorted by safe_name"""
+    classes = load_class_manifest()
+    return [classes[name] for name in sorted(classes)]
+
+@app.cli.command('rebuild-manifest')
+def rebuild_manifest_command():
+    """Rebuild data/.manifest.json from the class JSON files."""
+    classes = rebuild_class_manifest()
+    print(f"Manifest rebuilt with {len(classes)} classes")
+
+# Roster Projection
+# data/.rosters/<class>.json holds each student's ID, name, counts and shown
+# photo, so roster pages never load the class file (and its encodings). It is
+# written with every class save and tagged with the class file version it
+# was made from, so a missing or stale one is rebuilt on first use.
+def roster_path(safe_class_name):
+    return os.path.join(DATA_FOLDER, '.rosters', f"{safe_class_name}.json")
+
+def write_class_roster(class_data):
+    """Save the roster projection of a class (call while holding the class lock, after saving it)"""
+    safe_class_name = class_data['safe_name']
+    roster = {
+        'class_version': file_version(class_file_path(safe_class_name)),
+        'students': [{
+            'student_id': s['student_id'],
+            'name': s['name'],
+            'photo': s['photos'][0] if s.get('photos') else None,
+            'photo_count': len(s.get('photos', [])),
+            'encoding_count': len(s.get('encodings', [])),
+        } for s in class_data['students']],
+    }
+    storage.write_json(roster_path(safe_class_name), roster)
+    return roster
+
+def load_class_roster(class_name, class_version):
+    """Roster projection of a class at class_version (its file version), or None if there is no class"""
+    safe_class_name = get_safe_name(class_name)
+    try:
+        roster = storage.read_json(roster_path(safe_class_name))
+        if roster.get('class_version') == class_version:
+            return roster
+    except (FileNotFoundError, ValueError):
+        pass
+    with storage.lock(class_file_path(safe_class_name)):
+        class_data = get_class(safe_class_name)
+        return write_class_roster(class_data) if class_data else None
+
 # Class Management
 def get_all_classes():
-    classes = []
-    if os.path.exists(DATA_FOLDER):
-        for filename in os.listdir(DATA_FOLDER):
-            if filename.endswith('.json'):
-                class_name = filename[:-5]  # Remove .json extension
-                classes.append(class_name)
-    return sorted(classes)
+    return sorted(load_class_manifest())
 
 def create_class(class_name, total_students=0):
     safe_class_name = get_safe_name(class_name)
     filepath = os.path.join(DATA_FOLDER, f"{safe_class_name}.json")
     
-    if os.path.exists(filepath):
-        return False, f"Class '{class_name}' already exists"
-    
-    # Create class directories
-    class_faces_dir = os.path.join(KNOWN_FACES_FOLDER, safe_class_name)
-    os.makedirs(class_faces_dir, exist_ok=True)
-    
-    class_attendance_dir = os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name)
-    os.makedirs(class_attendance_dir, exist_ok=True)
-    
     # Create class data structure
     class_data = {
         'name': class_name,
@@ -160,8 +495,15 @@ def create_class(class_name, total_students=0):
         'updated_at': datetime.now().isoformat()
     }
     
-    with open(filepath, 'w') as f:
-        json.dump(class_data, f, indent=2)
+    with storage.lock(filepath):
+        if storage.exists(filepath):
+            return False, f"Class '{class_name}' already exists"
+        storage.save_versioned_json(filepath, class_data, indent=2)
+        update_class_manifest(safe_class_name, class_data)
+        write_class_roster(class_data)
+        record_changes([{"type": "class.created", "class_name": class_name, "safe_name": safe_class_name,
+                         "total_students": total_students}])
+    invalidate_api_cache(safe_class_name)
     
     return True, f"Class '{class_name}' created successfully"
 
@@ -169,71 +511,105 @@ def get_class(class_name):
     safe_class_name = get_safe_name(class_name)
     filepath = os.path.join(DATA_FOLDER, f"{safe_class_name}.json")
     
-    if not os.path.exists(filepath):
+    try:
+        return storage.read_json(filepath)
+    except FileNotFoundError:
         return None
-    
-    with open(filepath, 'r') as f:
-        return json.load(f)
 
-def save_class(class_data):
+def save_class(class_data, changes=()):
+    """Save a class document read earlier with get_class.
+
+    Raises VersionConflict if another request saved the class in between;
+    use update_class for read-modify-write cycles that should retry.
+    changes are recorded in the change feed while the class is still
+    locked, so the feed lists saves of a class in the order they happened.
+    """
     safe_class_name = class_data['safe_name']
     filepath = os.path.join(DATA_FOLDER, f"{safe_class_name}.json")
     
-    with open(filepath, 'w') as f:
-        json.dump(class_data, f, indent=2)
+    with storage.lock(filepath):
+        storage.save_versioned_json(filepath, class_data, indent=2)
+        update_class_manifest(safe_class_name, class_data)
+        write_class_roster(class_data)
+        if changes:
+            record_changes(changes)
+    invalidate_api_cache(safe_class_name)
     
     return True
 
+def update_class(class_name, mutate, retries=5):
+    """Re-read the class, apply mutate(class_data) and save it.
+
+    mutate is re-applied to a fresh copy whenever a concurrent save wins the
+    version check, so it must only depend on its argument. Returning False
+    from mutate aborts without saving. Returns the saved class data, or None
+    if the class does not exist or mutate aborted. Raises VersionConflict
+    when every retry lost; callers answer that with CLASS_BUSY_MESSAGE.
+    """
+    for attempt in range(retries):
+        class_data = get_class(class_name)
+        if not class_data:
+            return None
+        before = {s['student_id']: s['name'] for s in class_data['students']}
+        if mutate(class_data) is False:
+            return None
+        class_data['updated_at'] = datetime.now().isoformat()
+        try:
+            save_class(class_data, roster_changes(class_data, before,
+                                                  {s['student_id']: s['name'] for s in class_data['students']}))
+            return class_data
+        except VersionConflict as e:
+            logger.info(f"Retrying update of '{class_name}' ({attempt + 1}/{retries}): {e}")
+    raise VersionConflict(f"Class '{class_name}' is being modified concurrently")
+
+CLASS_BUSY_MESSAGE = "Class is being modified by someone else, please try again"
+
 def delete_class(class_name):
     safe_class_name = get_safe_name(class_name)
     
     # Delete class data file
     filepath = os.path.join(DATA_FOLDER, f"{safe_class_name}.json")
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    with storage.lock(filepath):
+        storage.delete(filepath)
+        update_class_manifest(safe_class_name, None)
+        storage.delete(roster_path(safe_class_name))
+        record_changes([{"type": "class.deleted", "class_name": class_name, "safe_name": safe_class_name}])
     
     # Delete class faces directory
-    class_faces_dir = os.path.join(KNOWN_FACES_FOLDER, safe_class_name)
-    if os.path.exists(class_faces_dir):
-        import shutil
-        shutil.rmtree(class_faces_dir)
+    storage.delete_prefix(os.path.join(KNOWN_FACES_FOLDER, safe_class_name))
     
     # Delete class attendance directory
-    class_attendance_dir = os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name)
-    if os.path.exists(class_attendance_dir):
-        import shutil
-        shutil.rmtree(class_attendance_dir)
+    storage.delete_prefix(os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name))
+    invalidate_api_cache(safe_class_name)
     
     return True, f"Class '{class_name}' deleted successfully"
 
 # Student Management
 def add_students(class_name, students_data):
-    class_data = get_class(class_name)
-    if not class_data:
-        return False, "Class not found"
-    
-    # Update existing students or add new ones
-    for new_student in students_data:
-        existing = False
-        for i, student in enumerate(class_data['students']):
-            if student['student_id'] == new_student['student_id']:
-                class_data['students'][i]['name'] = new_student['name']
-                existing = True
-                break
-        
-        if not existing:
-            class_data['students'].append({
-                'student_id': new_student['student_id'],
-                'name': new_student['name'],
-                'photos': [],
-                'encodings': []
-            })
-    
-    # Update timestamp
-    class_data['updated_at'] = datetime.now().isoformat()
-    
-    # Save updated class data
-    save_class(class_data)
+    def apply(class_data):
+        # Update existing students or add new ones
+        for new_student in students_data:
+            existing = False
+            for i, student in enumerate(class_data['students']):
+                if student['student_id'] == new_student['student_id']:
+                    class_data['students'][i]['name'] = new_student['name']
+                    existing = True
+                    break
+            
+            if not existing:
+                class_data['students'].append({
+                    'student_id': new_student['student_id'],
+                    'name': new_student['name'],
+                    'photos': [],
+                    'encodings': []
+                })
+
+    try:
+        if not update_class(class_name, apply):
+            return False, "Class not found"
+    except VersionConflict as e:
+        logger.warning(f"Could not add students: {e}")
+        return False, CLASS_BUSY_MESSAGE
     
     return True, f"Added/updated {len(students_data)} students in class '{class_name}'"
 
@@ -253,94 +629,255 @@ def add_student_photo(class_name, student_id, photo_files):
         photo_files = [photo_files]
 
     safe_class_name = class_data['safe_name']
-    added = 0
+    new_photos = []
+    face_recognition = recognition.load()
 
+    # Encode outside the class lock; only the final merge is serialized
     for photo_file in photo_files:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{student_id}_{timestamp}_{secure_filename(photo_file.filename)}"
         filepath = os.path.join(KNOWN_FACES_FOLDER, safe_class_name, filename)
 
-        photo_file.save(filepath)
+        data = photo_file.read()
+        storage.write_bytes(filepath, data)
 
         try:
-            image = face_recognition.load_image_file(filepath)
-            face_locations = face_recognition.face_locations(image)
-            if not face_locations:
-                os.remove(filepath)
-                continue
-
-            face_encodings = face_recognition.face_encodings(image, face_locations)
-            if not face_encodings:
-                os.remove(filepath)
+            image = face_recognition.load_image_file(io.BytesIO(data))
+            encoding = encode_enrollment_photo(image)
+            if encoding is None:
+                storage.delete(filepath)
                 continue
 
-            student['photos'].append(filename)
-            student['encodings'].append(face_encodings[0].tolist())
-            added += 1
+            new_photos.append((filename, encoding))
         except Exception as e:
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            storage.delete(filepath)
             logger.warning(f"Error processing {filepath}: {e}")
 
-    if added > 0:
-        # Keep only the first photo for encodings
-        if student['photos']:
-            # Sort photos by filename and keep only the first one for encoding
-            sorted_photos = sorted(student['photos'])
-            first_photo = sorted_photos[0]
-            
-            # Find the encoding corresponding to the first photo
-            first_photo_index = student['photos'].index(first_photo)
-            first_encoding = student['encodings'][first_photo_index]
-            
-            # Keep only the first photo and encoding
-            student['photos'] = [first_photo]
-            student['encodings'] = [first_encoding]
-        
-        class_data['updated_at'] = datetime.now().isoformat()
-        save_class(class_data)
-        return True, f"✅ {added} photo(s) added successfully. Only first photo used for encoding."
-    else:
+    if not new_photos:
         return False, "❌ No valid face detected in uploaded photo(s)"
 
-# Function to delete a student
-def delete_student(class_name, student_id):
-    """Delete a student from JSON, photos, and encodings (not CSV)."""
+    def apply(class_data):
+        student = next((s for s in class_data['students'] if s['student_id'] == student_id), None)
+        if not student:
+            return False
+        merge_student_photos(student, new_photos)
+
+    try:
+        class_data = update_class(class_name, apply)
+        message = "Student not found"
+    except VersionConflict as e:
+        logger.warning(f"Could not add photos of {student_id}: {e}")
+        class_data, message = None, CLASS_BUSY_MESSAGE
+    if not class_data:
+        for filename, _ in new_photos:
+            storage.delete(os.path.join(KNOWN_FACES_FOLDER, safe_class_name, filename))
+        return False, message
+
+    student = next(s for s in class_data['students'] if s['student_id'] == student_id)
+    # earlier templates already have their thumbnails; only render new ones that were picked
+    added = {filename for filename, _ in new_photos}
+    for photo in student['photos']:
+        if photo in added:
+            prerender_thumbnails(os.path.join(KNOWN_FACES_FOLDER, safe_class_name, photo))
+
+    return True, (f"✅ {len(new_photos)} photo(s) added successfully. "
+                  f"{len(student['encodings'])} used as recognition templates.")
+
+def set_student_templates(student, photos, profile):
+    """Keep the best TEMPLATES_PER_STUDENT of [(filename, encoding)] as the student's templates.
+
+    photos[0] becomes the medoid, which is also the photo shown for the student.
+    """
+    chosen = gallery.select_templates([encoding for _, encoding in photos],
+                                      TEMPLATES_PER_STUDENT, TEMPLATE_MAX_SPREAD)
+    student['photos'] = [photos[i][0] for i in chosen]
+    student['encodings'] = [photos[i][1] for i in chosen]
+    if chosen:
+        student['encoding_profile'] = profile
+
+def merge_student_photos(student, new_photos):
+    """Add [(filename, encoding)] to a student and re-select their templates"""
+    profile = encoding_profile(ENROLLMENT_PROFILE)
+    current = list(zip(student['photos'], student['encodings']))
+    if student.get('encoding_profile', recognition.LEGACY_ENCODING)['landmarks'] != profile['landmarks']:
+        current = []  # encodings of another landmark model are not comparable
+    set_student_templates(student, current + list(new_photos), profile)
+
+def import_students(class_name, roster_stream, photo_stream=None, workers=None):
+    """Enroll a roster CSV, and photos from a ZIP named by student_id, in one save.
+
+    Returns (True, result) with a message, counts and per-row problems, or
+    (False, message) when nothing could be imported.
+    """
     class_data = get_class(class_name)
     if not class_data:
         return False, "Class not found"
-
     safe_class_name = class_data['safe_name']
-    students = class_data['students']
+    profile = get_profile(ENROLLMENT_PROFILE)
+    workers = workers or IMPORT_WORKERS
 
-    # find student
-    student = None
-    for s in students:
-        if s['student_id'] == student_id:
-            student = s
-            break
+    try:
+        archive = zipfile.ZipFile(photo_stream) if photo_stream is not None else None
+    except zipfile.BadZipFile:
+        return False, "Photo archive is not a valid ZIP file"
+    members = roster_import.photo_index(archive, ALLOWED_EXTENSIONS) if archive else {}
 
-    if not student:
-        return False, f"Student {student_id} not found"
+    students, photos, problems = [], {}, []
+    used_members = set()
+    batch = []  # (row, student_id, member name, bytes)
 
-    # 1. remove photos from known_faces folder
-    class_faces_dir = os.path.join(KNOWN_FACES_FOLDER, safe_class_name)
-    if os.path.exists(class_faces_dir):
-        for photo in student.get("photos", []):
-            photo_path = os.path.join(class_faces_dir, photo)
-            try:
-                if os.path.exists(photo_path):
-                    os.remove(photo_path)
-            except Exception as e:
-                logger.warning(f"Could not delete {photo_path}: {e}")
+    def problem(row, student_id, text):
+        problems.append({'row': row, 'student_id': student_id, 'problem': text})
+
+    def encode_batch():
+        results = recognition.encode_photos([data for *_, data in batch], profile, workers)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        for (row, student_id, member, data), (encoding, error) in zip(batch, results):
+            if encoding is None:
+                problem(row, student_id, f"{member}: {error}")
+                continue
+            filename = f"{student_id}_{timestamp}_{secure_filename(posixpath.basename(member))}"
+            storage.write_bytes(os.path.join(KNOWN_FACES_FOLDER, safe_class_name, filename), data)
+            photos[student_id] = (filename, encoding)
+        batch.clear()
+
+    # photos are read and encoded a batch at a time while the CSV streams by
+    for row, student_id, name, photo, error in roster_import.read_roster(roster_stream):
+        if error:
+            problem(row, student_id, error)
+            continue
+        students.append({'student_id': student_id, 'name': name})
+        if archive is None:
+            continue
+
+        info = members.get(photo or student_id)
+        if info is None:
+            problem(row, student_id, f"{photo or 'photo'} not found in archive")
+            continue
+        used_members.add(info.filename)
+        try:
+            batch.append((row, student_id, info.filename, archive.read(info)))
+        except (zipfile.BadZipFile, OSError, EOFError) as e:
+            problem(row, student_id, f"{info.filename}: could not be read ({e})")
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            encode_batch()
+    if batch:
+        encode_batch()
+
+    for info in {info.filename: info for info in members.values()}.values():
+        if info.filename not in used_members:
+            problem('', '', f"{info.filename} matches no roster row")
+
+    if not students:
+        return False, problems[0]['problem'] if problems else "Roster has no students"
+    problems.sort(key=lambda p: (p['row'] == '', p['row'] or 0))
+
+    counts = {}
+    def apply(class_data):
+        counts.update(added=0, updated=0)
+        by_id = {s['student_id']: s for s in class_data['students']}
+        for new_student in students:
+            student = by_id.get(new_student['student_id'])
+            if student is None:
+                student = {'student_id': new_student['student_id'], 'name': new_student['name'],
+                           'photos': [], 'encodings': []}
+                class_data['students'].append(student)
+                by_id[student['student_id']] = student
+                counts['added'] += 1
+            else:
+                student['name'] = new_student['name']
+                counts['updated'] += 1
+            if student['student_id'] in photos:
+                merge_student_photos(student, [photos[student['student_id']]])
 
-    # 2. remove student from JSON
-    class_data['students'] = [s for s in students if s['student_id'] != student_id]
-    class_data['updated_at'] = datetime.now().isoformat()
-    save_class(class_data)
+    try:
+        class_data = update_class(class_name, apply)
+        message = "Class not found"
+    except VersionConflict as e:
+        logger.warning(f"Could not import students: {e}")
+        class_data, message = None, CLASS_BUSY_MESSAGE
+    if not class_data:
+        for filename, _ in photos.values():
+            storage.delete(os.path.join(KNOWN_FACES_FOLDER, safe_class_name, filename))
+        return False, message
+
+    message = (f"Imported {len(students)} students into '{class_name}' ({counts['added']} new, "
+               f"{counts['updated']} updated), {len(photos)} photo(s) encoded, {len(problems)} problem(s)")
+    logger.info(message)
+    return True, {'message': message, 'students': len(students), 'photos': len(photos),
+                  'problems': problems, **counts}
+
+# Function to delete a student
+def delete_student(class_name, student_id):
+    """Delete a student from JSON, photos, and encodings (not CSV)."""
+    removed = []
+    class_faces_dir = os.path.join(KNOWN_FACES_FOLDER, get_safe_name(class_name))
+    filenames = storage.list(class_faces_dir)
+
+    def apply(class_data):
+        students = class_data['students']
+        student = next((s for s in students if s['student_id'] == student_id), None)
+        if not student:
+            return False
+        # templates plus uploads that were not picked, so a reused ID starts clean
+        uploads = student_uploads(class_data, filenames).get(student_id, [])
+        removed[:] = [student, sorted(set(student.get('photos', [])) | set(uploads))]
+        class_data['students'] = [s for s in students if s['student_id'] != student_id]
+
+    try:
+        class_data = update_class(class_name, apply)
+    except VersionConflict as e:
+        logger.warning(f"Could not delete student {student_id}: {e}")
+        return False, CLASS_BUSY_MESSAGE
+    if not class_data:
+        if not removed and get_class(class_name) is None:
+            return False, "Class not found"
+        return False, f"Student {student_id} not found"
+
+    # remove photos from known_faces folder once the JSON no longer references them
+    for photo in removed[1]:
+        photo_path = os.path.join(class_faces_dir, photo)
+        try:
+            storage.delete(photo_path)
+        except Exception as e:
+            logger.warning(f"Could not delete {photo_path}: {e}")
 
     return True, f"🗑️ Student {student_id} deleted from {class_name}"
 
+def student_uploads(class_data, filenames):
+    """{student_id: photo filenames, newest first} of a class folder listing.
+
+    Uploads are named "<student_id>_<timestamp>_..." (group crops use the
+    secure_filename of the ID); the longest matching ID wins, so "S1_..."
+    never claims the photos of "S1_2".
+    """
+    ids = [s['student_id'] for s in class_data['students']]
+    prefixes = sorted({(f"{name}_", sid) for sid in ids for name in (sid, secure_filename(sid))},
+                      key=lambda p: len(p[0]), reverse=True)
+    uploads = {}
+    for filename in sorted(filenames, reverse=True):
+        if not allowed_file(filename):
+            continue
+        owner = next((sid for prefix, sid in prefixes if filename.startswith(prefix)), None)
+        if owner is not None:
+            uploads.setdefault(owner, []).append(filename)
+    return uploads
+
+def student_photo_candidates(class_data, filenames):
+    """{student_id: photo filenames} to choose templates from.
+
+    Besides the current templates this picks up older uploads that are still
+    in the class folder, newest first, up to TEMPLATE_MAX_CANDIDATES per
+    student.
+    """
+    uploads = student_uploads(class_data, filenames)
+    candidates = {}
+    for student in class_data['students']:
+        photos = list(student['photos'])
+        photos += [f for f in uploads.get(student['student_id'], []) if f not in photos]
+        candidates[student['student_id']] = photos[:max(TEMPLATE_MAX_CANDIDATES, len(student['photos']))]
+    return candidates
+
 # Function to generate encodings for all photos in a class
 def generate_class_encodings(class_name):
     class_data = get_class(class_name)
@@ -349,179 +886,475 @@ def generate_class_encodings(class_name):
     
     safe_class_name = class_data['safe_name']
     class_faces_dir = os.path.join(KNOWN_FACES_FOLDER, safe_class_name)
+    candidates = student_photo_candidates(class_data, storage.list(class_faces_dir))
     
-    if not os.path.exists(class_faces_dir):
-        return False, "Class faces directory not found"
-    
-    # Process each student
+    # photo filename -> encoding (or None); computed without holding the lock
+    computed = {}
+    profile = encoding_profile(ENROLLMENT_PROFILE)
+    face_recognition = recognition.load()
     for student in class_data['students']:
-        # Clear existing encodings
-        student['encodings'] = []
-        
-        # Use only the first photo (sorted by filename)
-        if student['photos']:
-            # Sort photos by filename and take the first one
-            sorted_photos = sorted(student['photos'])
-            first_photo = sorted_photos[0]
-            photo_path = os.path.join(class_faces_dir, first_photo)
-            
-            if not os.path.exists(photo_path):
-                continue
+        # every photo of the student is a candidate template
+        for photo in candidates[student['student_id']]:
+            photo_path = os.path.join(class_faces_dir, photo)
+            computed[photo] = None
                 
             try:
                 # Load the image
-                image = face_recognition.load_image_file(photo_path)
-                
-                # Find face locations
-                face_locations = face_recognition.face_locations(image)
-                
-                if not face_locations:
-                    continue
-                
-                # Get face encodings
-                face_encodings = face_recognition.face_encodings(image, face_locations)
-                
-                if face_encodings:
-                    # Add only the first encoding to student data
-                    student['encodings'] = [face_encodings[0].tolist()]
+                image = face_recognition.load_image_file(storage.open_image(photo_path))
+                computed[photo] = encode_enrollment_photo(image)
                     
+            except FileNotFoundError:
+                continue
             except Exception as e:
                 print(f"Error processing {photo_path}: {e}")
                 continue
+
+    def apply(class_data):
+        for student in class_data['students']:
+            photos = [(photo, computed[photo]) for photo in candidates.get(student['student_id'], [])
+                      if computed.get(photo) is not None]
+            # photos added since we started keep the encoding add_student_photo stored
+            photos += [(photo, encoding) for photo, encoding in zip(student['photos'], student['encodings'])
+                       if photo not in computed]
+            if photos:
+                set_student_templates(student, photos, profile)
+            else:
+                student['encodings'] = []
+
+    try:
+        class_data = update_class(class_name, apply)
+    except VersionConflict as e:
+        logger.warning(f"Could not save encodings: {e}")
+        return False, CLASS_BUSY_MESSAGE
+    if not class_data:
+        return False, "Class not found"
+    for student in class_data['students']:
+        for photo in student['photos'][:1]:
+            prerender_thumbnails(os.path.join(class_faces_dir, photo))
     
-    # Save updated class data
-    class_data['updated_at'] = datetime.now().isoformat()
-    save_class(class_data)
-    
-    return True, f"🔧 Encodings generated for class '{class_name}' (using first photo only)"
+    templates = sum(len(s['encodings']) for s in class_data['students'])
+    return True, f"🔧 Encodings generated for class '{class_name}' ({templates} templates)"
+
+# Group-photo enrollment: detect every face of one or two class photos once,
+# cache the crops and encodings, then let the teacher assign them to students
+def enrollment_session_dir(token):
+    if not re.fullmatch(r'[0-9a-f]{32}', token or ''):
+        return None
+    return os.path.join(ENROLLMENT_CACHE_FOLDER, token)
+
+def purge_enrollment_sessions():
+    """Remove cached sessions older than ENROLLMENT_CACHE_MAX_AGE."""
+    cutoff = time.time() - ENROLLMENT_CACHE_MAX_AGE
+    for token in storage.list(ENROLLMENT_CACHE_FOLDER):
+        session_dir = enrollment_session_dir(token)
+        if not session_dir:
+            continue
+        # faces.json is written last; a session without it is judged by its first crop
+        st = (storage.stat(os.path.join(session_dir, "faces.json"))
+              or storage.stat(os.path.join(session_dir, "face_0.jpg")))
+        if st is None or st.mtime < cutoff:
+            storage.delete_prefix(session_dir)
+
+def detect_enrollment_faces(class_name, photo_files):
+    """Detect and encode all faces in class photos; returns (token, message)."""
+    class_data = get_class(class_name)
+    if not class_data:
+        return None, "Class not found"
+
+    face_recognition = recognition.load()
+    from PIL import Image
+
+    profile_name = ENROLLMENT_PROFILE
+    profile = get_profile(profile_name)
+    token = uuid.uuid4().hex
+    session_dir = enrollment_session_dir(token)
+    purge_enrollment_sessions()
+
+    faces, skipped = [], 0
+    for photo_index, photo_file in enumerate(photo_files):
+        try:
+            image = face_recognition.load_image_file(photo_file)
+        except Exception as e:
+            logger.warning(f"Could not read enrollment photo {photo_file.filename}: {e}")
+            continue
+
+        locations = detect_group_faces(image, profile=profile)
+        locations, encodings, skipped_faces = recognition.encode_faces(
+            image, locations, landmark_model=profile['landmarks'],
+            num_jitters=profile['jitters'], quality=QUALITY_GATE)
+        skipped += len(skipped_faces)
+
+        pil_image = Image.fromarray(image)
+        for location, encoding in zip(locations, encodings):
+            top, right, bottom, left = location
+            crop = pil_image.crop(thumbnails.crop_box(pil_image, (left, top, right, bottom)))
+            crop.thumbnail((400, 400))
+            face_id = len(faces)
+            buf = io.BytesIO()
+            crop.save(buf, 'JPEG', quality=90)
+            storage.write_bytes(os.path.join(session_dir, f"face_{face_id}.jpg"), buf.getvalue())
+            faces.append({
+                "id": face_id,
+                "photo": photo_index,
+                "location": [int(v) for v in location],
+                "encoding": encoding.tolist(),
+            })
+
+    if not faces:
+        storage.delete_prefix(session_dir)
+        return None, "No usable faces detected in the uploaded photo(s)"
+
+    storage.write_json(os.path.join(session_dir, "faces.json"), {
+        "class": class_data['safe_name'],
+        "profile": encoding_profile(profile_name),
+        "created_at": datetime.now().isoformat(),
+        "faces": faces,
+    })
+    message = f"{len(faces)} face(s) detected"
+    if skipped:
+        message += f", {skipped} skipped as too small, blurred or turned away"
+    return token, message
+
+def load_enrollment_session(class_name, token):
+    """Cached faces of an enrollment session, or None if missing/expired."""
+    session_dir = enrollment_session_dir(token)
+    class_data = get_class(class_name)
+    if not session_dir or not class_data:
+        return None
+    try:
+        session = storage.read_json(os.path.join(session_dir, "faces.json"))
+    except (OSError, ValueError):
+        return None
+    if session.get("class") != class_data['safe_name']:
+        return None
+    return session
+
+def assign_enrollment_faces(class_name, token, assignments):
+    """Enroll cached faces as student photos in a single class save.
+
+    assignments maps face id -> student id. A student's previous photos are
+    replaced by the assigned crop.
+    """
+    session = load_enrollment_session(class_name, token)
+    if not session:
+        return False, "Enrollment session expired, please upload the photos again"
+    faces = {face["id"]: face for face in session["faces"]}
+    session_dir = enrollment_session_dir(token)
+
+    class_data = get_class(class_name)
+    safe_class_name = class_data['safe_name']
+    class_faces_dir = os.path.join(KNOWN_FACES_FOLDER, safe_class_name)
+
+    # copy crops into known_faces before the save so the JSON never points at missing files
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    new_photos = {}
+    for face_id, student_id in assignments.items():
+        if face_id not in faces or student_id in new_photos:
+            continue
+        filename = f"{secure_filename(student_id)}_{timestamp}_group_{face_id}.jpg"
+        storage.write_bytes(os.path.join(class_faces_dir, filename),
+                            storage.read_bytes(os.path.join(session_dir, f"face_{face_id}.jpg")))
+        new_photos[student_id] = (filename, faces[face_id]["encoding"])
+
+    if not new_photos:
+        return False, "No faces were assigned"
+
+    replaced, enrolled = [], []
+
+    def apply(class_data):
+        replaced.clear()
+        enrolled.clear()
+        for student in class_data['students']:
+            if student['student_id'] not in new_photos:
+                continue
+            filename, encoding = new_photos[student['student_id']]
+            replaced.extend(student.get('photos', []))
+            student['photos'] = [filename]
+            student['encodings'] = [encoding]
+            student['encoding_profile'] = session["profile"]
+            enrolled.append(student['student_id'])
+
+    try:
+        saved = update_class(class_name, apply)
+        message = "None of the assigned students are in this class"
+    except VersionConflict as e:
+        logger.warning(f"Could not enroll faces from the class photo: {e}")
+        saved, message = None, CLASS_BUSY_MESSAGE
+    if not saved or not enrolled:
+        for filename, _ in new_photos.values():
+            storage.delete(os.path.join(class_faces_dir, filename))
+        return False, message
+
+    for student_id, (filename, _) in new_photos.items():
+        if student_id not in enrolled:
+            storage.delete(os.path.join(class_faces_dir, filename))
+        else:
+            prerender_thumbnails(os.path.join(class_faces_dir, filename))
+    for photo in replaced:
+        try:
+            storage.delete(os.path.join(class_faces_dir, photo))
+        except OSError:
+            pass
+
+    storage.delete_prefix(session_dir)
+    return True, f"✅ {len(enrolled)} student(s) enrolled from the class photo"
 
 # Attendance Management
-def recognize_faces_in_image(class_name, image_path, tolerance=0.5, margin=0.02):
+def detect_group_faces(group_image, tiled=None, profile=None):
+    """Face boxes in a group photo, tiling very large images.
+
+    tiled=None follows Config.TILED_DETECTION ('auto' tiles images whose
+    longer side is at least TILED_DETECTION_MIN_DIM pixels). profile is a
+    recognition profile dict (defaults to ATTENDANCE_PROFILE).
     """
-    Recognize faces in a group image and mark attendance.
+    profile = profile or get_profile(ATTENDANCE_PROFILE)
+    if tiled is None:
+        tiled = TILED_DETECTION
+    if tiled == 'auto':
+        tiled = max(group_image.shape[:2]) >= TILED_DETECTION_MIN_DIM
+
+    if not tiled:
+        return recognition.detect_faces(group_image, model=profile['detector'], upsample=profile['upsample'])
+    return recognition.detect_faces_tiled(
+        group_image,
+        model=profile['detector'],
+        tile_size=app.config.get('TILE_SIZE', 1024),
+        max_upsample=app.config.get('TILE_MAX_UPSAMPLE', 2),
+        workers=app.config.get('TILE_WORKERS', 2))
+
+def match_faces(class_data, group_image, tolerance=0.5, margin=0.02, tiled=None, profile=None):
+    """
+    Detect, encode and match the faces of a group image against a class.
 
     Args:
-        class_name (str): Class identifier
-        image_path (str): Path to uploaded group image
+        class_data (dict): Class document (see get_class)
+        group_image (ndarray): RGB image
         tolerance (float): Distance threshold for recognition (lower = stricter)
         margin (float): Difference required between best and second-best match
-    """
-    class_data = get_class(class_name)
-    if not class_data:
-        return {"error": "Class not found"}
+        tiled (bool|str|None): Tiled detection mode, see detect_group_faces
+        profile (str|None): Recognition profile name (default ATTENDANCE_PROFILE)
 
-    # load all students encodings
-    students_encodings = {}
-    for student in class_data['students']:
-        encs = [np.array(e) for e in student.get("encodings", [])]
-        if encs:
-            students_encodings[student['student_id']] = {
-                "name": student['name'],
-                "encodings": encs
-            }
+    Returns a dict with recognized_faces, unknown_faces, skipped_faces,
+    profile and profile_mismatch.
+    """
+    return match_sections([class_data], group_image, tolerance=tolerance, margin=margin,
+                          tiled=tiled, profile=profile)
 
-    # load group image
-    try:
-        group_image = face_recognition.load_image_file(image_path)
-    except Exception as e:
-        return {"error": f"Error loading image: {e}"}
+def match_sections(classes, group_image, tolerance=0.5, margin=0.02, tiled=None, profile=None):
+    """
+    Like match_faces, against the union of several classes' galleries.
 
-    face_locations = face_recognition.face_locations(group_image)
-    face_encodings = face_recognition.face_encodings(group_image, face_locations)
+    Faces are detected and encoded once. A student enrolled in more than one
+    of the classes counts as one person: the runner-up for the margin check
+    is the closest *other* student, and the face is attributed to every
+    selected class the student belongs to (recognized_faces[i]["classes"]).
+    """
+    profile_name = profile or ATTENDANCE_PROFILE
+    profile = get_profile(profile_name)
+
+    # all students encodings, cached per worker until the class is saved
+    galleries = [gallery.get_gallery(
+        class_data, mode=COMPACT_GALLERY,
+        exact_dir=GALLERY_CACHE_FOLDER if COMPACT_GALLERY else None,
+        rerank=app.config.get('GALLERY_RERANK', gallery.DEFAULT_RERANK),
+        max_entries=app.config.get('GALLERY_CACHE_SIZE', 256)) for class_data in classes]
+
+    # encodings from different landmark models are not comparable, so query
+    # faces are also encoded with every other model the gallery was built with
+    gallery_landmarks = set().union(*(g.groups for g in galleries))
+    mismatched_landmarks = sorted(gallery_landmarks - {profile['landmarks']})
+    if mismatched_landmarks:
+        names = ", ".join(c['name'] for c in classes)
+        logger.warning(f"Class(es) '{names}' have encodings made with {mismatched_landmarks} landmarks, "
+                       f"profile '{profile_name}' uses '{profile['landmarks']}'; re-encode the class to fix")
+
+    face_locations = detect_group_faces(group_image, tiled=tiled, profile=profile)
+    # tiny, blurred and profile faces are reported instead of encoded
+    face_locations, face_encodings, skipped_faces = recognition.encode_faces(
+        group_image, face_locations, landmark_model=profile['landmarks'],
+        num_jitters=profile['jitters'], quality=QUALITY_GATE)
+    query_encodings = {profile['landmarks']: face_encodings}
+    for landmarks in mismatched_landmarks:
+        query_encodings[landmarks] = recognition.encode_faces(
+            group_image, face_locations, landmark_model=landmarks, num_jitters=profile['jitters'])[1]
 
     recognized_faces, unknown_faces = [], []
 
-    for i, face_encoding in enumerate(face_encodings):
-        results = []
-
-        # compare with each student
-        for sid, data in students_encodings.items():
-            dists = face_recognition.face_distance(data["encodings"], face_encoding)
-            if len(dists) > 0:
-                min_d = float(np.min(dists))
-                results.append((sid, data["name"], min_d))
-
-        if results:
-            results.sort(key=lambda x: x[2])  # sort by distance (lower is better)
-            best_sid, best_name, best_dist = results[0]
-            second_dist = results[1][2] if len(results) > 1 else 1.0
-
-            # ✅ margin + tolerance check
-            if best_dist <= tolerance and (second_dist - best_dist) >= margin:
-                confidence = max(0, (1 - best_dist / 0.6) * 100)
-                recognized_faces.append({
-                    "location": face_locations[i],
-                    "student_id": best_sid,
-                    "name": best_name,
-                    "distance": round(best_dist, 3),
-                    "confidence": round(confidence, 1)
-                })
-            else:
-                unknown_faces.append({"location": face_locations[i]})
+    per_class = [g.nearest(query_encodings) for g in galleries]
+    for face_index, location in enumerate(face_locations):
+        # (distance, runner-up within the class, class index, student index)
+        candidates = sorted(
+            (result[face_index][1], result[face_index][2], ci, result[face_index][0])
+            for ci, result in enumerate(per_class) if result[face_index][0] is not None)
+        if not candidates:
+            unknown_faces.append({"location": location})
+            continue
+
+        best_dist, _, best_class, best = candidates[0]
+        best_sid = galleries[best_class].student_ids[best]
+        same_student = [c for c in candidates if galleries[c[2]].student_ids[c[3]] == best_sid]
+        second_dist = min([c[1] for c in same_student] +
+                          [c[0] for c in candidates if galleries[c[2]].student_ids[c[3]] != best_sid])
+
+        # ✅ margin + tolerance check
+        if best_dist <= tolerance and (second_dist - best_dist) >= margin:
+            confidence = max(0, (1 - best_dist / 0.6) * 100)
+            recognized_faces.append({
+                "location": location,
+                "student_id": best_sid,
+                "name": galleries[best_class].names[best],
+                "distance": round(best_dist, 3),
+                "confidence": round(confidence, 1),
+                "classes": [classes[c[2]]['name'] for c in same_student if c[0] <= tolerance]
+            })
         else:
-            unknown_faces.append({"location": face_locations[i]})
+            unknown_faces.append({"location": location})
+
+    return {
+        "recognized_faces": recognized_faces,
+        "unknown_faces": unknown_faces,
+        "skipped_faces": skipped_faces,
+        "profile": profile_name,
+        "profile_mismatch": mismatched_landmarks,
+    }
+
+def annotate_group_image(group_image, matched, label):
+    """Draw recognized/unknown/skipped boxes; returns the file name under ANNOTATED_FOLDER."""
+    from PIL import Image, ImageDraw, ImageFont
 
     # annotated image banani
     pil_image = Image.fromarray(group_image)
     draw = ImageDraw.Draw(pil_image)
 
     # recognized (green box + name)
-    for face in recognized_faces:
+    for face in matched["recognized_faces"]:
         top, right, bottom, left = face['location']
         draw.rectangle(((left, top), (right, bottom)), outline=(0, 255, 0), width=3)
-        label = f"{face['name']} ({face['confidence']}%)"
+        label_text = f"{face['name']} ({face['confidence']}%)"
         try:
             font = ImageFont.truetype("arial.ttf", 20)
         except IOError:
             font = ImageFont.load_default()
         try:
-            bbox = draw.textbbox((0, 0), label, font=font)
+            bbox = draw.textbbox((0, 0), label_text, font=font)
             tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
         except AttributeError:
-            tw, th = draw.textsize(label, font=font)
+            tw, th = draw.textsize(label_text, font=font)
         draw.rectangle(((left, bottom - th - 10), (left + tw + 10, bottom)), fill=(0, 255, 0))
-        draw.text((left + 5, bottom - th - 5), label, fill=(0, 0, 0), font=font)
+        draw.text((left + 5, bottom - th - 5), label_text, fill=(0, 0, 0), font=font)
 
     # unknown (red box)
-    for face in unknown_faces:
+    for face in matched["unknown_faces"]:
         top, right, bottom, left = face['location']
         draw.rectangle(((left, top), (right, bottom)), outline=(255, 0, 0), width=3)
 
+    # skipped (orange box)
+    for face in matched["skipped_faces"]:
+        top, right, bottom, left = face['location']
+        draw.rectangle(((left, top), (right, bottom)), outline=(255, 165, 0), width=2)
+
     # save annotated image
-    annotated_dir = os.path.join("static", "annotated")
-    os.makedirs(annotated_dir, exist_ok=True)
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    annotated_filename = f"{class_name}_{ts}.jpg"
-    annotated_path = os.path.join(annotated_dir, annotated_filename)
-    pil_image.save(annotated_path)
-
-    # attendance status
+    annotated_filename = f"{label}_{ts}.jpg"
+    buf = io.BytesIO()
+    pil_image.save(buf, 'JPEG')
+    storage.write_bytes(os.path.join(ANNOTATED_FOLDER, annotated_filename), buf.getvalue())
+    return annotated_filename
+
+def class_attendance_status(class_data, recognized_faces):
+    """Present/absent per student of a class from recognized faces."""
+    present = {rf["student_id"] for rf in recognized_faces if class_data['name'] in rf.get("classes", [class_data['name']])}
     student_status = []
     for student in class_data['students']:
-        status = "absent"
-        for rf in recognized_faces:
-            if rf["student_id"] == student["student_id"]:
-                status = "present"
-                break
         student_status.append({
             "student_id": student["student_id"],
             "name": student["name"],
-            "status": status
+            "status": "present" if student["student_id"] in present else "absent"
         })
+    return student_status
+
+def class_result(class_data, recognized_faces):
+    """Per-class part of a recognition result."""
+    student_status = class_attendance_status(class_data, recognized_faces)
+    recognized_count = sum(1 for s in student_status if s["status"] == "present")
 
     # Calculate recognition rate
-    recognition_rate = (len(recognized_faces) / len(class_data['students'])) * 100 if class_data['students'] else 0
+    recognition_rate = (recognized_count / len(class_data['students'])) * 100 if class_data['students'] else 0
 
     return {
-        "class_name": class_name,
+        "class_name": class_data['name'],
         "total_students": len(class_data["students"]),
-        "recognized_count": len(recognized_faces),
-        "unknown_count": len(unknown_faces),
+        "recognized_count": recognized_count,
         "student_status": student_status,
-        "annotated_image": f"annotated/{annotated_filename}",
         "recognition_rate": recognition_rate
     }
 
+def recognize_faces_in_image(class_name, image_path, tolerance=0.5, margin=0.02, tiled=None, profile=None):
+    """
+    Recognize faces in a group image and mark attendance.
+
+    Args:
+        class_name (str): Class identifier
+        image_path (str): Path to uploaded group image
+        tolerance (float): Distance threshold for recognition (lower = stricter)
+        margin (float): Difference required between best and second-best match
+        tiled (bool|str|None): Tiled detection mode, see detect_group_faces
+        profile (str|None): Recognition profile name (default ATTENDANCE_PROFILE)
+    """
+    result = recognize_faces_in_sections([class_name], image_path, tolerance=tolerance, margin=margin,
+                                         tiled=tiled, profile=profile)
+    if "error" in result:
+        return result
+
+    section = result.pop("sections")[0]
+    result.update(section)
+    # the single-class page has always counted recognized faces
+    recognized_count = len(result.pop("recognized_faces"))
+    result["recognized_count"] = recognized_count
+    result["recognition_rate"] = (recognized_count / result["total_students"]) * 100 if result["total_students"] else 0
+    return result
+
+def recognize_faces_in_sections(class_names, image_path, tolerance=0.5, margin=0.02, tiled=None, profile=None):
+    """
+    Recognize faces of a combined session (several classes in one photo).
+
+    Detection and encoding run once; returns per-class results in "sections"
+    plus the shared unknown/skipped counts and annotated image.
+    """
+    classes = []
+    for class_name in class_names:
+        class_data = get_class(class_name)
+        if not class_data:
+            return {"error": f"Class '{class_name}' not found" if len(class_names) > 1 else "Class not found"}
+        classes.append(class_data)
+
+    face_recognition = recognition.load()
+
+    # load group image
+    try:
+        group_image = face_recognition.load_image_file(storage.open_image(image_path))
+    except Exception as e:
+        return {"error": f"Error loading image: {e}"}
+
+    matched = match_sections(classes, group_image, tolerance=tolerance, margin=margin,
+                             tiled=tiled, profile=profile)
+    if matched["skipped_faces"]:
+        logger.info(f"Skipped {len(matched['skipped_faces'])} low-quality face(s) in {image_path}")
+
+    label = class_names[0] if len(class_names) == 1 else "combined"
+    annotated_image = annotate_group_image(group_image, matched, label)
+
+    return {
+        "sections": [class_result(class_data, matched["recognized_faces"]) for class_data in classes],
+        "recognized_faces": matched["recognized_faces"],
+        "unknown_count": len(matched["unknown_faces"]),
+        "skipped_count": len(matched["skipped_faces"]),
+        "skipped_faces": matched["skipped_faces"],
+        "profile": matched["profile"],
+        "profile_mismatch": matched["profile_mismatch"],
+        "annotated_image": annotated_image,
+    }
+
 @app.route('/class/<class_name>/delete', methods=['POST'])
 def delete_class_route(class_name):
     success, message = delete_class(class_name)
@@ -538,7 +1371,6 @@ def save_attendance(class_name, attendance_data, timestamp, present_count):
     
     safe_class_name = class_data['safe_name']
     attendance_dir = os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name)
-    os.makedirs(attendance_dir, exist_ok=True)
     
     # Create filename with timestamp
     date_str = timestamp.strftime("%Y%m%d")
@@ -563,6 +1395,7 @@ def save_attendance(class_name, attendance_data, timestamp, present_count):
     csv_data.append(["Student ID", "Name", "Status"])
     
     # Add student attendance
+    records = []
     for student in class_data['students']:
         status = "absent"
         for att in attendance_data:
@@ -571,65 +1404,148 @@ def save_attendance(class_name, attendance_data, timestamp, present_count):
                 break
         
         csv_data.append([student['student_id'], student['name'], status])
+        records.append({"student_id": student['student_id'], "name": student['name'], "status": status})
     
     # Write CSV file
-    with open(filepath, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerows(csv_data)
+    storage.write_csv(filepath, csv_data)
+    entry = session_entry(filename, timestamp, total_students, present_count)
+    add_to_session_index(safe_class_name, entry)
+    record_changes([{"type": "attendance.saved", "class_name": class_data['name'], "safe_name": safe_class_name,
+                     "session": entry, "records": records}])
     
     return True, f"✅ Attendance saved successfully for {class_name}"
 
-def get_attendance_history(class_name):
-    class_data = get_class(class_name)
-    if not class_data:
-        return []
-    
-    safe_class_name = class_data['safe_name']
+# Session Index
+# attendance_data/<class>/.sessions.json lists every saved session (oldest
+# first) with its counts, so history pages never list the directory or
+# parse filenames.
+SESSION_INDEX = '.sessions.json'
+_session_index_cache = {}
+
+def session_index_path(safe_class_name):
+    return os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name, SESSION_INDEX)
+
+def session_entry(filename, timestamp, total_students, present_count):
+    return {
+        'filename': filename,
+        'timestamp': timestamp.strftime("%Y-%m-%dT%H:%M:%S"),
+        'date': timestamp.strftime("%Y-%m-%d"),
+        'time': timestamp.strftime("%H:%M:%S"),
+        'total': total_students,
+        'present': present_count,
+        'absent': total_students - present_count
+    }
+
+def parse_session_filename(filename):
+    """Timestamp of attendance_<class>_<YYYYmmdd>_<HHMMSS>.csv, or None"""
+    if not (filename.startswith('attendance_') and filename.endswith('.csv')):
+        return None
+    # the class part may itself contain underscores, so split from the right
+    parts = filename[:-len('.csv')].rsplit('_', 2)
+    try:
+        return datetime.strptime(parts[1] + parts[2], "%Y%m%d%H%M%S")
+    except (IndexError, ValueError):
+        return None
+
+def read_session_counts(filepath):
+    """(total, present) from the header rows of a saved session CSV"""
+    header = {}
+    for row in csv.reader(io.StringIO(storage.read_text(filepath))):
+        if row[:3] == ["Student ID", "Name", "Status"]:
+            break
+        if row and ':' in row[0]:
+            key, _, value = row[0].partition(':')
+            header[key.strip()] = value.strip()
+    return int(header.get('Total Students', 0)), int(header.get('Present', 0))
+
+def rebuild_session_index(safe_class_name):
+    """Recreate a class's session index from its attendance CSVs"""
     attendance_dir = os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name)
-    
-    if not os.path.exists(attendance_dir):
+    filenames = [f for f in storage.list(attendance_dir) if parse_session_filename(f)]
+    if not filenames:
+        # classes without sessions (or unknown names) get no index file
         return []
-    
-    attendance_files = []
-    for filename in os.listdir(attendance_dir):
-        if filename.startswith('attendance_') and filename.endswith('.csv'):
-            # Extract date and time from filename
-            parts = filename.split('_')
-            if len(parts) >= 4:
-                date_str = parts[2]
-                time_str = parts[3].split('.')[0]
-                
-                try:
-                    date = datetime.strptime(date_str, "%Y%m%d").strftime("%Y-%m-%d")
-                    time = datetime.strptime(time_str, "%H%M%S").strftime("%H:%M:%S")
-                    
-                    attendance_files.append({
-                        'filename': filename,
-                        'date': date,
-                        'time': time,
-                        'class_name': class_name
-                    })
-                except ValueError:
-                    continue
-    
-    # Sort by date and time (newest first)
-    attendance_files.sort(key=lambda x: (x['date'], x['time']), reverse=True)
-    return attendance_files
+
+    index_path = session_index_path(safe_class_name)
+    with storage.lock(index_path):
+        sessions = []
+        for filename in filenames:
+            try:
+                total, present = read_session_counts(os.path.join(attendance_dir, filename))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping {filename} in session index rebuild: {e}")
+                continue
+            sessions.append(session_entry(filename, parse_session_filename(filename), total, present))
+        sessions.sort(key=lambda s: s['timestamp'])
+        storage.write_json(index_path, {'sessions': sessions})
+    return sessions
+
+def load_session_index(safe_class_name):
+    """Sessions of a class, oldest first; rebuilt from the CSVs if missing"""
+    index_path = session_index_path(safe_class_name)
+    version = file_version(index_path)
+    if version == "0":
+        return rebuild_session_index(safe_class_name)
+    cached = _session_index_cache.get(safe_class_name)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    try:
+        sessions = storage.read_json(index_path)['sessions']
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Session index of {safe_class_name} unreadable, rebuilding: {e}")
+        return rebuild_session_index(safe_class_name)
+
+    _session_index_cache[safe_class_name] = (version, sessions)
+    return sessions
+
+def add_to_session_index(safe_class_name, entry):
+    """Insert (or replace) one session in the class's index"""
+    load_session_index(safe_class_name)
+    index_path = session_index_path(safe_class_name)
+    with storage.lock(index_path):
+        try:
+            sessions = storage.read_json(index_path)['sessions']
+        except (OSError, ValueError, KeyError):
+            sessions = []
+        sessions = [s for s in sessions if s['filename'] != entry['filename']]
+        sessions.append(entry)
+        sessions.sort(key=lambda s: s['timestamp'])
+        storage.write_json(index_path, {'sessions': sessions})
+
+@app.cli.command('rebuild-session-index')
+def rebuild_session_index_command():
+    """Rebuild the attendance session index of every class."""
+    for safe_class_name in get_all_classes():
+        sessions = rebuild_session_index(safe_class_name)
+        print(f"{safe_class_name}: {len(sessions)} sessions")
+
+def get_attendance_history(class_name, date_from=None, date_to=None):
+    """Sessions of a class (newest first), optionally between two YYYY-MM-DD dates"""
+    sessions = load_session_index(get_safe_name(class_name))
+    return [dict(session, class_name=class_name) for session in reversed(sessions)
+            if (not date_from or session['date'] >= date_from) and (not date_to or session['date'] <= date_to)]
 
 # NEW API ROUTES
 @app.route('/api/attendance-stats/<class_name>')
 def attendance_stats(class_name):
     """API endpoint for chart data"""
     ensure_attendance_csv_exists()
-    csv_file = "attendance_data/overall_attendance.csv"
+    # the ledger and this class's file: roster writes to other classes keep this ETag,
+    # but the ledger is shared, so attendance logged for any class changes it
+    version = f"{file_version(OVERALL_ATTENDANCE_CSV)}/{file_version(class_file_path(class_name))}"
+    return cached_json_response(("attendance-stats", get_safe_name(class_name), class_name), version,
+                                lambda: build_attendance_stats(class_name))
+
+def build_attendance_stats(class_name):
+    """Last 10 attendance rates for a class, shaped for Chart.js"""
+    csv_file = OVERALL_ATTENDANCE_CSV
     
     records = []
     try:
-        with open(csv_file, "r") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row["class_name"] == class_name:
-                    records.append(row)
+        for row in csv.DictReader(io.StringIO(storage.read_text(csv_file))):
+            if row["class_name"] == class_name:
+                records.append(row)
     except Exception as e:
         logger.warning(f"Error reading overall_attendance: {e}")
 
@@ -673,30 +1589,28 @@ def attendance_stats(class_name):
         }]
     }
     
-    return jsonify(data)
+    return data
 
 @app.route('/api/class-overview')
 def class_overview():
     """API endpoint for dashboard overview"""
-    classes = get_all_classes()
-    
-    # Calculate actual statistics
-    total_students = 0
-    for class_name in classes:
-        class_data = get_class(class_name)
-        if class_data:
-            total_students += len(class_data.get('students', []))
-            
     ensure_attendance_csv_exists()
-    csv_file = "attendance_data/overall_attendance.csv"
+    load_class_manifest()
+    version = f"{file_version(OVERALL_ATTENDANCE_CSV)}/{file_version(CLASS_MANIFEST)}"
+    return cached_json_response(("class-overview",), version, build_class_overview)
+
+def build_class_overview():
+    """Class/student totals and overall attendance rate"""
+    classes = get_class_summaries()
+    total_students = sum(c['student_count'] for c in classes)
+            
+    csv_file = OVERALL_ATTENDANCE_CSV
     sum_students = 0
     sum_present = 0
     try:
-        with open(csv_file, "r") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                sum_students += int(row["total_students"])
-                sum_present += int(row["present"])
+        for row in csv.DictReader(io.StringIO(storage.read_text(csv_file))):
+            sum_students += int(row["total_students"])
+            sum_present += int(row["present"])
     except Exception as e:
         logger.warning(f"Error reading overall_attendance.csv: {e}")
         
@@ -708,21 +1622,73 @@ def class_overview():
         'attendance_rate': actual_rate
     }
     
-    return jsonify(overview)
+    return overview
+
+@app.route('/api/class-roster/<class_name>')
+def class_roster(class_name):
+    """API endpoint for one page of a class roster, optionally filtered by ?q="""
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(max(1, request.args.get('per_page', ROSTER_PAGE_SIZE, type=int)), ROSTER_MAX_PAGE_SIZE)
+
+    version = file_version(class_file_path(class_name))
+    if version == "0":
+        return jsonify({"error": "Class not found"}), 404
+    return cached_json_response(("class-roster", get_safe_name(class_name), class_name, page, per_page, query),
+                                version,
+                                lambda: build_class_roster(class_name, query, page, per_page, version))
+
+def build_class_roster(class_name, query, page, per_page, version):
+    """Students matching query (name or ID) on one page, read from the roster projection"""
+    roster = load_class_roster(class_name, version) or {'students': []}
+    safe_class_name = get_safe_name(class_name)
+    needle = query.lower()
+    students = [s for s in roster['students']
+                if not needle or needle in s['student_id'].lower() or needle in s['name'].lower()]
+
+    start = (page - 1) * per_page
+    rows = []
+    for student in students[start:start + per_page]:
+        photo = f"{safe_class_name}/{student['photo']}" if student['photo'] else None
+        rows.append({
+            'student_id': student['student_id'],
+            'name': student['name'],
+            'photo_count': student['photo_count'],
+            'encoding_count': student['encoding_count'],
+            'thumbnail': url_for('known_face_thumbnail', size=128, filename=photo) if photo else None,
+        })
+
+    return {
+        'class_name': class_name,
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'total': len(students),
+        'next_page': page + 1 if start + per_page < len(students) else None,
+        'students': rows,
+    }
+
+@app.route('/api/changes')
+def changes():
+    """API endpoint for the change feed after cursor ?since= (see changefeed.py)"""
+    since = max(0, request.args.get('since', 0, type=int))
+    limit = min(max(1, request.args.get('limit', CHANGE_FEED_PAGE_SIZE, type=int)), CHANGE_FEED_MAX_PAGE_SIZE)
+    try:
+        page = changefeed.read_changes(storage, CHANGE_FEED_FOLDER, since, limit)
+    except changefeed.CursorExpired as e:
+        return jsonify({"error": f"Cursor {since} has expired ({e}); resync and continue from latest",
+                        "latest": changefeed.latest_seq(storage, CHANGE_FEED_FOLDER)}), 410
+    return jsonify(dict(page, since=since))
 
 # Flask Routes - UPDATED INDEX ROUTE
 @app.route('/')
 def index():
     # NEW: Calculate dynamic stats
-    classes = get_all_classes()
+    classes = get_class_summaries()
     active_classes = len(classes)
     
     # Calculate total students across all classes
-    total_students_all = 0
-    for class_name in classes:
-        class_data = get_class(class_name)
-        if class_data:
-            total_students_all += len(class_data.get('students', []))
+    total_students_all = sum(c['student_count'] for c in classes)
     
     # Get today's attendance summary
     try:
@@ -778,18 +1744,16 @@ def create_class_route():
 
 @app.route('/class/<class_name>')
 def class_detail(class_name):
-    class_data = get_class(class_name)
-    if not class_data:
+    # the roster itself is fetched page by page from /api/class-roster
+    class_summary = load_class_manifest().get(get_safe_name(class_name))
+    if not class_summary:
         flash('❌ Class not found', 'error')
         return redirect(url_for('add_data'))
     
-    # Calculate how many empty rows to show (at least 5)
-    empty_rows = max(5, 10 - len(class_data['students']))
-    
     return render_template('class_detail.html', 
                          class_name=class_name, 
-                         class_data=class_data,
-                         empty_rows=empty_rows)
+                         class_summary=class_summary,
+                         page_size=ROSTER_PAGE_SIZE)
 
 @app.route('/class/<class_name>/add_students', methods=['POST'])
 def add_students_route(class_name):
@@ -828,7 +1792,10 @@ def add_students_route(class_name):
     # 2️⃣ Collect uploaded files (FIXED)
     # -------------------------------
     photo_files = {}
-    for file_key in request.files:
+    # photos arrive as files or, from upload.js, as chunked upload ids in "<field>_upload"
+    photo_fields = {key[:-len('_upload')] if key.endswith('_upload') else key
+                    for key in list(request.files) + list(request.form)}
+    for file_key in photo_fields:
         if not file_key.startswith('student_') or not file_key.endswith('_photos'):
             continue
             
@@ -841,8 +1808,8 @@ def add_students_route(class_name):
         except ValueError:
             continue
 
-        files = request.files.getlist(file_key)
-        valid_files = [f for f in files if f and f.filename and allowed_file(f.filename)]
+        files = request_files(file_key)
+        valid_files = [f for f in files if allowed_file(f.filename)]
         if valid_files:
             photo_files[idx] = valid_files
             logger.info(f"Files received for row {idx}: {[f.filename for f in valid_files]}")
@@ -918,6 +1885,87 @@ def add_students_route(class_name):
     return redirect(url_for('class_detail', class_name=class_name))
 
 
+@app.route('/class/<class_name>/import', methods=['POST'])
+def import_students_route(class_name):
+    roster = next(iter(request_files('roster')), None)
+    photos = next(iter(request_files('photos')), None)
+    if roster is None or not roster.filename.lower().endswith('.csv'):
+        flash('❌ Please choose a roster CSV file', 'error')
+        return redirect(url_for('class_detail', class_name=class_name))
+    if photos is not None and not photos.filename.lower().endswith('.zip'):
+        flash('❌ Photos must be uploaded as a ZIP file', 'error')
+        return redirect(url_for('class_detail', class_name=class_name))
+
+    success, result = import_students(class_name, roster.stream, photos.stream if photos else None)
+    if not success:
+        flash(f'❌ {result}', 'error')
+        return redirect(url_for('class_detail', class_name=class_name))
+
+    flash(f"✅ {result['message']}", 'success' if not result['problems'] else 'warning')
+    return render_template('import_result.html', class_name=class_name, result=result)
+
+@app.route('/class/<class_name>/enroll_from_group', methods=['GET', 'POST'])
+def enroll_from_group(class_name):
+    class_data = get_class(class_name)
+    if not class_data:
+        flash('❌ Class not found', 'error')
+        return redirect(url_for('add_data'))
+
+    if request.method == 'POST':
+        files = [f for f in request.files.getlist('group_photos') if f and f.filename and allowed_file(f.filename)]
+        if not files:
+            flash('📸 Please upload one or two class photos', 'error')
+            return redirect(url_for('enroll_from_group', class_name=class_name))
+
+        token, message = detect_enrollment_faces(class_name, files[:2])
+        if not token:
+            flash(f'❌ {message}', 'error')
+            return redirect(url_for('enroll_from_group', class_name=class_name))
+        flash(f'🔍 {message}. Assign each face to a student.', 'info')
+        return redirect(url_for('assign_group_faces', class_name=class_name, token=token))
+
+    return render_template('group_enroll.html', class_name=class_name, class_data=class_data, enrollment=None)
+
+@app.route('/class/<class_name>/enroll_from_group/<token>', methods=['GET', 'POST'])
+def assign_group_faces(class_name, token):
+    session = load_enrollment_session(class_name, token)
+    if not session:
+        flash('⏰ Enrollment session expired, please upload the photos again', 'warning')
+        return redirect(url_for('enroll_from_group', class_name=class_name))
+
+    if request.method == 'POST':
+        assignments = {}
+        for key in request.form:
+            if key.startswith('face_') and request.form[key]:
+                try:
+                    assignments[int(key.split('_', 1)[1])] = request.form[key]
+                except ValueError:
+                    continue
+
+        duplicates = {sid for sid in assignments.values() if list(assignments.values()).count(sid) > 1}
+        if duplicates:
+            flash(f"⚠️ Each student can be assigned only one face: {', '.join(sorted(duplicates))}", 'warning')
+            return redirect(url_for('assign_group_faces', class_name=class_name, token=token))
+
+        success, message = assign_enrollment_faces(class_name, token, assignments)
+        flash(message if success else f'❌ {message}', 'success' if success else 'error')
+        if success:
+            return redirect(url_for('class_detail', class_name=class_name))
+        return redirect(url_for('assign_group_faces', class_name=class_name, token=token))
+
+    return render_template('group_enroll.html', class_name=class_name, class_data=get_class(class_name),
+                           enrollment=session, token=token)
+
+@app.route('/class/<class_name>/enroll_from_group/<token>/face/<int:face_id>')
+def group_face_crop(class_name, token, face_id):
+    session_dir = enrollment_session_dir(token)
+    if not session_dir:
+        abort(404)
+    try:
+        return send_file(storage.local_path(os.path.join(session_dir, f"face_{face_id}.jpg")))
+    except FileNotFoundError:
+        abort(404)
+
 # New route to generate encodings for a class
 @app.route('/class/<class_name>/generate_encodings')
 def generate_encodings_route(class_name):
@@ -934,12 +1982,8 @@ def generate_encodings_route(class_name):
 def delete_student_route(class_name, student_id):
     success, message = delete_student(class_name, student_id)
     if success:
+        # the other students' templates are unchanged; galleries rebuild from the new class version
         flash(f'✅ {message}', 'success')
-        # optional: regenerate encodings for class
-        try:
-            generate_class_encodings(class_name)
-        except Exception as e:
-            logger.warning(f"Re-encoding failed: {e}")
     else:
         flash(f'❌ {message}', 'error')
 
@@ -958,10 +2002,52 @@ def attendance():
     classes = get_all_classes()
     return render_template('attendance_upload.html', classes=classes)
 
+@app.route('/uploads', methods=['POST'])
+def start_chunked_upload():
+    """Open a resumable upload (see chunked_upload.py)."""
+    payload = request.get_json(silent=True) or {}
+    filename = str(payload.get('filename', ''))
+    try:
+        size = int(payload.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+    limits = upload_limits(str(payload.get('kind') or 'image'))
+    if limits is None:
+        return jsonify({"error": "Unknown upload kind"}), 400
+    extensions, max_size = limits
+    if not allowed_file(filename, extensions):
+        if extensions == ALLOWED_EXTENSIONS:
+            return jsonify({"error": "Please upload a valid image file"}), 400
+        return jsonify({"error": f"Please upload a {' or '.join(sorted(extensions))} file"}), 400
+
+    chunked_upload.purge_uploads(storage, CHUNKED_UPLOAD_FOLDER, CHUNKED_UPLOAD_MAX_AGE)
+    upload_id, message = chunked_upload.create_upload(storage, CHUNKED_UPLOAD_FOLDER, filename, size, max_size)
+    if not upload_id:
+        return jsonify({"error": message}), 400
+    return jsonify({"upload_id": upload_id, "offset": 0, "chunk_size": CHUNKED_UPLOAD_CHUNK_SIZE}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT'])
+def chunked_upload_route(upload_id):
+    if request.method == 'GET':
+        status = chunked_upload.upload_status(storage, CHUNKED_UPLOAD_FOLDER, upload_id)
+        if status is None:
+            return jsonify({"error": "Upload not found"}), 404
+        return jsonify(status)
+
+    offset = request.args.get('offset', type=int)
+    data = request.get_data(cache=False)
+    if offset is None or len(data) > CHUNKED_UPLOAD_CHUNK_SIZE:
+        return jsonify({"error": f"Send chunks of at most {CHUNKED_UPLOAD_CHUNK_SIZE} bytes with ?offset="}), 400
+
+    success, status = chunked_upload.append_chunk(storage, CHUNKED_UPLOAD_FOLDER, upload_id, offset, data)
+    if status is None:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(status), 200 if success else 409
+
 @app.route('/attendance/<class_name>', methods=['GET', 'POST'])
 def take_attendance(class_name):
     if request.method == 'POST':
-        file = request.files.get('group_photo')
+        file = next(iter(request_files('group_photo')), None)
         if not file or not allowed_file(file.filename):
             flash('📸 Please upload a valid image file', 'error')
             return redirect(url_for('attendance'))
@@ -972,9 +2058,10 @@ def take_attendance(class_name):
 
         ext = file.filename.rsplit('.', 1)[1].lower()
         unique_name = f"group_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_name)
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        file.save(filepath)
+        # one folder per class so archived uploads can be re-processed (reprocess.py)
+        upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], get_safe_name(class_name))
+        filepath = os.path.join(upload_dir, unique_name)
+        storage.write_bytes(filepath, file.read())
 
         # Recognize faces in the image
         result = recognize_faces_in_image(class_name, filepath, tolerance=MATCH_THRESHOLD)
@@ -994,6 +2081,9 @@ def take_attendance(class_name):
             flash_message = f"🔍 Low recognition. Please check photo quality"
         
         flash(flash_message, 'info')
+        if result.get('profile_mismatch'):
+            flash("⚠️ Some students were enrolled with a different encoder profile. "
+                  "Regenerate the class encodings for best accuracy.", 'warning')
 
         # Render result page
         return render_template(
@@ -1005,6 +2095,66 @@ def take_attendance(class_name):
     # GET request - show upload page
     return render_template("attendance_upload.html", class_name=class_name)
 
+@app.route('/attendance/combined', methods=['POST'])
+def take_combined_attendance():
+    """One group photo, several classes (exams, merged lectures)."""
+    class_names = [c for c in request.form.getlist('class_names') if c]
+    file = next(iter(request_files('group_photo')), None)
+    if len(class_names) < 2:
+        flash('🎯 Please select at least two classes for a combined session', 'error')
+        return redirect(url_for('attendance'))
+    if not file or not allowed_file(file.filename):
+        flash('📸 Please upload a valid image file', 'error')
+        return redirect(url_for('attendance'))
+
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    unique_name = f"group_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}.{ext}"
+    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'combined')
+    filepath = os.path.join(upload_dir, unique_name)
+    storage.write_bytes(filepath, file.read())
+
+    result = recognize_faces_in_sections(class_names, filepath, tolerance=MATCH_THRESHOLD)
+    if 'error' in result:
+        flash(f'❌ Error: {result["error"]}', 'error')
+        return redirect(url_for('attendance'))
+
+    flash(f"🎯 {len(result['recognized_faces'])} student(s) recognized across {len(class_names)} classes", 'info')
+    if result.get('profile_mismatch'):
+        flash("⚠️ Some students were enrolled with a different encoder profile. "
+              "Regenerate the class encodings for best accuracy.", 'warning')
+    return render_template("attendance_combined_result.html", result=result)
+
+@app.route('/attendance/combined/save', methods=['POST'])
+def save_combined_attendance_route():
+    """Save one session (and one log_attendance entry) per class."""
+    class_names = request.form.getlist('class_names')
+    timestamp = datetime.now()
+    saved = []
+
+    for index, class_name in enumerate(class_names):
+        class_data = get_class(class_name)
+        if not class_data:
+            flash(f'❌ Class {class_name} not found', 'error')
+            continue
+
+        prefix = f"status_{index}_"
+        attendance_data = [
+            {'student_id': key[len(prefix):], 'status': request.form.get(key)}
+            for key in request.form if key.startswith(prefix)
+        ]
+        present_count = sum(1 for a in attendance_data if a['status'] == 'present')
+
+        log_attendance(class_name, len(class_data.get('students', [])), present_count)
+        success, message = save_attendance(class_name, attendance_data, timestamp, present_count)
+        if success:
+            saved.append(class_name)
+        else:
+            flash(f'❌ {message}', 'error')
+
+    if saved:
+        flash(f"✅ Attendance saved for {', '.join(saved)}", 'success')
+    return redirect(url_for('attendance'))
+
 # UPDATED SAVE ATTENDANCE ROUTE WITH STATS LOGGING
 @app.route('/attendance/<class_name>/save', methods=['POST'])
 def save_attendance_route(class_name):
@@ -1033,52 +2183,187 @@ def save_attendance_route(class_name):
     success, message = save_attendance(class_name, attendance_data, timestamp, present_count)
     
     if success:
+        sync_student_index()
         flash(f'✅ {message}', 'success')
         return redirect(url_for('attendance_history', class_name=class_name))
     else:
         flash(f'❌ {message}', 'error')
         return redirect(url_for('take_attendance', class_name=class_name))
 
+def parse_history_date(value):
+    """A YYYY-MM-DD filter value, or None if empty or malformed"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+def history_page_context(class_name):
+    """Template variables for one page of the attendance history (?page=&from=&to=)"""
+    date_from = parse_history_date(request.args.get('from', ''))
+    date_to = parse_history_date(request.args.get('to', ''))
+    sessions = get_attendance_history(class_name, date_from, date_to)
+
+    pages = max(1, -(-len(sessions) // HISTORY_PAGE_SIZE))
+    page = min(max(1, request.args.get('page', 1, type=int)), pages)
+    start = (page - 1) * HISTORY_PAGE_SIZE
+    history_args = {key: value for key, value in (('from', date_from), ('to', date_to)) if value}
+    return {
+        'class_name': class_name,
+        'attendance_files': sessions[start:start + HISTORY_PAGE_SIZE],
+        'matching_sessions': len(sessions),
+        'total_sessions': len(load_session_index(get_safe_name(class_name))),
+        'page': page,
+        'pages': pages,
+        'date_from': date_from or '',
+        'date_to': date_to or '',
+        'history_args': history_args,
+    }
+
 @app.route('/attendance/<class_name>/history')
 def attendance_history(class_name):
-    attendance_files = get_attendance_history(class_name)
-    return render_template('attendance_history.html', 
-                         class_name=class_name,
-                         attendance_files=attendance_files)
+    return render_template('attendance_history.html', **history_page_context(class_name))
 
 @app.route('/download_attendance/<class_name>/<filename>')
 def download_attendance(class_name, filename):
     safe_class_name = get_safe_name(class_name)
-    filepath = os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name, filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, as_attachment=True)
-    else:
+    filepath = safe_join(ATTENDANCE_DATA_FOLDER, safe_class_name, filename)
+    try:
+        if filepath is None:
+            raise FileNotFoundError(filename)
+        return send_file(storage.local_path(filepath), as_attachment=True, download_name=filename)
+    except FileNotFoundError:
         flash('❌ File not found', 'error')
         return redirect(url_for('attendance_history', class_name=class_name))
 
+def export_classes(class_names, date_from=None, date_to=None):
+    """ExportClass per class (all classes if none named) with its sessions in the date range.
+
+    Raises KeyError for an unknown class. Rosters are only loaded when the
+    export reaches that class.
+    """
+    classes = load_class_manifest()
+    safe_names = [get_safe_name(name) for name in class_names] or sorted(classes)
+    for name, safe_name in zip(class_names, safe_names):
+        if safe_name not in classes:
+            raise KeyError(name)
+
+    def roster(safe_name):
+        class_data = get_class(safe_name) or {'students': []}
+        return [(s['student_id'], s['name']) for s in class_data['students']]
+
+    return [export.ExportClass(classes[safe_name]['name'], safe_name,
+                               [s for s in load_session_index(safe_name)
+                                if (not date_from or s['date'] >= date_from) and (not date_to or s['date'] <= date_to)],
+                               lambda safe_name=safe_name: roster(safe_name))
+            for safe_name in safe_names]
+
+# Student Index
+# cache/student_index.sqlite3 keeps present/total counters per student and
+# class across the institution; it follows the change feed (see
+# student_index.py).
+def student_index_history():
+    """(safe_name, class_name, filename, date, records) of every saved session, for a rebuild"""
+    for export_class in export_classes([]):
+        for _, session, text in export.session_files(storage, ATTENDANCE_DATA_FOLDER, export_class):
+            yield (export_class.safe_name, export_class.name, session['filename'], session['date'],
+                   export.read_session(text))
+
+def sync_student_index():
+    """Bring the student index up to date with the change feed; failures only delay it."""
+    try:
+        with closing(student_index.connect(STUDENT_INDEX_PATH)) as conn:
+            counted = student_index.sync(conn, storage, CHANGE_FEED_FOLDER, student_index_history)
+        if counted:
+            logger.info(f"Student index: counted {counted} sessions")
+    except Exception as e:
+        logger.error(f"Could not update the student index: {e}")
+
+def rebuild_student_index():
+    """Recount the student index from the session history; returns the sessions counted"""
+    feed_seq = changefeed.latest_seq(storage, CHANGE_FEED_FOLDER)
+    feed_lost = changefeed.lost_version(storage, CHANGE_FEED_FOLDER)
+    with closing(student_index.connect(STUDENT_INDEX_PATH)) as conn:
+        return student_index.rebuild(conn, student_index_history(), feed_seq, feed_lost)
+
+@app.cli.command('rebuild-student-index')
+def rebuild_student_index_command():
+    """Rebuild the cross-class student attendance index from the session history."""
+    print(f"Student index rebuilt from {rebuild_student_index()} sessions")
+
+@app.route('/api/student-attendance')
+def student_attendance():
+    """API endpoint for students below ?below= percent across ?class= (repeatable, default all) between ?from= and ?to="""
+    threshold = request.args.get('below', STUDENT_INDEX_THRESHOLD, type=float)
+    classes = request.args.getlist('class')
+    date_from = parse_history_date(request.args.get('from', ''))
+    date_to = parse_history_date(request.args.get('to', ''))
+
+    sync_student_index()
+    with closing(student_index.connect(STUDENT_INDEX_PATH)) as conn:
+        students = student_index.below_threshold(conn, threshold, [get_safe_name(name) for name in classes],
+                                                 date_from, date_to)
+    return jsonify({
+        'below': threshold,
+        'classes': classes,
+        'from': date_from,
+        'to': date_to,
+        'count': len(students),
+        'students': students,
+    })
+
+@app.route('/export')
+def export_attendance():
+    """Stream attendance of ?class= (repeatable, default all) between ?from= and ?to="""
+    layout = request.args.get('layout', 'wide')
+    fmt = request.args.get('format', 'csv')
+    if layout not in export.LAYOUTS or fmt not in export.FORMATS:
+        return jsonify({"error": f"layout must be one of {', '.join(export.LAYOUTS)} "
+                                 f"and format one of {', '.join(export.FORMATS)}"}), 400
+    try:
+        classes = export_classes(request.args.getlist('class'),
+                                 parse_history_date(request.args.get('from', '')),
+                                 parse_history_date(request.args.get('to', '')))
+    except KeyError as e:
+        return jsonify({"error": f"Class {e} not found"}), 404
+
+    name = 'sessions' if fmt == 'zip' else layout
+    filename = f"attendance_{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    logger.info(f"Exporting {sum(len(c.sessions) for c in classes)} sessions of {len(classes)} classes as {filename}")
+    return app.response_class(export.export_stream(storage, ATTENDANCE_DATA_FOLDER, classes, layout, fmt),
+                              mimetype=export.MIMETYPES[fmt],
+                              headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 # New route to view attendance table
 @app.route('/attendance/<class_name>/view/<filename>')
 def view_attendance_table(class_name, filename):
     safe_class_name = get_safe_name(class_name)
-    filepath = os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name, filename)
+    # only indexed sessions can be opened, which also rules out path tricks
+    session = next((s for s in load_session_index(safe_class_name) if s['filename'] == filename), None)
 
     table_data = []
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as f:
-            reader = csv.reader(f)
-            table_data = list(reader)
+    if session is not None:
+        try:
+            table_data = list(csv.reader(io.StringIO(
+                storage.read_text(os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name, filename)))))
+        except FileNotFoundError:
+            pass
+    if not table_data:
+        flash('❌ Attendance record not found', 'error')
+        return redirect(url_for('attendance_history', class_name=class_name, **request.args))
 
     return render_template('attendance_history.html',
-                           class_name=class_name,
-                           attendance_files=get_attendance_history(class_name),
                            table_data=table_data,
-                           selected_file=filename)
+                           selected_file=filename,
+                           selected_session=session,
+                           **history_page_context(class_name))
 
 @app.context_processor
 def utility_processor():
     def get_class_data(class_name):
         return get_class(class_name)
-    return dict(get_class_data=get_class_data)
+    def get_class_summary(class_name):
+        return load_class_manifest().get(get_safe_name(class_name))
+    return dict(get_class_data=get_class_data, get_class_summary=get_class_summary)
 
 # Add this route to your app.py
 @app.route('/class_report/<class_name>')
@@ -1089,11 +2374,12 @@ def class_report(class_name):
         flash("❌ Class not found", "error")
         return redirect(url_for("add_data"))
     
-    # Get attendance files for this class
+    # Get attendance sessions for this class
     safe_class_name = class_data['safe_name']
     attendance_dir = os.path.join(ATTENDANCE_DATA_FOLDER, safe_class_name)
+    sessions = load_session_index(safe_class_name)
     
-    if not os.path.exists(attendance_dir):
+    if not sessions:
         flash("ℹ️ No attendance records found for this class.", "warning")
         return redirect(url_for("class_detail", class_name=class_name))
     
@@ -1102,52 +2388,42 @@ def class_report(class_name):
     total_classes = 0
     
     # Process each attendance file
-    for filename in os.listdir(attendance_dir):
-        if filename.startswith('attendance_') and filename.endswith('.csv'):
-            total_classes += 1
-            filepath = os.path.join(attendance_dir, filename)
-            
-            # Extract date from filename
-            parts = filename.split('_')
-            if len(parts) >= 4:
-                date_str = parts[2]  # Date is in YYYYMMDD format
-                try:
-                    date_obj = datetime.strptime(date_str, "%Y%m%d")
-                    formatted_date = date_obj.strftime("%Y-%m-%d")
-                except:
-                    formatted_date = date_str
-            else:
-                formatted_date = "Unknown Date"
-            
-            # Read CSV file
-            with open(filepath, 'r') as f:
-                reader = csv.reader(f)
-                rows = list(reader)
-                
-                # Skip header rows (first 8 rows)
-                if len(rows) > 8:
-                    for row in rows[8:]:
-                        if len(row) >= 3:
-                            student_id = row[0]
-                            name = row[1]
-                            status = row[2].lower()
-                            
-                            # Initialize student if not exists
-                            if student_id not in students_summary:
-                                students_summary[student_id] = {
-                                    'id': student_id,
-                                    'name': name,
-                                    'present_days': 0,
-                                    'absent_days': 0,
-                                    'absent_dates': []
-                                }
-                            
-                            # Update counts
-                            if status == 'present':
-                                students_summary[student_id]['present_days'] += 1
-                            else:
-                                students_summary[student_id]['absent_days'] += 1
-                                students_summary[student_id]['absent_dates'].append(formatted_date)
+    for session in sessions:
+        filepath = os.path.join(attendance_dir, session['filename'])
+        formatted_date = session['date']
+        
+        # Read CSV file
+        try:
+            rows = list(csv.reader(io.StringIO(storage.read_text(filepath))))
+        except FileNotFoundError:
+            logger.warning(f"Indexed session {session['filename']} is missing; run flask rebuild-session-index")
+            continue
+        total_classes += 1
+        
+        # Skip header rows (first 8 rows)
+        if len(rows) > 8:
+            for row in rows[8:]:
+                if len(row) >= 3:
+                    student_id = row[0]
+                    name = row[1]
+                    status = row[2].lower()
+                    
+                    # Initialize student if not exists
+                    if student_id not in students_summary:
+                        students_summary[student_id] = {
+                            'id': student_id,
+                            'name': name,
+                            'present_days': 0,
+                            'absent_days': 0,
+                            'absent_dates': []
+                        }
+                    
+                    # Update counts
+                    if status == 'present':
+                        students_summary[student_id]['present_days'] += 1
+                    else:
+                        students_summary[student_id]['absent_days'] += 1
+                        students_summary[student_id]['absent_dates'].append(formatted_date)
     
     # Calculate percentage for each student
     for student in students_summary.values():
@@ -1165,11 +2441,63 @@ def class_report(class_name):
 
 @app.route('/known_faces/<path:filename>')
 def known_faces(filename):
-    # Base folder where all class folders are stored
-    base_dir = os.path.join(app.root_path, 'known_faces')  # change 'known_faces' if your folder is named differently
-
     # Safely serve the requested file
-    return send_from_directory(base_dir, filename)
+    photo_path = safe_join(KNOWN_FACES_FOLDER, filename)
+    if photo_path is None:
+        abort(404)
+    try:
+        return send_file(storage.local_path(photo_path))
+    except FileNotFoundError:
+        abort(404)
+
+@app.route('/annotated/<path:filename>')
+def annotated_image(filename):
+    """Annotated group photos, wherever the storage backend keeps them"""
+    image_path = safe_join(ANNOTATED_FOLDER, filename)
+    if image_path is None:
+        abort(404)
+    try:
+        return send_file(storage.local_path(image_path))
+    except FileNotFoundError:
+        abort(404)
+
+@app.route('/thumbnails/<int:size>/<path:filename>')
+def known_face_thumbnail(size, filename):
+    """Face-cropped, resized copy of a known_faces photo with HTTP caching"""
+    if size not in THUMBNAIL_SIZES:
+        abort(404)
+
+    source_path = safe_join(KNOWN_FACES_FOLDER, filename)
+    if source_path is None:
+        abort(404)
+    try:
+        source_path = storage.local_path(source_path)
+    except FileNotFoundError:
+        abort(404)
+
+    fmt = 'webp' if thumbnails.webp_supported() and 'image/webp' in request.accept_mimetypes else 'jpeg'
+
+    # Answer revalidations without rendering anything
+    thumb_path, etag = thumbnails.lookup_thumbnail(source_path, size, fmt, THUMBNAIL_CACHE_FOLDER)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        try:
+            if thumb_path is None:
+                thumb_path, etag = thumbnails.get_thumbnail(source_path, size, fmt, THUMBNAIL_CACHE_FOLDER)
+        except Exception as e:
+            logger.warning(f"Thumbnail generation failed for {filename}: {e}")
+            return redirect(url_for('known_faces', filename=filename))
+        response = send_file(thumb_path, mimetype=thumbnails.FORMATS[fmt][1], conditional=False, etag=False)
+
+    # Centre crops are replaced by face crops when the photo is enrolled again
+    # or `flask prerender-thumbnails` runs, so only face crops get the long max-age
+    response.set_etag(etag)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = THUMBNAIL_MAX_AGE if etag.endswith('-face') else min(THUMBNAIL_MAX_AGE, 3600)
+    response.vary.add('Accept')
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Change feed.
+
+Every attendance commit and roster change is appended to an event log, so
+other systems can sync what changed instead of re-reading every session:
+
+    GET /api/changes?since=<seq>&limit=500   -> {"changes": [...], "next": <seq>, "more": bool}
+
+    python changefeed.py status
+    python changefeed.py compact --keep-days 90      # or --before <seq>
+
+Events are JSON lines with a sequence number that only ever grows:
+
+    {"seq": 42, "time": "2025-09-01T09:05:13", "type": "attendance.saved", "class_name": "CSE-22", ...}
+
+A client stores the "next" of each response and passes it back as since; a
+page never holds an event twice or skips one. The log is split into
+segments of SEGMENT_EVENTS events named after their first sequence number
+(<folder>/000000000001.jsonl), so a read starts at the right segment and
+compaction just deletes whole old segments. A cursor older than the first
+segment left is answered with 410 and the latest sequence number; the
+client resyncs in full (e.g. with export.py) and follows the feed from
+there.
+
+Appends take the storage lock of the feed (see storage.py), so app nodes
+sharing a storage backend share one sequence. Events that could not be
+appended are noted in <folder>/lost.json (mark_lost); followers such as
+the student index resync in full when that marker changes.
+"""
+import os
+import re
+import json
+import time
+import argparse
+from datetime import datetime
+
+SEGMENT_EVENTS = 1000
+
+LOST_MARKER = 'lost.json'
+
+_SEGMENT = re.compile(r'^(\d{12})\.jsonl$')
+
+
+class CursorExpired(Exception):
+    """The events after a cursor have been compacted away."""
+
+
+def _segment_key(folder, first_seq):
+    return os.path.join(folder, f"{first_seq:012d}.jsonl")
+
+
+def _segments(store, folder):
+    """First sequence numbers of the segments, oldest first."""
+    return sorted(int(m.group(1)) for m in map(_SEGMENT.match, store.list(folder)) if m)
+
+
+def _parse(data):
+    """Events of a segment; a line torn by a crash mid-append is skipped."""
+    events = []
+    for line in data.splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events
+
+
+def _read_segment(store, folder, first_seq):
+    try:
+        return store.read_bytes(_segment_key(folder, first_seq))
+    except FileNotFoundError:
+        return b""  # compacted while we were reading
+
+
+def append(store, folder, events, segment_events=SEGMENT_EVENTS):
+    """Number and append events (dicts with a "type"); returns their sequence numbers."""
+    if not events:
+        return []
+    with store.lock(os.path.join(folder, 'feed')):
+        segments = _segments(store, folder)
+        if segments:
+            first_seq = segments[-1]
+            data = _read_segment(store, folder, first_seq)
+            current = _parse(data)
+            last_seq = current[-1]['seq'] if current else first_seq - 1
+            if data and not data.endswith(b"\n"):
+                # drop a torn tail so the next line does not run into it
+                store.write_bytes(_segment_key(folder, first_seq),
+                                  b"".join(json.dumps(e).encode('utf-8') + b"\n" for e in current))
+            if len(current) >= segment_events:
+                first_seq = last_seq + 1
+        else:
+            first_seq, last_seq = 1, 0
+
+        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        lines = []
+        for offset, event in enumerate(events, 1):
+            lines.append(json.dumps(dict({"seq": last_seq + offset, "time": now}, **event)).encode('utf-8') + b"\n")
+        store.append_bytes(_segment_key(folder, first_seq), b"".join(lines))
+    return list(range(last_seq + 1, last_seq + 1 + len(events)))
+
+
+def mark_lost(store, folder, events):
+    """Note that events were saved but could not be appended to the feed."""
+    store.write_json(os.path.join(folder, LOST_MARKER), {
+        "time": datetime.now().isoformat(),
+        "events": len(events),
+        "types": sorted({event['type'] for event in events}),
+    })
+
+
+def lost_version(store, folder):
+    """Token that changes with every mark_lost ("0" if nothing was ever lost)."""
+    return store.version(os.path.join(folder, LOST_MARKER))
+
+
+def read_changes(store, folder, since=0, limit=500):
+    """Up to limit events with seq > since.
+
+    Returns {"changes", "next", "more"}; "next" is the cursor for the
+    following call. Raises CursorExpired if events after since are gone.
+    """
+    segments = _segments(store, folder)
+    if segments and since + 1 < segments[0]:
+        raise CursorExpired(f"events before {segments[0]} have been compacted")
+
+    # the segment holding since + 1 is the last one starting at or before it
+    start = 0
+    for index, first_seq in enumerate(segments):
+        if first_seq <= since + 1:
+            start = index
+
+    changes = []
+    more = False
+    for first_seq in segments[start:]:
+        for event in _parse(_read_segment(store, folder, first_seq)):
+            if event['seq'] <= since:
+                continue
+            if len(changes) == limit:
+                more = True
+                break
+            changes.append(event)
+        if more:
+            break
+    return {"changes": changes, "next": changes[-1]['seq'] if changes else since, "more": more}
+
+
+def latest_seq(store, folder):
+    """Sequence number of the newest event, 0 for an empty feed."""
+    segments = _segments(store, folder)
+    if not segments:
+        return 0
+    events = _parse(_read_segment(store, folder, segments[-1]))
+    return events[-1]['seq'] if events else segments[-1] - 1
+
+
+def head(store, folder):
+    """Token that changes with every append (None for an empty feed); a list and a stat, no read."""
+    segments = _segments(store, folder)
+    if not segments:
+        return None
+    return f"{segments[-1]}:{store.version(_segment_key(folder, segments[-1]))}"
+
+
+def status(store, folder):
+    """One dict per segment: first/last sequence number, events, bytes and last write."""
+    rows = []
+    for first_seq in _segments(store, folder):
+        data = _read_segment(store, folder, first_seq)
+        events = _parse(data)
+        st = store.stat(_segment_key(folder, first_seq))
+        rows.append({"segment": first_seq, "first": events[0]['seq'] if events else None,
+                     "last": events[-1]['seq'] if events else None, "events": len(events),
+                     "bytes": len(data), "modified": st.mtime if st else None})
+    return rows
+
+
+def compact(store, folder, before_seq=None, older_than=None):
+    """Delete old segments; returns how many went.
+
+    A segment goes when all of its events are below before_seq, or when
+    its last write is older than older_than (epoch seconds). The segment
+    being appended to is always kept, so sequence numbers never restart.
+    """
+    removed = 0
+    with store.lock(os.path.join(folder, 'feed')):
+        segments = _segments(store, folder)
+        for first_seq, next_first in zip(segments, segments[1:]):
+            expired = before_seq is not None and next_first <= before_seq
+            if older_than is not None and not expired:
+                st = store.stat(_segment_key(folder, first_seq))
+                expired = st is not None and st.mtime < older_than
+            if not expired:
+                break  # keep the feed contiguous: only a prefix is ever removed
+            store.delete(_segment_key(folder, first_seq))
+            removed += 1
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="list the segments of the feed")
+    compact_parser = commands.add_parser('compact', help="delete old segments")
+    compact_parser.add_argument('--keep-days', type=float, default=None,
+                                help="keep segments written in the last N days (default CHANGE_FEED_KEEP_DAYS)")
+    compact_parser.add_argument('--before', type=int, default=None,
+                                help="delete segments whose events all have seq < BEFORE")
+    args = parser.parse_args(argv)
+
+    import app as webapp
+
+    store, folder = webapp.storage, webapp.CHANGE_FEED_FOLDER
+    if args.command == 'status':
+        rows = status(store, folder)
+        for row in rows:
+            modified = datetime.fromtimestamp(row['modified']).strftime("%Y-%m-%d %H:%M") if row['modified'] else '-'
+            print(f"{row['segment']:012d}  seq {row['first']}..{row['last']}  "
+                  f"{row['events']:>6} events  {row['bytes']:>10} bytes  {modified}")
+        print(f"{len(rows)} segments, {sum(row['events'] for row in rows)} events")
+        return 0
+
+    older_than = None
+    if args.keep_days is not None or args.before is None:
+        keep_days = args.keep_days if args.keep_days is not None else webapp.CHANGE_FEED_KEEP_DAYS
+        older_than = time.time() - keep_days * 24 * 3600
+    removed = compact(store, folder, before_seq=args.before, older_than=older_than)
+    print(f"Removed {removed} segments")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
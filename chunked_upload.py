@@ -0,0 +1,130 @@
+"""
+Resumable chunked uploads.
+
+The upload pages (static/js/upload.js) downscale photos in the browser and
+send them here in chunks instead of as one multipart request:
+
+    POST /uploads                    {"filename", "size"} -> {"upload_id", "chunk_size"}
+    PUT  /uploads/<id>?offset=N      raw chunk bytes       -> {"offset", ...}
+    GET  /uploads/<id>                                     -> {"offset", "size", "complete"}
+
+A chunk is only appended at the current end of the file; any other offset
+is answered with 409 and the real offset, so a client whose connection
+dropped mid-chunk simply continues from there. The form is then submitted
+with the upload id in place of the file and the route turns it back into a
+FileStorage with open_upload(), so the existing recognition path is
+unchanged.
+
+Uploads live in the app's storage (see storage.py), so the chunks of one
+upload may reach different app nodes: <folder>/<id>/meta.json holds the
+name, size and bytes received, and every chunk is its own object (object
+stores cannot append). Unfinished uploads are purged after a while.
+"""
+import os
+import re
+import time
+import uuid
+import tempfile
+
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _upload_dir(folder, upload_id):
+    if not _UPLOAD_ID.match(upload_id or ''):
+        return None
+    return os.path.join(folder, upload_id)
+
+
+def _chunk_key(upload_dir, offset):
+    return os.path.join(upload_dir, f"{offset:012d}.chunk")
+
+
+def create_upload(store, folder, filename, size, max_size):
+    """Open a new upload; returns (upload_id, message)."""
+    filename = secure_filename(filename or '')
+    if not filename:
+        return None, "Missing file name"
+    if size <= 0 or size > max_size:
+        return None, f"File size must be between 1 byte and {max_size // (1024 * 1024)} MB"
+
+    upload_id = uuid.uuid4().hex
+    store.write_json(os.path.join(_upload_dir(folder, upload_id), "meta.json"),
+                     {"filename": filename, "size": size, "offset": 0, "created_at": time.time()})
+    return upload_id, "Upload started"
+
+
+def _read_meta(store, upload_dir):
+    try:
+        return store.read_json(os.path.join(upload_dir, "meta.json"))
+    except (OSError, ValueError):
+        return None
+
+
+def _status(upload_id, meta):
+    return {"upload_id": upload_id, "filename": meta['filename'], "offset": meta['offset'],
+            "size": meta['size'], "complete": meta['offset'] == meta['size']}
+
+
+def upload_status(store, folder, upload_id):
+    """Bytes received so far, or None for an unknown upload."""
+    upload_dir = _upload_dir(folder, upload_id)
+    meta = _read_meta(store, upload_dir) if upload_dir else None
+    return _status(upload_id, meta) if meta else None
+
+
+def append_chunk(store, folder, upload_id, offset, data):
+    """Append `data` at `offset`; returns (success, status) with status None if unknown."""
+    upload_dir = _upload_dir(folder, upload_id)
+    if not upload_dir:
+        return False, None
+    meta_key = os.path.join(upload_dir, "meta.json")
+    with store.lock(meta_key):
+        meta = _read_meta(store, upload_dir)
+        if meta is None:
+            return False, None
+        if offset != meta['offset'] or not data or offset + len(data) > meta['size']:
+            # stale or overlong chunk; the client resumes from the returned offset
+            return False, _status(upload_id, meta)
+        # a chunk left over from a failed attempt at this offset is simply overwritten
+        store.write_bytes(_chunk_key(upload_dir, offset), data)
+        meta['offset'] = offset + len(data)
+        store.write_json(meta_key, meta)
+        return True, _status(upload_id, meta)
+
+
+def open_upload(store, folder, upload_id):
+    """Hand a finished upload over as a FileStorage and delete it; None if not complete."""
+    upload_dir = _upload_dir(folder, upload_id)
+    if not upload_dir:
+        return None
+    with store.lock(os.path.join(upload_dir, "meta.json")):
+        status = upload_status(store, folder, upload_id)
+        if status is None or not status['complete']:
+            return None
+        # chunk by chunk into a temp file: imports can be far larger than memory should hold
+        stream = tempfile.TemporaryFile()
+        for name in store.list(upload_dir):
+            if name.endswith('.chunk') and int(name[:-len('.chunk')]) < status['size']:
+                stream.write(store.read_bytes(os.path.join(upload_dir, name)))
+        store.delete_prefix(upload_dir)
+    if stream.tell() != status['size']:
+        stream.close()
+        return None
+    stream.seek(0)
+    return FileStorage(stream=stream, filename=status['filename'], name=upload_id)
+
+
+def purge_uploads(store, folder, max_age):
+    """Remove uploads that have not received data for `max_age` seconds."""
+    cutoff = time.time() - max_age
+    for upload_id in store.list(folder):
+        upload_dir = _upload_dir(folder, upload_id)
+        if not upload_dir:
+            continue
+        # meta.json is rewritten by every chunk, so uploads in progress survive
+        st = store.stat(os.path.join(upload_dir, "meta.json"))
+        if st is None or st.mtime < cutoff:
+            store.delete_prefix(upload_dir)
@@ -8,4 +8,117 @@ class Config:
     ATTENDANCE_DATA_FOLDER = 'attendance_data'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     MATCH_THRESHOLD = 0.6
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
\ No newline at end of file
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+
+    # Where the folders above (plus static/annotated and in-flight enrollment and
+    # upload sessions) live, see storage.py. 'local' is a directory on this node;
+    # 's3' shares state between app nodes behind a load balancer ('directory' is
+    # a local stand-in with the same object-store semantics)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')  # 'local', 's3' or 'directory'
+    STORAGE_ROOT = os.environ.get('STORAGE_ROOT', '.')           # 'local' and 'directory'
+    STORAGE_BUCKET = os.environ.get('STORAGE_BUCKET')
+    STORAGE_PREFIX = os.environ.get('STORAGE_PREFIX', '')
+    STORAGE_ENDPOINT_URL = os.environ.get('STORAGE_ENDPOINT_URL')  # S3-compatible stores (MinIO, ...)
+    STORAGE_CACHE_FOLDER = os.path.join('cache', 'storage')       # node-local read-through cache
+
+    # Load the dlib models at startup instead of on the first recognition request
+    PRELOAD_RECOGNITION = os.environ.get('PRELOAD_RECOGNITION', '0') == '1'
+
+    # Tiled detection for very large group photos (lecture-hall panoramas).
+    # 'auto' tiles images whose longer side is at least TILED_DETECTION_MIN_DIM
+    TILED_DETECTION = 'auto'    # 'auto', True or False
+    TILED_DETECTION_MIN_DIM = 3000
+    TILE_SIZE = 1024
+    TILE_MAX_UPSAMPLE = 2
+    TILE_WORKERS = 2            # detection processes per web worker (1 = inline)
+
+    # Faces failing these checks are reported as skipped instead of encoded
+    QUALITY_GATING = True
+    QUALITY_MIN_FACE_PX = 20     # shorter side of the detection box
+    QUALITY_MIN_SHARPNESS = 20.0  # variance of Laplacian on a 64x64 face crop
+    QUALITY_MAX_YAW = 0.35       # nose offset from eye midpoint / eye distance
+
+    # Named performance profiles for detection and encoding.
+    # landmarks: 'small' (5-point) or 'large' (68-point) alignment model
+    # jitters: encoder re-samples per face (1 = none); worth it only at enrollment
+    # detector/upsample: face_locations model and upsample count
+    RECOGNITION_PROFILES = {
+        'fast': {'landmarks': 'small', 'jitters': 1, 'detector': 'hog', 'upsample': 0},
+        'balanced': {'landmarks': 'small', 'jitters': 1, 'detector': 'hog', 'upsample': 1},
+        'accurate': {'landmarks': 'small', 'jitters': 10, 'detector': 'hog', 'upsample': 1},
+        'accurate-large': {'landmarks': 'large', 'jitters': 10, 'detector': 'hog', 'upsample': 1},
+    }
+    ENROLLMENT_PROFILE = os.environ.get('ENROLLMENT_PROFILE', 'accurate')
+    ATTENDANCE_PROFILE = os.environ.get('ATTENDANCE_PROFILE', 'balanced')
+
+    # Recognition templates per student, picked from all their photos
+    TEMPLATES_PER_STUDENT = 3
+    TEMPLATE_MAX_SPREAD = 0.6   # farther from the student's typical photo = bad shot, never a template
+    TEMPLATE_MAX_CANDIDATES = 12  # photos per student considered by Generate Encodings
+
+    # Per-worker gallery cache; None keeps float64 encodings, 'float16' or
+    # 'int8' quantize them and re-rank the closest students exactly
+    COMPACT_GALLERY = os.environ.get('COMPACT_GALLERY') or None
+    GALLERY_CACHE_FOLDER = os.path.join('cache', 'gallery')
+    GALLERY_CACHE_SIZE = 256    # classes per worker
+    GALLERY_RERANK = 4          # students re-ranked with exact encodings
+
+    # Face crops detected in class photos, waiting to be assigned to students
+    ENROLLMENT_CACHE_FOLDER = os.path.join('cache', 'enrollment')
+    ENROLLMENT_CACHE_MAX_AGE = 24 * 3600  # seconds
+
+    # Bulk roster import (roster_import.py, /class/<name>/import)
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', min(4, os.cpu_count() or 1)))  # encoding processes
+    IMPORT_BATCH_SIZE = 32      # photos held in memory and encoded per batch
+    ROSTER_IMPORT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # per roster CSV / photo ZIP, chunked or posted directly
+
+    # Browser-side downscaling and resumable chunked uploads (static/js/upload.js)
+    UPLOAD_MAX_MEGAPIXELS = 5.0             # group photos; a pixel budget, so panoramas stay wide
+    ENROLLMENT_UPLOAD_MAX_MEGAPIXELS = 1.5  # student portraits
+    UPLOAD_JPEG_QUALITY = 0.85
+    CHUNKED_UPLOAD_FOLDER = os.path.join('cache', 'uploads')
+    CHUNKED_UPLOAD_CHUNK_SIZE = 512 * 1024  # bytes per request
+    CHUNKED_UPLOAD_MAX_AGE = 24 * 3600      # seconds without data before an upload is dropped
+
+    # Append-only change feed of attendance and roster changes (changefeed.py, /api/changes)
+    CHANGE_FEED_FOLDER = os.path.join('data', 'changes')
+    CHANGE_FEED_SEGMENT_EVENTS = 1000  # events per segment file
+    CHANGE_FEED_PAGE_SIZE = 500
+    CHANGE_FEED_MAX_PAGE_SIZE = 5000
+    CHANGE_FEED_KEEP_DAYS = 90  # default retention of `python changefeed.py compact`
+
+    # Cross-class per-student attendance index (student_index.py, /api/student-attendance)
+    STUDENT_INDEX_PATH = os.path.join('cache', 'student_index.sqlite3')  # node-local, follows the change feed
+    STUDENT_INDEX_THRESHOLD = 75  # default ?below= percent
+
+    # Per-worker cache of dashboard API responses (entries)
+    API_CACHE_SIZE = 64
+
+    # Class roster pages (/api/class-roster/<class_name>)
+    ROSTER_PAGE_SIZE = 50
+    ROSTER_MAX_PAGE_SIZE = 200
+
+    # Sessions per attendance history page
+    HISTORY_PAGE_SIZE = 20
+
+    # Sampled request profiling (cProfile + tracemalloc), see profiling.py
+    PROFILING = os.environ.get('PROFILING', '0') == '1'
+    PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', 100))  # 1 in N requests, 0 = header only
+    PROFILE_HEADER = 'X-Profile'  # send the token in this header to profile a request
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # also guards /_profiles
+    PROFILE_FOLDER = os.path.join('cache', 'profiles')
+    PROFILE_KEEP = 50
+    PROFILE_TRACEMALLOC = True
+
+    # Face-cropped thumbnails of known_faces photos
+    THUMBNAIL_CACHE_FOLDER = os.path.join('cache', 'thumbnails')
+    THUMBNAIL_SIZES = (64, 128, 256)
+    THUMBNAIL_MAX_AGE = 30 * 24 * 3600  # seconds
+
+    # Production server sizing (run.py --production); env vars override
+    WORKER_MEMORY_MB = 350      # private RSS per worker while processing a group photo
+    SHARED_MODEL_MEMORY_MB = 200  # dlib models, loaded once in the master
+    THREADS_PER_WORKER = 4
+    WORKER_MAX_REQUESTS = 500   # recycle workers to cap RSS growth
+    WORKER_MAX_REQUESTS_JITTER = 50
+    WORKER_TIMEOUT = 120        # seconds; large group photos take a while
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Accuracy-vs-latency evaluation of detector and matcher settings.
+
+Runs labeled group photos of a class through detection, encoding and
+matching for every combination of the swept settings and reports student
+level precision and recall, the share of detected faces left unknown, and
+p50/p95 latency per stage.
+
+    python evaluate.py init CSE-22 uploads/*.jpeg > labels.json   # then fill in "present"
+    python evaluate.py run labels.json --detector hog --upsample 0 1 2 \\
+        --tolerance 0.5 0.55 0.6 --margin 0 0.02 --output results.json \\
+        --min-precision 0.98 --min-recall 0.9
+
+labels.json:
+
+    {"class": "CSE-22",
+     "images": [{"path": "uploads/group1.jpeg", "present": ["1", "4", "7"]}]}
+
+Detection is cached per (image, detector, upsample) and encoding per
+profile, so adding tolerance/margin values is nearly free. By default the
+class's stored encodings are the gallery; --reencode rebuilds it from the
+enrollment photos with each swept profile.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+import app as webapp
+import gallery
+import recognition
+
+STAGES = ('detect', 'encode', 'match')
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def build_gallery(class_data, profile, reencode):
+    """Gallery of the stored encodings, or re-encoded with the given profile."""
+    if not reencode:
+        return gallery.Gallery(gallery.gallery_students(class_data))
+
+    face_recognition = recognition.load()
+    class_dir = os.path.join(webapp.KNOWN_FACES_FOLDER, class_data['safe_name'])
+    students = []
+    for student in class_data['students']:
+        encodings = []
+        for photo in sorted(student.get('photos', []))[:1]:
+            image = face_recognition.load_image_file(webapp.storage.open_image(os.path.join(class_dir, photo)))
+            locations = recognition.detect_faces(image, model=profile['detector'], upsample=profile['upsample'])
+            encodings = [e.tolist() for e in recognition.encode_faces(
+                image, locations[:1], landmark_model=profile['landmarks'], num_jitters=profile['jitters'])[1]]
+        students.append((student['student_id'], student['name'], profile['landmarks'], encodings))
+    return gallery.Gallery(students)
+
+
+def evaluate(labels, detectors, upsamples, profiles, tolerances, margins, reencode=False, repeat=1):
+    class_data = webapp.get_class(labels['class'])
+    if not class_data:
+        raise SystemExit(f"Class '{labels['class']}' not found")
+
+    face_recognition = recognition.load()
+    recognition.warm_up()
+    images = [(item['path'], face_recognition.load_image_file(item['path']), set(map(str, item['present'])))
+              for item in labels['images']]
+
+    rows = []
+    for detector, upsample, profile_name in itertools.product(detectors, upsamples, profiles):
+        profile = dict(webapp.get_profile(profile_name), detector=detector, upsample=upsample)
+        class_gallery = build_gallery(class_data, profile, reencode)
+        landmarks = profile['landmarks']
+
+        # per image: detected/encoded faces and stage timings
+        processed = []
+        for path, image, present in images:
+            timings = {stage: [] for stage in STAGES}
+            for _ in range(repeat):
+                started = time.perf_counter()
+                locations = webapp.detect_group_faces(image, profile=profile)
+                timings['detect'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                kept, encodings, skipped = recognition.encode_faces(
+                    image, locations, landmark_model=landmarks,
+                    num_jitters=profile['jitters'], quality=webapp.QUALITY_GATE)
+                timings['encode'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                nearest = class_gallery.nearest({landmarks: encodings})
+                timings['match'].append(time.perf_counter() - started)
+            processed.append((path, present, len(locations), len(skipped), nearest, timings))
+
+        for tolerance, margin in itertools.product(tolerances, margins):
+            tp = fp = fn = faces = unknown = skipped_total = 0
+            latencies = {stage: [] for stage in STAGES + ('total',)}
+            per_image = []
+            for path, present, detected, skipped, nearest, timings in processed:
+                predicted = set()
+                for best, best_dist, second_dist in nearest:
+                    sid = class_gallery.student_ids[best] if best is not None else None
+                    matched = gallery.decision(sid, best_dist, second_dist, tolerance, margin)
+                    if matched is None:
+                        unknown += 1
+                    else:
+                        predicted.add(matched)
+                faces += len(nearest)
+                skipped_total += skipped
+                tp += len(predicted & present)
+                fp += len(predicted - present)
+                fn += len(present - predicted)
+                per_image.append({"path": path, "detected": detected, "false_positives": sorted(predicted - present),
+                                  "missed": sorted(present - predicted)})
+                for stage in STAGES:
+                    latencies[stage].extend(timings[stage])
+                latencies['total'].extend(map(sum, zip(*(timings[stage] for stage in STAGES))))
+
+            rows.append({
+                "detector": detector,
+                "upsample": upsample,
+                "profile": profile_name,
+                "tolerance": tolerance,
+                "margin": margin,
+                "precision": tp / (tp + fp) if tp + fp else 1.0,
+                "recall": tp / (tp + fn) if tp + fn else 1.0,
+                "unknown_rate": unknown / faces if faces else 0.0,
+                "faces": faces,
+                "skipped": skipped_total,
+                "latency_ms": {stage: {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+                               for stage, values in latencies.items()},
+                "images": per_image,
+            })
+    return rows
+
+
+def print_table(rows, best=None, out=sys.stdout):
+    header = (f"{'detector':<8} {'up':>2} {'profile':<14} {'tol':>5} {'margin':>6} {'prec':>6} {'recall':>6} "
+              f"{'unknown':>7} {'detect p50/p95':>15} {'encode p50/p95':>15} {'total p50/p95':>15}")
+    print(header, file=out)
+    print('-' * len(header), file=out)
+    for row in sorted(rows, key=lambda r: r['latency_ms']['total']['p50']):
+        lat = row['latency_ms']
+        marker = ' *' if row is best else ''
+        print(f"{row['detector']:<8} {row['upsample']:>2} {row['profile']:<14} {row['tolerance']:>5.2f} "
+              f"{row['margin']:>6.2f} {row['precision']:>6.3f} {row['recall']:>6.3f} {row['unknown_rate']:>7.3f} "
+              f"{lat['detect']['p50']:>7.0f}/{lat['detect']['p95']:<7.0f} "
+              f"{lat['encode']['p50']:>7.0f}/{lat['encode']['p95']:<7.0f} "
+              f"{lat['total']['p50']:>7.0f}/{lat['total']['p95']:<7.0f}{marker}", file=out)
+
+
+def init_labels(class_name, paths):
+    return {"class": class_name, "images": [{"path": path, "present": []} for path in paths]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    init = sub.add_parser('init', help="print a labels template for some group photos")
+    init.add_argument('class_name')
+    init.add_argument('paths', nargs='+')
+
+    run = sub.add_parser('run', help="sweep settings over a labels file")
+    run.add_argument('labels')
+    run.add_argument('--detector', nargs='+', default=['hog'], choices=['hog', 'cnn'])
+    run.add_argument('--upsample', nargs='+', type=int, default=[0, 1, 2])
+    run.add_argument('--profile', nargs='+', default=[webapp.ATTENDANCE_PROFILE],
+                     help="recognition profiles (landmarks/jitters); detector/upsample come from the sweep")
+    run.add_argument('--tolerance', nargs='+', type=float, default=[0.5, 0.55, webapp.MATCH_THRESHOLD])
+    run.add_argument('--margin', nargs='+', type=float, default=[0.0, 0.02, 0.05])
+    run.add_argument('--reencode', action='store_true', help="re-encode the gallery with each profile")
+    run.add_argument('--repeat', type=int, default=1, help="timed runs per image")
+    run.add_argument('--min-precision', type=float, default=0.0)
+    run.add_argument('--min-recall', type=float, default=0.0)
+    run.add_argument('--output', help="write all results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == 'init':
+        json.dump(init_labels(args.class_name, args.paths), sys.stdout, indent=2)
+        print()
+        return 0
+
+    with open(args.labels, 'r') as f:
+        labels = json.load(f)
+    rows = evaluate(labels, args.detector, args.upsample, sorted(set(args.profile)),
+                    args.tolerance, args.margin, reencode=args.reencode, repeat=max(1, args.repeat))
+
+    eligible = [r for r in rows if r['precision'] >= args.min_precision and r['recall'] >= args.min_recall]
+    best = min(eligible, key=lambda r: r['latency_ms']['total']['p50'], default=None)
+    print_table(rows, best)
+    if best:
+        print(f"\nFastest setting meeting the floor (*): detector={best['detector']} upsample={best['upsample']} "
+              f"profile={best['profile']} tolerance={best['tolerance']} margin={best['margin']}")
+    else:
+        print("\nNo setting meets the precision/recall floor")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"labels": args.labels, "best": best, "results": rows}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0 if best else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Bulk attendance export.
+
+Streams the attendance of any set of classes over a date range, either as a
+wide matrix (one row per student, one column per session) or as long
+records (one row per student per session), in CSV or newline-delimited
+JSON, or as a ZIP of the raw session CSVs:
+
+    GET /export?class=CSE-22&class=ECE-22&from=2025-08-01&to=2025-12-15&layout=wide&format=csv
+
+    python export.py CSE-22 ECE-22 --from 2025-08-01 --to 2025-12-15 --layout long --format ndjson -o term.ndjson
+    python export.py --format zip -o sessions.zip      # every class, every session
+
+Sessions are found through the per-class session index and read one file
+at a time; output leaves in small batches from generators. The wide layout
+keeps one status byte per student and session of the class being written,
+nothing else.
+"""
+import io
+import os
+import csv
+import json
+import zipfile
+import argparse
+from collections import namedtuple
+
+LAYOUTS = ('wide', 'long')
+FORMATS = ('csv', 'ndjson', 'zip')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'zip': 'application/zip'}
+
+BATCH_SIZE = 64 * 1024  # characters/bytes per yielded chunk
+
+LONG_FIELDS = ["class_name", "date", "time", "student_id", "name", "status"]
+
+# name/safe_name of a class, its index entries in the date range (oldest
+# first) and a callable returning its roster as [(student_id, name)]
+ExportClass = namedtuple('ExportClass', 'name safe_name sessions roster')
+
+
+def session_label(session):
+    return f"{session['date']} {session['time']}"
+
+
+def read_session(text):
+    """(student_id, name, status) rows of a saved session CSV."""
+    rows = csv.reader(io.StringIO(text, newline=''))
+    for row in rows:
+        if row[:3] == ["Student ID", "Name", "Status"]:
+            break
+    for row in rows:
+        if len(row) >= 3:
+            yield row[0], row[1], row[2]
+
+
+def session_files(store, folder, export_class):
+    """(position, session, text) of each session file that exists."""
+    for position, session in enumerate(export_class.sessions):
+        try:
+            yield position, session, store.read_text(os.path.join(folder, export_class.safe_name, session['filename']))
+        except FileNotFoundError:
+            continue  # the index still lists a file deleted by hand
+
+
+def long_records(store, folder, classes):
+    """One dict per student per session."""
+    for export_class in classes:
+        for _, session, text in session_files(store, folder, export_class):
+            for student_id, name, status in read_session(text):
+                yield {"class_name": export_class.name, "date": session['date'], "time": session['time'],
+                       "student_id": student_id, "name": name, "status": status}
+
+
+def wide_columns(classes):
+    """Session labels of all classes, in chronological order."""
+    return sorted({session_label(s) for export_class in classes for s in export_class.sessions})
+
+
+def wide_records(store, folder, classes, columns):
+    """(class_name, student_id, name, statuses) with one status per column ('' = no session)."""
+    position = {label: i for i, label in enumerate(columns)}
+    for export_class in classes:
+        statuses = {}   # student_id -> bytearray of codes, one per session of this class
+        names = {}
+        codes = {}      # status -> code (0 means not recorded)
+        count = len(export_class.sessions)
+        for index, _, text in session_files(store, folder, export_class):
+            for student_id, name, status in read_session(text):
+                code = codes.setdefault(status, len(codes) + 1)
+                statuses.setdefault(student_id, bytearray(count))[index] = code
+                names.setdefault(student_id, name)
+
+        labels = [None] + list(codes)
+        columns_of_class = [position[session_label(s)] for s in export_class.sessions]
+        roster = export_class.roster()
+        roster_ids = {student_id for student_id, _ in roster}
+        # enrolled students first, then anyone who only appears in past sessions
+        students = roster + [(student_id, names[student_id]) for student_id in sorted(statuses)
+                             if student_id not in roster_ids]
+        for student_id, name in students:
+            row = [''] * len(columns)
+            for column, code in zip(columns_of_class, statuses.get(student_id, b'')):
+                if code:
+                    row[column] = labels[code]
+            yield export_class.name, student_id, name, row
+
+
+def _csv_stream(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_stream(records):
+    batch = []
+    size = 0
+    for record in records:
+        line = json.dumps(record) + "\n"
+        batch.append(line)
+        size += len(line)
+        if size >= BATCH_SIZE:
+            yield "".join(batch)
+            batch, size = [], 0
+    yield "".join(batch)
+
+
+class _ZipBuffer:
+    """Write-only file for ZipFile; without tell() it writes a streamable archive."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(store, folder, classes):
+    """ZIP of the raw session CSVs as <class>/<file>, yielded file by file."""
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for export_class in classes:
+            for _, session, text in session_files(store, folder, export_class):
+                archive.writestr(f"{export_class.safe_name}/{session['filename']}", text)
+                yield buffer.drain()
+    yield buffer.drain()
+
+
+def export_stream(store, folder, classes, layout, fmt):
+    """Generator of output chunks (str, or bytes for zip) for a layout and format."""
+    classes = list(classes)
+    if fmt == 'zip':
+        return zip_stream(store, folder, classes)
+    if layout == 'long':
+        records = long_records(store, folder, classes)
+        if fmt == 'ndjson':
+            return _ndjson_stream(records)
+        return _csv_stream(LONG_FIELDS, ([r[field] for field in LONG_FIELDS] for r in records))
+
+    columns = wide_columns(classes)
+    records = wide_records(store, folder, classes, columns)
+    if fmt == 'ndjson':
+        return _ndjson_stream({"class_name": class_name, "student_id": student_id, "name": name,
+                               "attendance": {label: status for label, status in zip(columns, row) if status}}
+                              for class_name, student_id, name, row in records)
+    return _csv_stream(["class_name", "student_id", "name"] + columns,
+                       ([class_name, student_id, name] + row for class_name, student_id, name, row in records))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('classes', nargs='*', help="class names (default: every class)")
+    parser.add_argument('--from', dest='start', help="first day (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', help="last day (YYYY-MM-DD), inclusive")
+    parser.add_argument('--layout', choices=LAYOUTS, default='wide')
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, default='csv')
+    parser.add_argument('-o', '--output', default='-', help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    import app as webapp
+
+    try:
+        classes = webapp.export_classes(args.classes, args.start, args.end)
+    except KeyError as e:
+        parser.error(f"Class {e} not found")
+
+    out = open(args.output, 'wb') if args.output != '-' else os.fdopen(os.dup(1), 'wb')
+    with out:
+        for chunk in export_stream(webapp.storage, webapp.ATTENDANCE_DATA_FOLDER, classes, args.layout, args.fmt):
+            out.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
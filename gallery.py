@@ -0,0 +1,327 @@
+"""
+In-memory face galleries for recognition.
+
+A gallery is one class's enrollment encodings packed into a single matrix.
+It is built once per class version and kept per worker, instead of turning
+the JSON float lists into float64 arrays on every recognition request, and
+matching is vectorized over all students at once.
+
+Students keep up to K templates (select_templates picks them from their
+photos). The matrix is padded to K rows per student by repeating templates,
+so one matrix product gives every face-template distance and a reshape to
+(faces, students, K) plus a min gives the distance to each student. Cost
+and memory per student are fixed by K.
+
+Compact galleries (Config.COMPACT_GALLERY = 'float16' or 'int8') keep the
+matrix quantized: float16, or int8 codes with a per-vector scale. Distances
+are computed on the quantized matrix, then the closest few students are
+re-ranked with exact float32 encodings memory-mapped from a sidecar .npy
+file, so only ~140 bytes per encoding stay resident.
+
+Check that a compact gallery makes the same decisions as the float lists
+on the stored galleries:
+
+    python gallery.py check --mode int8
+"""
+import os
+import glob
+import json
+import hashlib
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from persistence import atomic_open
+from recognition import LEGACY_ENCODING
+
+logger = logging.getLogger(__name__)
+
+MODES = ('float16', 'int8')
+NO_RUNNER_UP = 1.0  # runner-up distance when a class has a single encoded student
+DEFAULT_RERANK = 4
+
+_galleries = OrderedDict()
+_galleries_lock = threading.Lock()
+
+
+class Gallery:
+    """Encodings of one class, grouped by student and landmark model."""
+
+    def __init__(self, students, mode=None, exact_dir=None, rerank=DEFAULT_RERANK):
+        """students: iterable of (student_id, name, landmarks, encodings)."""
+        if mode not in (None,) + MODES:
+            raise ValueError(f"Unknown gallery mode {mode!r}")
+
+        # rows of one landmark model must be contiguous for the group slices
+        students = sorted((s for s in students if s[3]), key=lambda s: s[2])
+        self.student_ids = [s[0] for s in students]
+        self.names = [s[1] for s in students]
+        self.mode = mode
+        self.rerank = max(2, rerank)
+
+        # templates per student; students with fewer repeat theirs (a repeat never changes the min)
+        self.templates = max((len(s[3]) for s in students), default=1)
+        self.row_starts = np.arange(len(students) + 1, dtype=np.intp) * self.templates
+
+        # landmarks -> (first student, end student)
+        self.groups = {}
+        for i, student in enumerate(students):
+            first, _ = self.groups.get(student[2], (i, i))
+            self.groups[student[2]] = (first, i + 1)
+
+        matrix = np.array([e for s in students for e in _padded(s[3], self.templates)],
+                          dtype=np.float64).reshape(-1, 128)
+        if mode is None:
+            self.matrix = matrix
+            self.sq_norms = (matrix ** 2).sum(axis=1)
+            return
+
+        exact = matrix.astype(np.float32)
+        self.exact = _memory_mapped(exact, exact_dir) if exact_dir else exact
+        if mode == 'int8':
+            scales = np.abs(exact).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self.codes = np.round(exact / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        else:
+            self.codes = exact.astype(np.float16)
+            self.scales = None
+        self.sq_norms = (self._dequantized(0, len(exact)) ** 2).sum(axis=1)
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    @property
+    def nbytes(self):
+        if self.mode is None:
+            return self.matrix.nbytes + self.sq_norms.nbytes
+        return self.codes.nbytes + self.sq_norms.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _dequantized(self, start, end):
+        values = self.codes[start:end].astype(np.float32)
+        if self.scales is not None:
+            values *= self.scales[start:end, None]
+        return values
+
+    def _student_distances(self, queries, n_faces):
+        """(faces x students) minimum distance to each student's templates."""
+        distances = np.full((n_faces, len(self)), np.inf)
+        for landmarks, (first, end) in self.groups.items():
+            query = queries.get(landmarks)
+            if query is None or not n_faces:
+                continue
+            rows = slice(self.row_starts[first], self.row_starts[end])
+            if self.mode is None:
+                sq = (self.sq_norms[rows][None, :] + (query ** 2).sum(axis=1)[:, None]
+                      - 2 * query @ self.matrix[rows].T)
+            else:
+                sq = (self.sq_norms[rows][None, :] + (query ** 2).sum(axis=1)[:, None]
+                      - 2 * query.astype(np.float32) @ self._dequantized(rows.start, rows.stop).T)
+            row_dist = np.sqrt(np.maximum(sq, 0))
+            distances[:, first:end] = row_dist.reshape(n_faces, end - first, self.templates).min(axis=2)
+        return distances
+
+    def _exact_distance(self, student, query):
+        rows = self.exact[self.row_starts[student]:self.row_starts[student + 1]]
+        return float(np.min(np.linalg.norm(rows - query, axis=1)))
+
+    def nearest(self, queries):
+        """Best and runner-up student for every query face.
+
+        queries maps a landmark model to a (faces x 128) array of query
+        encodings made with that model. Returns one (student_index,
+        best_distance, runner_up_distance) per face; student_index is None
+        for an empty gallery.
+        """
+        n_faces = max((len(q) for q in queries.values()), default=0)
+        queries = {k: np.asarray(q, dtype=np.float64).reshape(-1, 128) for k, q in queries.items()}
+        if not len(self):
+            return [(None, None, None)] * n_faces
+
+        distances = self._student_distances(queries, n_faces)
+        if self.mode is None:
+            faces = np.arange(n_faces)
+            best = distances.argmin(axis=1)
+            best_dist = distances[faces, best]
+            second_dist = np.full(n_faces, NO_RUNNER_UP)
+            if len(self) > 1:
+                distances[faces, best] = np.inf
+                second_dist = distances.min(axis=1)
+            return [(int(b), float(d), float(s)) for b, d, s in zip(best, best_dist, second_dist)]
+
+        landmarks_of = np.empty(len(self), dtype=object)
+        for landmarks, (first, end) in self.groups.items():
+            landmarks_of[first:end] = landmarks
+
+        results = []
+        for face, row in enumerate(distances):
+            k = min(self.rerank, len(row))
+            top = np.argpartition(row, k - 1)[:k] if k < len(row) else range(len(row))
+            candidates = [(self._exact_distance(i, queries[landmarks_of[i]][face]), int(i)) for i in top]
+            candidates.sort()
+            best_dist, best = candidates[0]
+            second_dist = candidates[1][0] if len(candidates) > 1 else NO_RUNNER_UP
+            results.append((best, best_dist, second_dist))
+        return results
+
+
+def _padded(encodings, k):
+    """encodings repeated cyclically to exactly k rows."""
+    return [encodings[i % len(encodings)] for i in range(k)]
+
+
+def select_templates(encodings, k, max_spread=None):
+    """Indices of up to k representative encodings of one student, best first.
+
+    The medoid (smallest total distance to the others) comes first, then
+    each next pick is the encoding farthest from those already chosen, so
+    the templates cover different poses and lighting. With three or more
+    encodings, ones farther than max_spread from the medoid are treated as
+    bad shots (or someone else) and never chosen; exact duplicates are
+    skipped.
+    """
+    vectors = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+    if not len(vectors) or k < 1:
+        return []
+    pairwise = np.linalg.norm(vectors[:, None, :] - vectors[None, :, :], axis=2)
+    medoid = int(pairwise.sum(axis=1).argmin())
+
+    allowed = np.ones(len(vectors), dtype=bool)
+    if max_spread is not None and len(vectors) >= 3:
+        allowed = pairwise[medoid] <= max_spread
+
+    chosen = [medoid]
+    nearest_chosen = pairwise[medoid].copy()
+    while len(chosen) < k:
+        spread = np.where(allowed, nearest_chosen, 0.0)
+        pick = int(spread.argmax())
+        if spread[pick] <= 0:
+            break
+        chosen.append(pick)
+        nearest_chosen = np.minimum(nearest_chosen, pairwise[pick])
+    return chosen
+
+
+def _memory_mapped(exact, exact_dir):
+    """Store exact encodings in a content-addressed .npy and map it read-only."""
+    digest = hashlib.sha1(exact.tobytes()).hexdigest()[:20]
+    path = os.path.join(exact_dir, f"{digest}.npy")
+    if not os.path.exists(path):
+        with atomic_open(path, 'wb') as f:
+            np.save(f, exact)
+    return np.load(path, mmap_mode='r')
+
+
+def gallery_students(class_data):
+    """(student_id, name, landmarks, encodings) rows of a class document."""
+    for student in class_data.get('students', []):
+        landmarks = student.get('encoding_profile', LEGACY_ENCODING)['landmarks']
+        yield student['student_id'], student['name'], landmarks, student.get('encodings', [])
+
+
+def get_gallery(class_data, mode=None, exact_dir=None, rerank=DEFAULT_RERANK, max_entries=256):
+    """Cached gallery of a class document, rebuilt when the class is saved."""
+    key = (class_data['safe_name'], class_data.get('version', 0), class_data.get('updated_at'), mode, rerank)
+    with _galleries_lock:
+        gallery = _galleries.get(key)
+        if gallery is not None:
+            _galleries.move_to_end(key)
+            return gallery
+
+    gallery = Gallery(gallery_students(class_data), mode=mode, exact_dir=exact_dir, rerank=rerank)
+    with _galleries_lock:
+        # drop older versions of the same class
+        for stale in [k for k in _galleries if k[0] == key[0] and k[3:] == key[3:]]:
+            del _galleries[stale]
+        _galleries[key] = gallery
+        while len(_galleries) > max_entries:
+            _galleries.popitem(last=False)
+    return gallery
+
+
+# --------------------------
+# Accuracy check
+# --------------------------
+def reference_nearest(students, query):
+    """The per-student loop recognition used before galleries, for one query."""
+    results = []
+    for sid, _, _, encodings in students:
+        if encodings:
+            dists = np.linalg.norm(np.array(encodings) - query, axis=1)
+            results.append((sid, float(np.min(dists))))
+    if not results:
+        return None, None, None
+    results.sort(key=lambda x: x[1])
+    second = results[1][1] if len(results) > 1 else NO_RUNNER_UP
+    return results[0][0], results[0][1], second
+
+
+def decision(student_id, best, second, tolerance, margin):
+    if student_id is not None and best <= tolerance and (second - best) >= margin:
+        return student_id
+    return None
+
+
+def check_class(path, mode, tolerance, margin, noise_levels, seed=0):
+    """Compare compact and reference decisions on queries derived from a class.
+
+    Queries are every stored encoding plus noisy copies of it, so both
+    confident matches and near-threshold cases are exercised.
+    """
+    with open(path, 'r') as f:
+        class_data = json.load(f)
+    students = [(sid, name, 'small', encs) for sid, name, _, encs in gallery_students(class_data)]
+    gallery = Gallery(students, mode=mode)
+
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _, _, _, encodings in students:
+        for encoding in encodings:
+            encoding = np.asarray(encoding, dtype=np.float64)
+            queries.append(encoding)
+            for level in noise_levels:
+                queries.append(encoding + rng.normal(0, level / np.sqrt(128), size=128))
+    if not queries:
+        return 0, []
+
+    mismatches = []
+    compact = gallery.nearest({'small': np.array(queries)})
+    for query, (index, best, second) in zip(queries, compact):
+        expected = decision(*reference_nearest(students, query), tolerance, margin)
+        got = decision(gallery.student_ids[index] if index is not None else None, best, second, tolerance, margin)
+        if expected != got:
+            mismatches.append((expected, got, best, second))
+    return len(queries), mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    check = sub.add_parser('check', help="verify compact galleries make identical decisions")
+    check.add_argument('--data', default='data', help="folder with class JSON files")
+    check.add_argument('--mode', choices=MODES, default='int8')
+    check.add_argument('--tolerance', type=float, default=0.6)
+    check.add_argument('--margin', type=float, default=0.02)
+    check.add_argument('--noise', type=float, nargs='*', default=[0.2, 0.35, 0.45, 0.5, 0.55, 0.6])
+    args = parser.parse_args(argv)
+
+    total, failed = 0, 0
+    for path in sorted(glob.glob(os.path.join(args.data, '*.json'))):
+        if os.path.basename(path).startswith('.'):
+            continue
+        count, mismatches = check_class(path, args.mode, args.tolerance, args.margin, args.noise)
+        total += count
+        failed += len(mismatches)
+        print(f"{os.path.basename(path)}: {count} queries, {len(mismatches)} different decisions")
+        for expected, got, best, second in mismatches[:5]:
+            print(f"    expected {expected}, got {got} (best {best:.4f}, runner-up {second:.4f})")
+
+    print(f"{args.mode}: {total} queries, {failed} different decisions")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the web app with generated fixtures.
+
+Builds a throwaway data directory (classes, rosters with encodings, past
+sessions, group photos composited from the sample portraits in known_faces/)
+and drives the real app with scripted request mixes, either in-process
+through Flask's test client or over HTTP against gunicorn launched via
+run.py --production. Nothing leaves the machine.
+
+    python loadtest.py                                   # in-process, all phases
+    python loadtest.py --server gunicorn --workers 1 2 4 --concurrency 4 16
+    python loadtest.py --mix burst --requests 300 --output load.json
+
+Mixes (--mix):
+    enrollment  batches of new students with photos (add_students)
+    burst       start of a period: group-photo uploads while dashboards poll
+    dashboard   /api/class-overview and /api/attendance-stats polling
+    reports     class reports, history, class pages, home page
+    semester    enrollment, burst, then dashboard and reports (default)
+
+For every worker count, concurrency and phase it reports throughput, p50,
+p95 and p99 latency and the error rate (exceptions or HTTP >= 400) per
+route.
+"""
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timedelta
+from collections import defaultdict
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --------------------------
+# Fixtures
+# --------------------------
+def _portraits(limit=40):
+    """Sample portraits shipped in known_faces/, or drawn stand-ins."""
+    from PIL import Image, ImageDraw
+
+    folder = os.path.join(REPO_DIR, 'known_faces')
+    portraits = []
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder))[:limit]:
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                with Image.open(os.path.join(folder, name)) as img:
+                    img = img.convert('RGB')
+                    img.thumbnail((600, 600))
+                    portraits.append(img)
+    if not portraits:
+        rng = random.Random(0)
+        for _ in range(8):
+            img = Image.new('RGB', (300, 400), tuple(rng.randrange(60, 200) for _ in range(3)))
+            draw = ImageDraw.Draw(img)
+            draw.ellipse((70, 60, 230, 280), fill=(224, 172, 105))
+            draw.ellipse((110, 140, 130, 155), fill=(40, 40, 40))
+            draw.ellipse((170, 140, 190, 155), fill=(40, 40, 40))
+            draw.arc((115, 200, 185, 240), 20, 160, fill=(120, 40, 40), width=4)
+            portraits.append(img)
+    return portraits
+
+
+def _jpeg(image, quality=85):
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def _group_photo(portraits, rng, size=(1600, 1000), rows=3, cols=6):
+    from PIL import Image
+
+    canvas = Image.new('RGB', size, (90, 90, 100))
+    cell_w, cell_h = size[0] // cols, size[1] // rows
+    for r in range(rows):
+        for c in range(cols):
+            portrait = rng.choice(portraits).copy()
+            portrait.thumbnail((cell_w - 10, cell_h - 10))
+            canvas.paste(portrait, (c * cell_w + 5, r * cell_h + 5))
+    return _jpeg(canvas)
+
+
+def build_fixtures(workdir, webapp, classes=6, students=60, sessions=20, seed=0):
+    """Create classes, rosters and history in workdir (the app's cwd)."""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    portraits = _portraits()
+
+    class_names = []
+    for i in range(classes):
+        class_name = f"LOAD-{i + 1:02d}"
+        class_names.append(class_name)
+        if webapp.get_class(class_name):
+            continue
+        webapp.create_class(class_name)
+        webapp.add_students(class_name, [{'student_id': f"{i + 1:02d}{n:03d}", 'name': f"Student {i + 1}-{n}"}
+                                         for n in range(students)])
+
+        def add_encodings(class_data):
+            for student in class_data['students']:
+                encoding = np_rng.normal(0, 0.09, 128)
+                student['encodings'] = [encoding.round(6).tolist()]
+        webapp.update_class(class_name, add_encodings)
+
+        class_data = webapp.get_class(class_name)
+        now = datetime.now()
+        for day in range(sessions):
+            present = [{'student_id': s['student_id'], 'status': 'present' if rng.random() < 0.85 else 'absent'}
+                       for s in class_data['students']]
+            count = sum(1 for p in present if p['status'] == 'present')
+            webapp.save_attendance(class_name, present, now - timedelta(days=day, hours=rng.randrange(8)), count)
+        webapp.log_attendance(class_name, students, int(students * 0.85))
+
+    return {
+        "classes": class_names,
+        "group_photos": [_group_photo(portraits, rng) for _ in range(4)],
+        "portraits": [_jpeg(p) for p in portraits],
+    }
+
+
+# --------------------------
+# Request mixes
+# --------------------------
+def op_upload(fixtures, rng):
+    class_name = rng.choice(fixtures['classes'])
+    return ("POST /attendance/<class>", 'POST', f"/attendance/{class_name}", {},
+            [('group_photo', 'group.jpg', rng.choice(fixtures['group_photos']))])
+
+
+def op_enroll(fixtures, rng, batch=5):
+    class_name = rng.choice(fixtures['classes'])
+    fields, files = {}, []
+    for i in range(batch):
+        fields[f"student_{i}_id"] = f"L{uuid.uuid4().hex[:10]}"
+        fields[f"student_{i}_name"] = f"New Student {i}"
+        files.append((f"student_{i}_photos", 'photo.jpg', rng.choice(fixtures['portraits'])))
+    return ("POST /class/<class>/add_students", 'POST', f"/class/{class_name}/add_students", fields, files)
+
+
+def op_overview(fixtures, rng):
+    return ("GET /api/class-overview", 'GET', "/api/class-overview", None, None)
+
+
+def op_stats(fixtures, rng):
+    return ("GET /api/attendance-stats/<class>", 'GET', f"/api/attendance-stats/{rng.choice(fixtures['classes'])}", None, None)
+
+
+def op_report(fixtures, rng):
+    return ("GET /class_report/<class>", 'GET', f"/class_report/{rng.choice(fixtures['classes'])}", None, None)
+
+
+def op_history(fixtures, rng):
+    return ("GET /attendance/<class>/history", 'GET', f"/attendance/{rng.choice(fixtures['classes'])}/history", None, None)
+
+
+def op_class_page(fixtures, rng):
+    return ("GET /class/<class>", 'GET', f"/class/{rng.choice(fixtures['classes'])}", None, None)
+
+
+def op_index(fixtures, rng):
+    return ("GET /", 'GET', "/", None, None)
+
+
+# phase name -> (share of --requests, [(weight, op), ...])
+PHASES = {
+    'enrollment': (0.25, [(1, op_enroll)]),
+    'burst': (1.0, [(3, op_upload), (7, op_overview)]),
+    'dashboard': (1.0, [(3, op_overview), (1, op_stats)]),
+    'reports': (0.5, [(2, op_report), (2, op_history), (1, op_class_page), (1, op_index)]),
+}
+MIXES = {
+    'enrollment': ['enrollment'],
+    'burst': ['burst'],
+    'dashboard': ['dashboard'],
+    'reports': ['reports'],
+    'semester': ['enrollment', 'burst', 'dashboard', 'reports'],
+}
+
+
+# --------------------------
+# Clients
+# --------------------------
+class InProcessClient:
+    def __init__(self, webapp):
+        self.client = webapp.app.test_client()
+
+    def request(self, method, path, fields=None, files=None):
+        data = dict(fields or {})
+        for field, filename, content in files or []:
+            data.setdefault(field, []).append((io.BytesIO(content), filename))
+        response = self.client.open(path, method=method, data=data if method == 'POST' else None,
+                                    content_type='multipart/form-data' if files else None)
+        response.get_data()
+        return response.status_code
+
+
+class HttpClient:
+    def __init__(self, host, port, timeout=300):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.conn = None
+
+    def request(self, method, path, fields=None, files=None):
+        body, headers = None, {}
+        if method == 'POST':
+            body, content_type = encode_multipart(fields or {}, files or [])
+            headers['Content-Type'] = content_type
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                # server closed a keep-alive connection (e.g. worker recycled)
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+# --------------------------
+# Runner
+# --------------------------
+def run_phase(make_client, fixtures, phase, total, concurrency, seed):
+    share, ops = PHASES[phase]
+    budget = max(1, int(total * share))
+    weights = [w for w, _ in ops]
+    counter = iter(range(budget))
+    counter_lock = threading.Lock()
+    samples = defaultdict(list)   # route -> [(latency, ok)]
+    samples_lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = make_client()
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            op = rng.choices(ops, weights)[0][1]
+            route, method, path, fields, files = op(fixtures, rng)
+            started = time.perf_counter()
+            try:
+                ok = client.request(method, path, fields, files) < 400
+            except Exception:
+                ok = False
+            latency = time.perf_counter() - started
+            with samples_lock:
+                samples[route].append((latency, ok))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for route, values in sorted(samples.items()):
+        latencies = np.array([v[0] for v in values]) * 1000
+        errors = sum(1 for v in values if not v[1])
+        routes[route] = {
+            "requests": len(values),
+            "throughput_rps": len(values) / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "error_rate": errors / len(values),
+        }
+    return {"phase": phase, "elapsed_s": elapsed, "requests": budget,
+            "throughput_rps": budget / elapsed, "routes": routes}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workdir, workers, threads, port, startup_timeout=300):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    cmd = [sys.executable, os.path.join(REPO_DIR, 'run.py'), '--production', '--host', '127.0.0.1',
+           '--port', str(port), '--workers', str(workers), '--threads', str(threads)]
+    server = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with code {server.returncode}")
+        try:
+            if HttpClient('127.0.0.1', port, timeout=5).request('GET', '/') < 500:
+                return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("gunicorn did not start in time")
+
+
+def print_results(runs, out=sys.stdout):
+    for run in runs:
+        label = f"{run['server']}" + (f", {run['workers']} worker(s)" if run['server'] == 'gunicorn' else '')
+        print(f"\n=== {label}, concurrency {run['concurrency']} ===", file=out)
+        print(f"{'phase':<11} {'route':<36} {'req':>5} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}",
+              file=out)
+        for phase in run['phases']:
+            for route, r in phase['routes'].items():
+                print(f"{phase['phase']:<11} {route:<36} {r['requests']:>5} {r['throughput_rps']:>7.1f} "
+                      f"{r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['error_rate']:>6.1%}", file=out)
+            print(f"{phase['phase']:<11} {'(all)':<36} {phase['requests']:>5} {phase['throughput_rps']:>7.1f}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['inprocess', 'gunicorn'], default='inprocess')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2], help="gunicorn worker counts to try")
+    parser.add_argument('--threads', type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16], help="concurrent clients")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='semester')
+    parser.add_argument('--requests', type=int, default=200, help="requests per full-size phase")
+    parser.add_argument('--classes', type=int, default=6)
+    parser.add_argument('--students', type=int, default=60, help="students per class")
+    parser.add_argument('--workdir', help="fixture directory (default: a new temp dir, removed afterwards)")
+    parser.add_argument('--output', help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='attendance-load-'))
+    os.makedirs(workdir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else None
+    cleanup = not args.workdir
+
+    # the app uses paths relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import app as webapp
+
+    print(f"Building fixtures in {workdir} ...")
+    fixtures = build_fixtures(workdir, webapp, classes=args.classes, students=args.students)
+
+    runs = []
+    try:
+        worker_counts = args.workers if args.server == 'gunicorn' else [None]
+        for workers in worker_counts:
+            server, port = None, None
+            if args.server == 'gunicorn':
+                port = _free_port()
+                print(f"Starting gunicorn with {workers} worker(s) on port {port} ...")
+                server = start_gunicorn(workdir, workers, args.threads, port)
+                make_client = lambda: HttpClient('127.0.0.1', port)
+            else:
+                make_client = lambda: InProcessClient(webapp)
+            try:
+                for concurrency in args.concurrency:
+                    phases = []
+                    for seed, phase in enumerate(MIXES[args.mix]):
+                        print(f"  concurrency {concurrency}: {phase} ...")
+                        phases.append(run_phase(make_client, fixtures, phase, args.requests, concurrency, seed))
+                    runs.append({"server": args.server, "workers": workers, "threads": args.threads,
+                                 "concurrency": concurrency, "mix": args.mix, "phases": phases})
+            finally:
+                if server:
+                    server.terminate()
+                    server.wait(timeout=60)
+    finally:
+        os.chdir(REPO_DIR)
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(runs)
+    if output:
+        with open(output, 'w') as f:
+            json.dump({"runs": runs}, f, indent=2)
+        print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,78 @@
+"""
+Multi-process safe local file primitives.
+
+App state goes through storage.py; this module holds the local-disk pieces
+underneath it. LocalStorage (and DirectoryClient) build their locks and
+atomic writes on these, and the CLI reports (reprocess.py,
+roster_import.py) and node-local caches (gallery.py) use them directly:
+
+- file_lock(path): exclusive advisory lock on a "<path>.lock" sidecar file.
+- atomic_open / atomic_write_csv: write to a temp file in the target
+  directory, fsync, then os.replace(), so readers never see a partial file.
+- VersionConflict: raised by Storage.save_versioned_json when a class
+  document was saved by someone else since it was read.
+"""
+import os
+import csv
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class VersionConflict(Exception):
+    """The document on disk is newer than the copy being saved."""
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock for `path` (blocks until it is available)."""
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a+') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def atomic_open(path, mode='w', newline=None):
+    """Open a temp file next to `path`; it replaces `path` on clean exit."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, newline=newline) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_csv(path, rows, fieldnames=None):
+    """Write rows (lists, or dicts when fieldnames is given) atomically."""
+    with atomic_open(path, newline='') as f:
+        if fieldnames:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+        else:
+            writer = csv.writer(f)
+        writer.writerows(rows)
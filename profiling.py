@@ -0,0 +1,173 @@
+"""
+Opt-in request profiling.
+
+When Config.PROFILING is on, every PROFILE_SAMPLE_RATE-th request of a
+worker (or any request sending the PROFILE_HEADER header with the profile
+token) runs under cProfile, with tracemalloc tracing the allocations made
+while it runs. Each sample is written to PROFILE_FOLDER as a .prof file
+(load it with pstats or snakeviz) plus a .json summary with the hottest
+functions and the largest allocations still alive when the request ended.
+Only the newest PROFILE_KEEP samples are kept.
+
+Samples are listed at /_profiles and downloaded from /_profiles/<name>,
+both of which require the token (X-Profile-Token header or ?token=).
+
+Only one request per worker is profiled at a time: cProfile and
+tracemalloc are process-wide, and allocations made by other threads
+while a sample runs show up in its tracemalloc summary.
+"""
+import os
+import io
+import hmac
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import itertools
+import tracemalloc
+from datetime import datetime
+
+from flask import g, request, jsonify, abort, send_from_directory
+
+logger = logging.getLogger(__name__)
+
+_sample_lock = threading.Lock()
+_request_counter = itertools.count(1)
+
+
+def init_profiling(app):
+    """Register the profiling hooks and endpoints if Config.PROFILING is on."""
+    if not app.config.get('PROFILING'):
+        return
+
+    folder = app.config.get('PROFILE_FOLDER', os.path.join('cache', 'profiles'))
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 100)
+    header = app.config.get('PROFILE_HEADER', 'X-Profile')
+    token = app.config.get('PROFILE_TOKEN')
+    keep = app.config.get('PROFILE_KEEP', 50)
+    trace_memory = app.config.get('PROFILE_TRACEMALLOC', True)
+    os.makedirs(folder, exist_ok=True)
+
+    def authorized(value):
+        return bool(token) and bool(value) and hmac.compare_digest(value, token)
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint in ('static', 'list_profiles', 'download_profile'):
+            return
+        sampled = sample_rate > 0 and next(_request_counter) % sample_rate == 0
+        if not (sampled or authorized(request.headers.get(header))):
+            return
+        if not _sample_lock.acquire(blocking=False):
+            return  # another request of this worker is being profiled
+
+        g.profile_started = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start(10)
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    @app.after_request
+    def finish_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+
+        try:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot() if trace_memory else None
+            duration = time.perf_counter() - g.pop('profile_started')
+            save_sample(folder, keep, profiler, snapshot, duration, response.status_code)
+        except Exception as e:
+            logger.warning(f"Could not save profile sample: {e}")
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            _sample_lock.release()
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exc):
+        # after_request does not run when the view raised
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if trace_memory:
+                tracemalloc.stop()
+            _sample_lock.release()
+
+    @app.route('/_profiles')
+    def list_profiles():
+        if not authorized(request.headers.get('X-Profile-Token') or request.args.get('token')):
+            abort(404)
+        samples = []
+        for name in sorted(os.listdir(folder), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(folder, name), 'r') as f:
+                        summary = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                summary.pop('top_functions', None)
+                summary.pop('top_allocations', None)
+                samples.append(summary)
+        return jsonify(samples)
+
+    @app.route('/_profiles/<name>')
+    def download_profile(name):
+        if not authorized(request.headers.get('X-Profile-Token') or request.args.get('token')):
+            abort(404)
+        if not name.endswith(('.prof', '.json')):
+            abort(404)
+        return send_from_directory(os.path.abspath(folder), name, as_attachment=True)
+
+    logger.info(f"Request profiling on: 1 in {sample_rate} requests, samples in {folder}")
+
+
+def save_sample(folder, keep, profiler, snapshot, duration, status):
+    """Write one sample (.prof + .json summary) and trim the ring."""
+    endpoint = request.endpoint or 'unknown'
+    name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}_{endpoint}"
+
+    profiler.dump_stats(os.path.join(folder, f"{name}.prof"))
+
+    stats_text = io.StringIO()
+    pstats.Stats(profiler, stream=stats_text).sort_stats('cumulative').print_stats(30)
+
+    allocations = []
+    if snapshot is not None:
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        for stat in snapshot.statistics('lineno')[:25]:
+            frame = stat.traceback[0]
+            allocations.append({"location": f"{frame.filename}:{frame.lineno}",
+                                "size_kb": round(stat.size / 1024, 1), "count": stat.count})
+
+    summary = {
+        "name": name,
+        "profile": f"{name}.prof",
+        "method": request.method,
+        "path": request.path,
+        "endpoint": endpoint,
+        "status": status,
+        "pid": os.getpid(),
+        "duration_ms": round(duration * 1000, 1),
+        "created_at": datetime.now().isoformat(),
+        "top_functions": stats_text.getvalue(),
+        "top_allocations": allocations,
+    }
+    with open(os.path.join(folder, f"{name}.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    # bounded ring: drop the oldest samples (names sort by time)
+    samples = sorted(n[:-5] for n in os.listdir(folder) if n.endswith('.json'))
+    for old in samples[:-keep] if keep else []:
+        for ext in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(folder, old + ext))
+            except FileNotFoundError:
+                pass
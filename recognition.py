@@ -0,0 +1,396 @@
+"""
+Lazy access to the face recognition stack.
+
+Importing face_recognition loads dlib and its detector, landmark and encoder
+models, which costs seconds of startup and a large chunk of RSS. Dashboard,
+roster and report routes never need them, so the stack is imported the
+first time a recognition path asks for it. Workers that serve recognition
+traffic can call warm_up() up front instead of paying on the first request.
+
+It also holds the detection front end shared by the recognition paths,
+including tiled detection for very large lecture-hall panoramas.
+"""
+import math
+import logging
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_face_recognition = None
+_load_lock = threading.Lock()
+_tile_pool = None
+_encode_pool = None
+_pool_lock = threading.Lock()
+
+# dlib's HOG detector scans an 80x80 window; every upsample halves that
+HOG_MIN_FACE_PX = 80
+
+# How galleries without an 'encoding_profile' were encoded (face_encodings defaults)
+LEGACY_ENCODING = {'landmarks': 'small', 'jitters': 1}
+
+
+def load():
+    """Return the face_recognition module, importing it on first use."""
+    global _face_recognition
+    if _face_recognition is None:
+        with _load_lock:
+            if _face_recognition is None:
+                started = time.perf_counter()
+                import face_recognition
+                _face_recognition = face_recognition
+                logger.info(f"Loaded face_recognition models in {time.perf_counter() - started:.2f}s")
+    return _face_recognition
+
+
+def is_loaded():
+    return _face_recognition is not None
+
+
+def warm_up():
+    """Load the models and run one tiny detection and encoding pass.
+
+    dlib initializes some state lazily on the first call, so running a
+    dummy image through the pipeline makes the first real request fast.
+    """
+    import numpy as np
+
+    face_recognition = load()
+    started = time.perf_counter()
+    image = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_locations(image)
+    face_recognition.face_encodings(image, [(8, 56, 56, 8)])
+    logger.info(f"Recognition warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
+# --------------------------
+# Detection
+# --------------------------
+def detect_faces(image, model='hog', upsample=1):
+    """face_locations on the whole image: [(top, right, bottom, left), ...]"""
+    return load().face_locations(image, number_of_times_to_upsample=upsample, model=model)
+
+
+def _detect_tile(task):
+    """Process pool entry point: detect faces in one tile."""
+    tile, upsample, model = task
+    return load().face_locations(tile, number_of_times_to_upsample=upsample, model=model)
+
+
+def _process_pool(workers):
+    # Never fork a (possibly multi-threaded) web worker; pools are
+    # long-lived, so paying the model import once per child is fine
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+
+def _get_tile_pool(workers):
+    global _tile_pool
+    with _pool_lock:
+        if _tile_pool is None:
+            _tile_pool = _process_pool(workers)
+    return _tile_pool
+
+
+def _get_encode_pool(workers):
+    global _encode_pool
+    with _pool_lock:
+        if _encode_pool is None:
+            _encode_pool = _process_pool(workers)
+    return _encode_pool
+
+
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    starts = list(range(0, length - tile_size + 1, step))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+
+def _fit_face_size(boxes):
+    """Least-squares fit of face height against vertical position.
+
+    In a lecture hall the camera looks down the rows, so face size shrinks
+    roughly linearly towards the back (top of the image). Returns a function
+    y -> expected face height, or None with too few faces to fit.
+    """
+    import numpy as np
+
+    if len(boxes) < 3:
+        return None
+    centers = np.array([(top + bottom) / 2 for top, _, bottom, _ in boxes], dtype=float)
+    heights = np.array([bottom - top for top, _, bottom, _ in boxes], dtype=float)
+    if np.ptp(centers) < 1:
+        return None
+    slope, intercept = np.polyfit(centers, heights, 1)
+    return lambda y: slope * y + intercept
+
+
+def _upsample_for(expected_face_px, max_upsample):
+    if expected_face_px >= HOG_MIN_FACE_PX:
+        return 0
+    needed = math.ceil(math.log2(HOG_MIN_FACE_PX / max(expected_face_px, 1.0)))
+    return min(max_upsample, needed)
+
+
+def _box_score(box, tile):
+    """How far a box sits from the inner seams of its tile, relative to its size.
+
+    Boxes cut by a seam are truncated; when the same face is found in two
+    overlapping tiles the one further from the seam is the complete one.
+    Image borders are not seams.
+    """
+    top, right, bottom, left = box
+    y0, x0, y1, x1, height, width = tile
+    gaps = []
+    if y0 > 0:
+        gaps.append(top - y0)
+    if x0 > 0:
+        gaps.append(left - x0)
+    if y1 < height:
+        gaps.append(y1 - bottom)
+    if x1 < width:
+        gaps.append(x1 - right)
+    size = max(bottom - top, right - left, 1)
+    return min(1.0, min(gaps) / size) if gaps else 1.0
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.3, containment_threshold=0.6):
+    """Greedy NMS over (top, right, bottom, left) boxes.
+
+    Besides IoU, a box mostly contained in a better one is dropped: a face
+    truncated by a tile seam overlaps its full detection with a low IoU.
+    """
+    order = sorted(range(len(boxes)), key=lambda i: scores[i], reverse=True)
+    kept = []
+    for i in order:
+        top, right, bottom, left = boxes[i]
+        area = max(1, (bottom - top) * (right - left))
+        duplicate = False
+        for j in kept:
+            k_top, k_right, k_bottom, k_left = boxes[j]
+            ih = min(bottom, k_bottom) - max(top, k_top)
+            iw = min(right, k_right) - max(left, k_left)
+            if ih <= 0 or iw <= 0:
+                continue
+            inter = ih * iw
+            k_area = max(1, (k_bottom - k_top) * (k_right - k_left))
+            if inter / (area + k_area - inter) > iou_threshold or inter / min(area, k_area) > containment_threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(i)
+    return [boxes[i] for i in sorted(kept)]
+
+
+def _run_tiles(tasks, workers):
+    if workers > 1 and len(tasks) > 1:
+        return list(_get_tile_pool(workers).map(_detect_tile, tasks))
+    return [_detect_tile(task) for task in tasks]
+
+
+def detect_faces_tiled(image, model='hog', tile_size=1024, coarse_dim=1600, max_upsample=2, workers=2):
+    """Detect faces in a very large image using overlapping tiles.
+
+    1. A coarse pass on a downscaled copy finds the large (front-row) faces.
+    2. Every full-resolution tile is scanned once without upsampling.
+    3. Face height is modelled against image row from everything found so
+       far, and only the tiles where faces are expected to be too small for
+       the previous scan are re-scanned at the upsampling they need. This
+       repeats (at most max_upsample times) as the model gets more data.
+    4. Tiles run in a process pool and all boxes are merged across seams
+       with non-maximum suppression.
+    """
+    import numpy as np
+    from PIL import Image
+
+    height, width = image.shape[:2]
+    scale = min(1.0, coarse_dim / max(height, width))
+    if scale < 1.0:
+        small = Image.fromarray(image).resize((max(1, int(width * scale)), max(1, int(height * scale))))
+        coarse = [(int(t / scale), int(r / scale), int(b / scale), int(l / scale))
+                  for t, r, b, l in detect_faces(np.asarray(small), model=model, upsample=1)]
+    else:
+        coarse = detect_faces(image, model=model, upsample=1)
+
+    # Faces at least this big were visible to the coarse pass, so the tile
+    # overlap only has to keep faces smaller than that whole
+    coarse_min_face = (HOG_MIN_FACE_PX / 2) / scale
+    overlap = int(min(tile_size // 2, coarse_min_face + 16))
+
+    tiles = []
+    for y0 in _tile_starts(height, tile_size, overlap):
+        for x0 in _tile_starts(width, tile_size, overlap):
+            tiles.append((y0, x0, min(height, y0 + tile_size), min(width, x0 + tile_size), height, width))
+
+    def tile_boxes(index):
+        y0, x0 = tiles[index][0], tiles[index][1]
+        return [(t + y0, r + x0, b + y0, l + x0) for t, r, b, l in results[index]]
+
+    upsampled = [0] * len(tiles)
+    def crop(tile):
+        # dlib needs contiguous buffers
+        return np.ascontiguousarray(image[tile[0]:tile[2], tile[1]:tile[3]])
+
+    results = _run_tiles([(crop(t), 0, model) for t in tiles], workers)
+    scans = len(tiles)
+
+    for _ in range(max_upsample):
+        found = list(coarse)
+        for i in range(len(tiles)):
+            found.extend(tile_boxes(i))
+        face_size = _fit_face_size(found)
+
+        todo = []
+        for i, (y0, x0, y1, x1, _, _) in enumerate(tiles):
+            if face_size:
+                # smallest face expected anywhere in the tile
+                needed = _upsample_for(min(face_size(y0), face_size(y1)), max_upsample)
+            else:
+                needed = upsampled[i] + 1
+            if needed > upsampled[i]:
+                todo.append((i, needed))
+        if not todo:
+            break
+
+        # An upsampled scan also covers the larger faces, so it replaces the old one
+        rescans = _run_tiles([(crop(tiles[i]), up, model) for i, up in todo], workers)
+        for (i, up), found_in_tile in zip(todo, rescans):
+            results[i] = found_in_tile
+            upsampled[i] = up
+        scans += len(todo)
+
+    boxes, scores = [], []
+    for box in coarse:
+        boxes.append(box)
+        scores.append(0.5)  # localized at low resolution
+    for i, tile in enumerate(tiles):
+        for box in tile_boxes(i):
+            boxes.append(box)
+            scores.append(_box_score(box, tile))
+
+    logger.info(f"Tiled detection: {len(tiles)} tiles, {scans} tile scans, "
+                f"upsampling {sorted(set(upsampled))}, {len(boxes)} raw boxes")
+    return non_max_suppression(boxes, scores)
+
+
+# --------------------------
+# Quality gating and encoding
+# --------------------------
+def face_sharpness(image, location, sample_px=64):
+    """Variance of the Laplacian of the face crop, resampled to a fixed size
+    so the score does not depend on how large the face is."""
+    import numpy as np
+    from PIL import Image
+
+    top, right, bottom, left = location
+    height, width = image.shape[:2]
+    crop = image[max(0, top):min(height, bottom), max(0, left):min(width, right)]
+    if crop.size == 0:
+        return 0.0
+    gray = np.asarray(Image.fromarray(crop).convert('L').resize((sample_px, sample_px), Image.BILINEAR),
+                      dtype=np.float32)
+    laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1]
+                 - gray[1:-1, :-2] - gray[1:-1, 2:])
+    return float(laplacian.var())
+
+
+def face_yaw(shape, landmark_model):
+    """Horizontal offset of the nose from the eye midpoint, in inter-eye
+    distances. ~0 for a frontal face, growing towards 0.5+ in profile."""
+    import numpy as np
+
+    points = np.array([(p.x, p.y) for p in shape.parts()], dtype=float)
+    if landmark_model == 'small':
+        right_eye, left_eye, nose = points[0:2].mean(0), points[2:4].mean(0), points[4]
+    else:
+        right_eye, left_eye, nose = points[36:42].mean(0), points[42:48].mean(0), points[30]
+
+    axis = left_eye - right_eye
+    eye_distance = float(np.linalg.norm(axis))
+    if eye_distance < 1:
+        return 1.0
+    offset = np.dot(nose - (left_eye + right_eye) / 2, axis / eye_distance)
+    return abs(float(offset)) / eye_distance
+
+
+def encode_faces(image, locations, landmark_model='small', num_jitters=1, quality=None):
+    """Encode detected faces, optionally skipping ones that cannot match.
+
+    quality is None (encode everything) or a dict with min_face_px,
+    min_sharpness and max_yaw. Size and sharpness are checked before any
+    landmarks are computed; pose uses the same landmarks the encoder then
+    reuses, so gating adds no second landmark pass.
+
+    Returns (kept_locations, encodings, skipped) where skipped is a list of
+    {"location", "reason", "value"} dicts.
+    """
+    import numpy as np
+    from face_recognition import api
+
+    load()
+    candidates, skipped = [], []
+    for location in locations:
+        if quality:
+            top, right, bottom, left = location
+            size = min(bottom - top, right - left)
+            if size < quality['min_face_px']:
+                skipped.append({"location": location, "reason": "too_small", "value": int(size)})
+                continue
+            sharpness = face_sharpness(image, location)
+            if sharpness < quality['min_sharpness']:
+                skipped.append({"location": location, "reason": "blurred", "value": round(sharpness, 1)})
+                continue
+        candidates.append(location)
+
+    kept, encodings = [], []
+    shapes = api._raw_face_landmarks(image, candidates, model=landmark_model) if candidates else []
+    for location, shape in zip(candidates, shapes):
+        if quality:
+            yaw = face_yaw(shape, landmark_model)
+            if yaw > quality['max_yaw']:
+                skipped.append({"location": location, "reason": "pose", "value": round(yaw, 2)})
+                continue
+        kept.append(location)
+        encodings.append(np.array(api.face_encoder.compute_face_descriptor(image, shape, num_jitters)))
+
+    return kept, encodings, skipped
+
+
+# --------------------------
+# Batch enrollment
+# --------------------------
+def _encode_photo(task):
+    """Process pool entry point: (encoding, error) of the first face in an image file."""
+    import io
+
+    data, profile = task
+    try:
+        image = load().load_image_file(io.BytesIO(data))
+    except Exception:
+        return None, "not a readable image"
+    locations = detect_faces(image, model=profile['detector'], upsample=profile['upsample'])
+    if not locations:
+        return None, "no face detected"
+    _, encodings, _ = encode_faces(image, locations[:1], landmark_model=profile['landmarks'],
+                                   num_jitters=profile['jitters'])
+    if not encodings:
+        return None, "no face detected"
+    return encodings[0].tolist(), None
+
+
+def encode_photos(photos, profile, workers=2):
+    """[(encoding or None, error)] for a batch of image files (bytes), in order.
+
+    With workers > 1 the batch is spread over a long-lived process pool, so
+    bulk imports use every core while the web worker only coordinates.
+    """
+    tasks = [(data, profile) for data in photos]
+    if workers > 1 and len(tasks) > 1:
+        return list(_get_encode_pool(workers).map(_encode_photo, tasks))
+    return [_encode_photo(task) for task in tasks]
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Re-run recognition over archived group photos of a class.
+
+After re-enrolling students or changing MATCH_THRESHOLD, past sessions were
+recorded with the old gallery. This re-processes the uploads of a class in a
+date range with the current gallery and compares the result with the saved
+attendance_*.csv sessions:
+
+    python reprocess.py CSE-22 --from 2025-09-01 --to 2025-12-31
+    python reprocess.py CSE-22 --tolerance 0.55 --report diff.csv
+    python reprocess.py CSE-22 --list        # show which uploads would run
+
+Results are appended to a JSONL checkpoint as each photo finishes, so an
+interrupted run resumes where it stopped (records made with different
+settings are ignored, not reused).
+
+Uploads live in uploads/<class>/. Older uploads sit directly in uploads/ and
+are attributed to a class through the annotated image written a few seconds
+after them (static/annotated/<class>_<timestamp>.jpg).
+"""
+import io
+import os
+import re
+import csv
+import json
+import argparse
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app as webapp
+from persistence import atomic_write_csv
+
+TIMESTAMP_RE = re.compile(r'(\d{8})_(\d{6})')
+LEGACY_UPLOAD_WINDOW = timedelta(minutes=5)   # upload -> annotated image
+SESSION_WINDOW = timedelta(hours=3)           # upload -> saved session
+
+
+def parse_timestamp(filename):
+    match = TIMESTAMP_RE.search(filename)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(''.join(match.groups()), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+
+
+def is_image(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in webapp.ALLOWED_EXTENSIONS
+
+
+def find_uploads(class_name, safe_name, start, end):
+    """[(taken_at, path)] of a class's group photos taken in [start, end)."""
+    uploads = []
+
+    class_dir = os.path.join(webapp.UPLOAD_FOLDER, safe_name)
+    for filename in webapp.storage.list(class_dir):
+        taken_at = parse_timestamp(filename)
+        if taken_at and is_image(filename):
+            uploads.append((taken_at, os.path.join(class_dir, filename)))
+
+    # legacy flat uploads: matched to the class by its annotated images
+    annotated = []
+    prefix = f"{class_name}_"
+    for filename in webapp.storage.list(webapp.ANNOTATED_FOLDER):
+        if filename.startswith(prefix) and TIMESTAMP_RE.fullmatch(filename[len(prefix):].rsplit('.', 1)[0]):
+            annotated.append(parse_timestamp(filename))
+    annotated.sort()
+
+    if annotated:
+        for filename in webapp.storage.list(webapp.UPLOAD_FOLDER):
+            path = os.path.join(webapp.UPLOAD_FOLDER, filename)
+            taken_at = parse_timestamp(filename)
+            # class sub-folders have no timestamp/extension and drop out here
+            if not taken_at or not is_image(filename):
+                continue
+            i = bisect_left(annotated, taken_at)
+            if i < len(annotated) and annotated[i] - taken_at <= LEGACY_UPLOAD_WINDOW:
+                uploads.append((taken_at, path))
+
+    return sorted(u for u in uploads if start <= u[0] < end)
+
+
+def read_session(path):
+    """{student_id: status} of a saved attendance_*.csv session."""
+    statuses = {}
+    rows = csv.reader(io.StringIO(webapp.storage.read_text(path), newline=''))
+    for row in rows:
+        if row[:3] == ["Student ID", "Name", "Status"]:
+            break
+    for row in rows:
+        if len(row) >= 3:
+            statuses[row[0]] = row[2]
+    return statuses
+
+
+def find_sessions(safe_name):
+    """[(saved_at, path)] of a class's saved sessions, oldest first."""
+    attendance_dir = os.path.join(webapp.ATTENDANCE_DATA_FOLDER, safe_name)
+    return [(datetime.strptime(session['timestamp'], "%Y-%m-%dT%H:%M:%S"),
+             os.path.join(attendance_dir, session['filename']))
+            for session in webapp.load_session_index(safe_name)]
+
+
+def session_for_upload(sessions, uploads, taken_at):
+    """The first session saved after an upload and before the next one."""
+    later = [t for t, _ in uploads if t > taken_at]
+    until = min([taken_at + SESSION_WINDOW] + later)
+    for saved_at, path in sessions:
+        if taken_at <= saved_at <= until:
+            return path
+    return None
+
+
+# --------------------------
+# Workers
+# --------------------------
+def _init_worker():
+    # tiles run inline: the pool already uses every core
+    webapp.app.config['TILE_WORKERS'] = 1
+
+
+def process_upload(task):
+    """Pool entry point: recognize one archived photo."""
+    class_name, path, settings = task
+    record = {"upload": path, "settings": settings}
+    class_data = webapp.get_class(class_name)
+    try:
+        image = webapp.recognition.load().load_image_file(webapp.storage.open_image(path))
+        matched = webapp.match_faces(class_data, image, tolerance=settings['tolerance'],
+                                     margin=settings['margin'], profile=settings['profile'])
+    except Exception as e:
+        record["error"] = str(e)
+        return record
+
+    record["present"] = sorted({face["student_id"] for face in matched["recognized_faces"]})
+    record["unknown"] = len(matched["unknown_faces"])
+    record["skipped"] = len(matched["skipped_faces"])
+    return record
+
+
+def load_checkpoint(path, settings):
+    done = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of an interrupted run
+                if record.get("settings") == settings and "error" not in record:
+                    done[record["upload"]] = record
+    return done
+
+
+def run(class_name, uploads, settings, checkpoint, workers):
+    """Process uploads not yet in the checkpoint; returns upload -> record."""
+    done = load_checkpoint(checkpoint, settings)
+    todo = [path for _, path in uploads if path not in done]
+    print(f"{len(uploads)} upload(s), {len(uploads) - len(todo)} already in {checkpoint}")
+    if not todo:
+        return done
+
+    os.makedirs(os.path.dirname(checkpoint) or '.', exist_ok=True)
+    with open(checkpoint, 'a') as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(process_upload, (class_name, path, settings)) for path in todo]
+        for finished, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            if "error" in record:
+                print(f"[{finished}/{len(todo)}] {record['upload']}: {record['error']}")
+            else:
+                done[record["upload"]] = record
+                print(f"[{finished}/{len(todo)}] {record['upload']}: {len(record['present'])} present")
+    return done
+
+
+def diff_report(class_data, uploads, records, sessions):
+    """Rows of students whose re-processed status differs from the saved one."""
+    names = {s['student_id']: s['name'] for s in class_data['students']}
+    rows, summary = [], {"compared": 0, "no_session": 0, "to_present": 0, "to_absent": 0}
+    for taken_at, path in uploads:
+        record = records.get(path)
+        if not record:
+            continue
+        session = session_for_upload(sessions, uploads, taken_at)
+        if not session:
+            summary["no_session"] += 1
+            continue
+        summary["compared"] += 1
+
+        saved = read_session(session)
+        present = set(record["present"])
+        for student_id, name in names.items():
+            new = "present" if student_id in present else "absent"
+            old = saved.get(student_id, "absent")
+            if old != new:
+                summary["to_present" if new == "present" else "to_absent"] += 1
+                rows.append({
+                    "session": os.path.basename(session),
+                    "upload": path,
+                    "taken_at": taken_at.strftime("%Y-%m-%d %H:%M:%S"),
+                    "student_id": student_id,
+                    "name": name,
+                    "saved": old,
+                    "reprocessed": new,
+                })
+    return rows, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('class_name')
+    parser.add_argument('--from', dest='start', default='1970-01-01', help="first day (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', default='9999-12-30', help="last day (YYYY-MM-DD), inclusive")
+    parser.add_argument('--tolerance', type=float, default=webapp.MATCH_THRESHOLD)
+    parser.add_argument('--margin', type=float, default=0.02)
+    parser.add_argument('--profile', default=webapp.ATTENDANCE_PROFILE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--checkpoint', help="JSONL checkpoint (default cache/reprocess/<class>.jsonl)")
+    parser.add_argument('--report', help="write differing students to this CSV")
+    parser.add_argument('--list', action='store_true', help="list matching uploads and exit")
+    args = parser.parse_args(argv)
+
+    class_data = webapp.get_class(args.class_name)
+    if not class_data:
+        parser.error(f"Class '{args.class_name}' not found")
+    safe_name = class_data['safe_name']
+
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    end = datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)
+    uploads = find_uploads(args.class_name, safe_name, start, end)
+    sessions = find_sessions(safe_name)
+
+    if args.list:
+        for taken_at, path in uploads:
+            session = session_for_upload(sessions, uploads, taken_at)
+            print(f"{taken_at:%Y-%m-%d %H:%M:%S}  {path}  ->  {os.path.basename(session) if session else '-'}")
+        return 0
+
+    settings = {"tolerance": args.tolerance, "margin": args.margin, "profile": args.profile,
+                "class_version": class_data.get('version', 0)}
+    checkpoint = args.checkpoint or os.path.join('cache', 'reprocess', f"{safe_name}.jsonl")
+    records = run(args.class_name, uploads, settings, checkpoint, max(1, args.workers))
+
+    rows, summary = diff_report(class_data, uploads, records, sessions)
+    print(f"\n{summary['compared']} session(s) compared, {summary['no_session']} upload(s) without a saved session")
+    print(f"{summary['to_present']} absent -> present, {summary['to_absent']} present -> absent")
+    for row in rows[:50]:
+        print(f"  {row['taken_at']}  {row['student_id']:>10}  {row['name']:<24} {row['saved']} -> {row['reprocessed']}")
+    if len(rows) > 50:
+        print(f"  ... {len(rows) - 50} more")
+
+    if args.report:
+        atomic_write_csv(args.report, rows, fieldnames=["session", "upload", "taken_at", "student_id",
+                                                         "name", "saved", "reprocessed"])
+        print(f"Report written to {args.report}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
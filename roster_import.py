@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Bulk roster import.
+
+Enrolls a whole roster from a CSV (student_id,name[,photo]) and an optional
+ZIP of photos named by student ID (22CS001.jpg, or any name given in the
+photo column):
+
+    POST /class/<class_name>/import      form fields "roster" (CSV) and "photos" (ZIP)
+
+    python roster_import.py CSE-22 roster.csv --photos photos.zip --workers 8 --report errors.csv
+
+The CSV is read row by row and the ZIP member by member from its central
+directory; nothing is extracted to disk. Photos are encoded in batches on a
+process pool (recognition.encode_photos), and the roster and all encodings
+are committed to the class in one save. Problems are reported per row and
+never stop the rest of the import.
+"""
+import io
+import os
+import csv
+import argparse
+import posixpath
+
+HEADER_ALIASES = {'student_id': 'student_id', 'studentid': 'student_id', 'id': 'student_id',
+                  'name': 'name', 'student_name': 'name', 'photo': 'photo', 'photo_file': 'photo'}
+
+
+def read_roster(stream):
+    """(row_number, student_id, name, photo, error) for each data row of a roster CSV.
+
+    stream is a binary file; the header names the columns (student_id and
+    name, optionally photo) in any order and case.
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = next(reader, None)
+    columns = {}
+    for index, title in enumerate(header or []):
+        key = HEADER_ALIASES.get(title.strip().lower().replace(' ', '_'))
+        if key and key not in columns:
+            columns[key] = index
+    if 'student_id' not in columns or 'name' not in columns:
+        yield 1, '', '', '', "header must have student_id and name columns"
+        return
+
+    seen = set()
+    for row_number, row in enumerate(reader, 2):
+        if not any(cell.strip() for cell in row):
+            continue
+        cell = lambda key: row[columns[key]].strip() if key in columns and columns[key] < len(row) else ''
+        student_id, name, photo = cell('student_id'), cell('name'), cell('photo')
+        error = None
+        if not student_id or not name:
+            error = "student_id and name are required"
+        elif student_id in seen:
+            error = f"duplicate student_id {student_id}"
+        seen.add(student_id)
+        yield row_number, student_id, name, photo, error
+
+
+def photo_index(archive, allowed_extensions):
+    """{name: ZipInfo} of the image members of a ZIP, by file name and by stem."""
+    members = {}
+    for info in archive.infolist():
+        filename = posixpath.basename(info.filename)
+        stem, extension = os.path.splitext(filename)
+        if info.is_dir() or filename.startswith('.') or extension[1:].lower() not in allowed_extensions:
+            continue
+        members.setdefault(filename, info)
+        members.setdefault(stem, info)
+    return members
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('class_name')
+    parser.add_argument('roster', help="CSV with student_id and name (and optionally photo) columns")
+    parser.add_argument('--photos', help="ZIP of photos named by student_id")
+    parser.add_argument('--workers', type=int, default=None, help="encoding processes (default IMPORT_WORKERS)")
+    parser.add_argument('--report', help="write per-row problems to this CSV")
+    args = parser.parse_args(argv)
+
+    import app as webapp
+    from persistence import atomic_write_csv
+
+    with open(args.roster, 'rb') as roster, \
+            (open(args.photos, 'rb') if args.photos else io.BytesIO()) as photos:
+        success, result = webapp.import_students(args.class_name, roster, photos if args.photos else None,
+                                                 workers=args.workers)
+    if not success:
+        parser.error(result)
+
+    print(result['message'])
+    for problem in result['problems'][:50]:
+        print(f"  row {problem['row']:>5}  {problem['student_id']:>12}  {problem['problem']}")
+    if len(result['problems']) > 50:
+        print(f"  ... {len(result['problems']) - 50} more")
+    if args.report:
+        atomic_write_csv(args.report, result['problems'], fieldnames=["row", "student_id", "problem"])
+        print(f"Report written to {args.report}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
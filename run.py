@@ -1,39 +1,206 @@
 #!/usr/bin/env python3
 """
 Smart Attendance System - Startup Script
+
+    python run.py                    # start the server (models load on first use)
+    python run.py --preload          # load recognition models before serving
+    python run.py --debug            # Flask debugger + auto reloader
+    python run.py --download-models  # fetch the dlib landmark model and exit
+    python run.py --production       # gunicorn sized for this machine
+
+Production mode sizes gunicorn from the CPUs and memory actually available
+to the process (cgroup limits included), loads the dlib models once in the
+master so forked workers share them copy-on-write, and recycles workers
+after a number of requests. Every value can be overridden with a flag or
+environment variable (WEB_CONCURRENCY, GUNICORN_THREADS, MAX_REQUESTS).
 """
 import os
-from app import app
+import gc
+import argparse
 import urllib.request
 
-# --------------------------
-# 1) Ensure necessary folders
-# --------------------------
-os.makedirs('uploads', exist_ok=True)
-os.makedirs('data', exist_ok=True)
-os.makedirs('known_faces', exist_ok=True)
-os.makedirs('attendance_data', exist_ok=True)
-os.makedirs('models', exist_ok=True)
-
-# --------------------------
-# 2) Download model if missing
-# --------------------------
+from config import Config
+
 MODEL_URL = "https://github.com/davisking/dlib-models/raw/master/shape_predictor_68_face_landmarks.dat.bz2"
 MODEL_PATH = "models/shape_predictor_68_face_landmarks.dat.bz2"
 
-if not os.path.exists(MODEL_PATH):
-    print("Model not found, downloading...")
-    urllib.request.urlretrieve(MODEL_URL, MODEL_PATH)
-else:
-    print("Model already exists, skipping download.")
-
-# --------------------------
-# 3) Start the Flask app
-# --------------------------
-print("=" * 50)
-print("Starting Smart Attendance System...")
-print("=" * 50)
-print("Open http://localhost:5000 in your browser")
-print("=" * 50)
-
-app.run(debug=True, host='0.0.0.0', port=5000)
+
+def download_models():
+    os.makedirs('models', exist_ok=True)
+    if not os.path.exists(MODEL_PATH):
+        print("Model not found, downloading...")
+        urllib.request.urlretrieve(MODEL_URL, MODEL_PATH)
+    else:
+        print("Model already exists, skipping download.")
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    """CPUs this process may use, honouring affinity and cgroup quotas."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = _read_first_line('/sys/fs/cgroup/cpu.max')  # cgroup v2: "<quota> <period>"
+    if quota and not quota.startswith('max'):
+        limit, period = quota.split()
+        cpus = min(cpus, max(1, int(limit) // int(period)))
+    else:
+        limit = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')  # cgroup v1
+        period = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if limit and period and int(limit) > 0:
+            cpus = min(cpus, max(1, int(limit) // int(period)))
+    return cpus
+
+
+def available_memory_mb():
+    """Memory available to this process in MB (None if unknown)."""
+    candidates = []
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read_first_line(path)
+        if value and value.isdigit() and int(value) < 1 << 60:
+            candidates.append(int(value) // (1024 * 1024))
+
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    candidates.append(int(line.split()[1]) // 1024)
+                    break
+    except OSError:
+        pass
+    return min(candidates) if candidates else None
+
+
+def production_options(args):
+    """Gunicorn settings derived from the machine, Config and overrides."""
+    cpus = available_cpus()
+    memory_mb = available_memory_mb()
+
+    # Recognition is CPU bound (dlib holds the GIL), so one worker per core;
+    # threads only help the I/O-light dashboard routes
+    workers = cpus
+    if memory_mb is not None:
+        fits = (memory_mb - Config.SHARED_MODEL_MEMORY_MB) // Config.WORKER_MEMORY_MB
+        workers = min(workers, max(1, fits))
+
+    workers = args.workers or int(os.environ.get('WEB_CONCURRENCY', workers))
+    threads = args.threads or int(os.environ.get('GUNICORN_THREADS', Config.THREADS_PER_WORKER))
+    max_requests = args.max_requests if args.max_requests is not None else \
+        int(os.environ.get('MAX_REQUESTS', Config.WORKER_MAX_REQUESTS))
+
+    return {
+        'bind': f"{args.host}:{args.port}",
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'preload_app': not args.lazy,
+        'max_requests': max_requests,
+        'max_requests_jitter': Config.WORKER_MAX_REQUESTS_JITTER if max_requests else 0,
+        'timeout': Config.WORKER_TIMEOUT,
+        'accesslog': '-',
+    }, cpus, memory_mb
+
+
+def run_production(args):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("--production needs gunicorn (pip install gunicorn); it is not available on Windows")
+
+    options, cpus, memory_mb = production_options(args)
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            import recognition
+
+            if options['preload_app']:
+                # Loaded once here in the master; workers inherit the pages.
+                # Freezing moves everything allocated so far out of the GC's
+                # reach so collections in workers don't dirty the shared pages.
+                recognition.warm_up()
+                gc.freeze()
+            return app
+
+    print("=" * 50)
+    print("Starting Smart Attendance System (production)")
+    print("=" * 50)
+    print(f"CPUs available:      {cpus}")
+    print(f"Memory available:    {f'{memory_mb} MB' if memory_mb is not None else 'unknown'}")
+    for key in ('bind', 'workers', 'threads', 'worker_class', 'preload_app',
+                'max_requests', 'max_requests_jitter', 'timeout'):
+        print(f"{key + ':':<21}{options[key]}")
+    print("=" * 50)
+
+    ProductionServer().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start the Smart Attendance System")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--debug', action='store_true',
+                        help="enable the debugger and reloader (loads the app twice)")
+    parser.add_argument('--preload', action='store_true',
+                        help="load the face recognition models before serving")
+    parser.add_argument('--download-models', action='store_true',
+                        help="download the dlib landmark model and exit")
+    parser.add_argument('--production', action='store_true',
+                        help="serve with gunicorn, sized for this machine")
+    parser.add_argument('--workers', type=int, help="production: override the worker count")
+    parser.add_argument('--threads', type=int, help="production: override threads per worker")
+    parser.add_argument('--max-requests', type=int,
+                        help="production: recycle a worker after this many requests (0 disables)")
+    parser.add_argument('--lazy', action='store_true',
+                        help="production: don't preload the app and models in the master")
+    args = parser.parse_args()
+
+    if args.download_models:
+        download_models()
+        return
+
+    # --------------------------
+    # 1) Ensure necessary folders
+    # --------------------------
+    os.makedirs('uploads', exist_ok=True)
+    os.makedirs('data', exist_ok=True)
+    os.makedirs('known_faces', exist_ok=True)
+    os.makedirs('attendance_data', exist_ok=True)
+
+    # --------------------------
+    # 2) Start the Flask app
+    # --------------------------
+    if args.production:
+        run_production(args)
+        return
+
+    from app import app
+    import recognition
+
+    if args.preload:
+        recognition.warm_up()
+
+    print("=" * 50)
+    print("Starting Smart Attendance System...")
+    print("=" * 50)
+    print(f"Open http://localhost:{args.port} in your browser")
+    print("=" * 50)
+
+    app.run(debug=args.debug, use_reloader=args.debug, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+// Client-side downscaling and resumable chunked uploads.
+//
+// Forms marked with data-chunked-upload re-encode their photos as JPEG,
+// scaled down to data-max-megapixels, and send them to /uploads in chunks
+// (see chunked_upload.py). A dropped connection is retried with backoff and
+// resumes at the offset the server reports. The form is then submitted with
+// "<field>_upload" ids in place of the files. data-upload-kind="roster"
+// forms send CSV/ZIP files as they are, under the roster import limits.
+(function() {
+    const MAX_RETRIES = 8;
+
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+    async function downscale(file, maxMegapixels, quality) {
+        if (!file.type.startsWith('image/') || !window.createImageBitmap) return file;
+
+        let bitmap;
+        try {
+            bitmap = await createImageBitmap(file, {imageOrientation: 'from-image'});
+        } catch (e) {
+            return file;  // a format this browser cannot decode; send it as is
+        }
+        const scale = Math.min(1, Math.sqrt(maxMegapixels * 1e6 / (bitmap.width * bitmap.height)));
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.round(bitmap.width * scale);
+        canvas.height = Math.round(bitmap.height * scale);
+        canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+        bitmap.close();
+
+        const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality));
+        if (!blob || (scale === 1 && blob.size >= file.size)) return file;
+        return new File([blob], file.name.replace(/\.[^.]*$/, '') + '.jpg', {type: 'image/jpeg'});
+    }
+
+    async function send(method, url, body, contentType) {
+        const response = await fetch(url, {
+            method: method,
+            body: body,
+            headers: {'Content-Type': contentType},
+            credentials: 'same-origin'
+        });
+        const data = await response.json().catch(() => ({}));
+        return {status: response.status, data: data};
+    }
+
+    async function uploadFile(file, kind, onProgress) {
+        const started = await send('POST', '/uploads',
+            JSON.stringify({filename: file.name, size: file.size, kind: kind}), 'application/json');
+        if (started.status !== 201) throw new Error(started.data.error || 'Upload could not be started');
+
+        const uploadId = started.data.upload_id;
+        const chunkSize = started.data.chunk_size;
+        let offset = 0;
+        let failures = 0;
+        while (offset < file.size) {
+            let result = null;
+            try {
+                result = await send('PUT', `/uploads/${uploadId}?offset=${offset}`,
+                    file.slice(offset, offset + chunkSize), 'application/octet-stream');
+            } catch (e) {
+                // network error: fall through to the retry below
+            }
+
+            if (result && (result.status === 200 || result.status === 409)) {
+                // 409: the server has a different offset (e.g. a lost response); continue from there
+                offset = result.data.offset;
+                failures = 0;
+                onProgress(offset / file.size);
+                continue;
+            }
+            if (result && result.status < 500) throw new Error(result.data.error || 'Upload failed');
+
+            if (++failures > MAX_RETRIES) throw new Error('Connection lost');
+            onProgress(offset / file.size, true);
+            if (!navigator.onLine) {
+                await new Promise(resolve => window.addEventListener('online', resolve, {once: true}));
+            }
+            await sleep(Math.min(30000, 1000 * 2 ** (failures - 1)));
+        }
+        return uploadId;
+    }
+
+    function enhance(form) {
+        const status = form.querySelector('[data-upload-status]');
+        const show = text => { if (status) status.textContent = text; };
+
+        form.addEventListener('submit', async function(event) {
+            const inputs = [...form.querySelectorAll('input[type=file]')].filter(input => input.files.length && !input.disabled);
+            if (!inputs.length || !window.fetch) return;
+            event.preventDefault();
+
+            const kind = form.dataset.uploadKind || 'image';
+            const maxMegapixels = parseFloat(form.dataset.maxMegapixels) || 5;
+            const quality = parseFloat(form.dataset.jpegQuality) || 0.85;
+            const buttons = form.querySelectorAll('[type=submit]');
+            buttons.forEach(button => button.disabled = true);
+            form.querySelectorAll('input[data-upload-id]').forEach(input => input.remove());
+
+            const files = inputs.flatMap(input => [...input.files].map(file => ({input: input, file: file})));
+            try {
+                for (const [index, item] of files.entries()) {
+                    const noun = kind === 'image' ? 'photo' : 'file';
+                    const label = files.length > 1 ? `${noun} ${index + 1} of ${files.length}` : noun;
+                    show(`Preparing ${label}…`);
+                    const file = kind === 'image' ? await downscale(item.file, maxMegapixels, quality) : item.file;
+                    const uploadId = await uploadFile(file, kind, (done, retrying) => show(
+                        `${retrying ? 'Connection lost, retrying' : 'Uploading'} ${label}: ${Math.round(done * 100)}%`));
+
+                    const hidden = document.createElement('input');
+                    hidden.type = 'hidden';
+                    hidden.name = `${item.input.name}_upload`;
+                    hidden.value = uploadId;
+                    hidden.dataset.uploadId = '';
+                    form.appendChild(hidden);
+                }
+            } catch (error) {
+                show(`${error.message}. Please try again.`);
+                buttons.forEach(button => button.disabled = false);
+                return;
+            }
+
+            // disabled inputs are left out of the submission, so the originals are not sent again
+            inputs.forEach(input => input.disabled = true);
+            show('Processing…');
+            form.submit();
+        });
+    }
+
+    document.querySelectorAll('form[data-chunked-upload]').forEach(enhance);
+
+    // coming back to the page (bfcache) must not leave the file inputs disabled
+    window.addEventListener('pageshow', function() {
+        document.querySelectorAll('form[data-chunked-upload] input[type=file]').forEach(input => input.disabled = false);
+        document.querySelectorAll('form[data-chunked-upload] [type=submit]').forEach(button => button.disabled = false);
+    });
+})();
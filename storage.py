@@ -0,0 +1,521 @@
+"""
+Storage backends for the app's persistent state.
+
+app.py reads and writes class documents, student photos, attendance CSVs,
+uploads, annotated images and in-flight enrollment/upload sessions through
+a Storage object rather than the local filesystem, so several app nodes
+behind a load balancer can share one store. Keys are the relative paths the
+app always used (data/<class>.json, known_faces/<class>/<photo>, ...).
+
+- LocalStorage: files under a directory on this machine (the default; the
+  same layout as before).
+- ObjectStorage: a bucket-style store reached through a small client
+  interface (whole-object get/put with ETags and conditional writes, head,
+  conditional delete, list). S3Client adapts boto3; DirectoryClient is a local stand-in
+  with the same semantics for tests and single-box trials.
+
+ObjectStorage keeps a read-through cache on local disk: objects that are
+never rewritten (photos, uploads, annotated images) are served from it
+without a round trip, everything else (class documents the galleries are
+built from, CSVs) is revalidated by ETag. Libraries that need a real file
+(send_file, thumbnails) get the cached copy from local_path().
+
+Derived, content-addressed caches (thumbnails, exact gallery arrays) stay
+node-local and are not part of the store.
+"""
+import os
+import io
+import csv
+import json
+import time
+import uuid
+import shutil
+import logging
+import posixpath
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from persistence import file_lock, atomic_open, VersionConflict
+
+logger = logging.getLogger(__name__)
+
+Stat = namedtuple('Stat', 'size mtime version')
+
+
+class PreconditionFailed(Exception):
+    """A conditional write lost against a concurrent writer."""
+
+
+class LockLost(Exception):
+    """A lock lease was taken over while its holder still ran."""
+
+
+class Storage:
+    """Key/value file store; subclasses provide the primitives."""
+
+    def read_bytes(self, key):
+        raise NotImplementedError
+
+    def write_bytes(self, key, data):
+        raise NotImplementedError
+
+    def stat(self, key):
+        """Stat(size, mtime, version) or None if the key does not exist."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """Names directly below `prefix` (files and sub-prefixes), sorted."""
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """A local file with the key's content (raises FileNotFoundError)."""
+        raise NotImplementedError
+
+    def lock(self, key):
+        """Context manager serializing read-modify-write cycles on `key`."""
+        raise NotImplementedError
+
+    # helpers built on the primitives
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def version(self, key):
+        """Cheap change token for ETags ("0" if missing)."""
+        st = self.stat(key)
+        return st.version if st else "0"
+
+    def read_text(self, key):
+        return self.read_bytes(key).decode('utf-8')
+
+    def write_text(self, key, text):
+        self.write_bytes(key, text.encode('utf-8'))
+
+    def append_bytes(self, key, data):
+        """Append to a key; callers must serialize appends with a lock.
+
+        Object stores cannot append, so the default rewrites the object;
+        keep appended keys small (see changefeed.py segments).
+        """
+        try:
+            current = self.read_bytes(key)
+        except FileNotFoundError:
+            current = b""
+        self.write_bytes(key, current + data)
+
+    def read_json(self, key):
+        return json.loads(self.read_bytes(key))
+
+    def write_json(self, key, data, **kwargs):
+        self.write_text(key, json.dumps(data, **kwargs))
+
+    def write_csv(self, key, rows, fieldnames=None):
+        """Write rows (lists, or dicts when fieldnames is given)."""
+        buf = io.StringIO(newline='')
+        if fieldnames:
+            writer = csv.DictWriter(buf, fieldnames=fieldnames)
+            writer.writeheader()
+        else:
+            writer = csv.writer(buf)
+        writer.writerows(rows)
+        self.write_text(key, buf.getvalue())
+
+    def open_image(self, key):
+        """File-like object for PIL / face_recognition.load_image_file."""
+        return io.BytesIO(self.read_bytes(key))
+
+    def save_versioned_json(self, key, data, **kwargs):
+        """Save `data` if the stored document still has the version it was read at.
+
+        Must be called while holding lock(key). Bumps data['version'].
+        """
+        try:
+            current = self.read_json(key).get('version', 0)
+        except FileNotFoundError:
+            current = None
+        expected = data.get('version', 0)
+        if current is not None and current != expected:
+            raise VersionConflict(f"{key} is at version {current}, expected {expected}")
+        data['version'] = expected + 1
+        try:
+            self.write_json(key, data, **kwargs)
+        except BaseException:
+            data['version'] = expected
+            raise
+
+
+class LocalStorage(Storage):
+    """Files under `root` on this machine."""
+
+    def __init__(self, root='.'):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def read_bytes(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def write_bytes(self, key, data):
+        with atomic_open(self._path(key), 'wb') as f:
+            f.write(data)
+
+    def append_bytes(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def stat(self, key):
+        try:
+            st = os.stat(self._path(key))
+        except OSError:
+            return None
+        return Stat(st.st_size, st.st_mtime, f"{st.st_mtime_ns:x}.{st.st_size:x}")
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+    def list(self, prefix):
+        try:
+            return sorted(os.listdir(self._path(prefix)))
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+    def local_path(self, key):
+        path = os.path.abspath(self._path(key))
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        return path
+
+    def lock(self, key):
+        return file_lock(self._path(key))
+
+
+class ObjectStorage(Storage):
+    """Bucket-style store with a read-through local cache.
+
+    Locks are leases: a "<key>.lock" object created with a conditional put,
+    taken over once it is older than lock_ttl seconds. The holder renews its
+    lease every lock_ttl / 3 seconds and only deletes it while it still owns
+    it; if the lease was lost anyway (e.g. renewals failed for a whole TTL),
+    leaving the lock raises LockLost instead of freeing someone else's. When
+    the locked block raised, its exception is kept and the loss is logged.
+    """
+
+    def __init__(self, client, cache_dir, immutable_prefixes=(), lock_ttl=60, lock_timeout=30):
+        self.client = client
+        self.cache_dir = cache_dir
+        self.immutable_prefixes = tuple(self._key(p).rstrip('/') + '/' for p in immutable_prefixes)
+        self.lock_ttl = lock_ttl
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def _key(key):
+        return posixpath.normpath(key.replace('\\', '/')).lstrip('/')
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, *key.split('/'))
+
+    def _cached(self, key, etag=None):
+        """Cached copy of `key` if present (and at `etag`, when given)."""
+        path = self._cache_path(key)
+        try:
+            with open(f"{path}.etag", 'r') as f:
+                cached_etag = f.read()
+        except OSError:
+            return None
+        if etag is not None and cached_etag != etag:
+            return None
+        return path if os.path.exists(path) else None
+
+    def _store_cache(self, key, data, etag):
+        path = self._cache_path(key)
+        with atomic_open(path, 'wb') as f:
+            f.write(data)
+        with atomic_open(f"{path}.etag", 'w') as f:
+            f.write(etag)
+        return path
+
+    def _drop_cache(self, key):
+        path = self._cache_path(key)
+        for p in (path, f"{path}.etag"):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def _fetch(self, key):
+        """Local cache path of `key`, downloading it if stale or missing."""
+        key = self._key(key)
+        if key.startswith(self.immutable_prefixes):
+            path = self._cached(key)
+            if path:
+                return path
+        head = self.client.head(key)
+        if head is None:
+            self._drop_cache(key)
+            raise FileNotFoundError(key)
+        path = self._cached(key, head['etag'])
+        if path:
+            return path
+        data, etag = self.client.get(key)
+        return self._store_cache(key, data, etag)
+
+    def read_bytes(self, key):
+        with open(self._fetch(key), 'rb') as f:
+            return f.read()
+
+    def local_path(self, key):
+        return os.path.abspath(self._fetch(key))
+
+    def write_bytes(self, key, data):
+        key = self._key(key)
+        etag = self.client.put(key, data)
+        self._store_cache(key, data, etag)
+
+    def stat(self, key):
+        head = self.client.head(self._key(key))
+        if head is None:
+            return None
+        return Stat(head['size'], head['mtime'], head['etag'])
+
+    def delete(self, key):
+        key = self._key(key)
+        self.client.delete(key)
+        self._drop_cache(key)
+
+    def delete_prefix(self, prefix):
+        prefix = self._key(prefix).rstrip('/') + '/'
+        for key in list(self.client.list(prefix)):
+            self.client.delete(key)
+        shutil.rmtree(self._cache_path(prefix.rstrip('/')), ignore_errors=True)
+
+    def list(self, prefix):
+        prefix = self._key(prefix).rstrip('/') + '/'
+        return sorted({key[len(prefix):].split('/', 1)[0] for key in self.client.list(prefix)})
+
+    @contextmanager
+    def lock(self, key):
+        lock_key = f"{self._key(key)}.lock"
+        lease = json.dumps({"owner": uuid.uuid4().hex}).encode()
+        deadline = time.time() + self.lock_timeout
+        delay = 0.02
+        while True:
+            try:
+                etag = self.client.put(lock_key, lease, if_none_match=True)
+                break
+            except PreconditionFailed:
+                pass
+            head = self.client.head(lock_key)
+            if head and head['mtime'] < time.time() - self.lock_ttl:
+                # holder died; take the stale lease over (only one taker wins)
+                try:
+                    etag = self.client.put(lock_key, lease, if_match=head['etag'])
+                    break
+                except PreconditionFailed:
+                    pass
+            if time.time() > deadline:
+                raise TimeoutError(f"Could not lock {key}")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        lease_etag = [etag]
+        lost = threading.Event()
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.lock_ttl / 3):
+                try:
+                    lease_etag[0] = self.client.put(lock_key, lease, if_match=lease_etag[0])
+                except PreconditionFailed:
+                    lost.set()
+                    return
+                except Exception:
+                    pass  # transient; the next renewal retries while the lease is still valid
+
+        def release():
+            done.set()
+            renewer.join()
+            try:
+                if lost.is_set():
+                    raise PreconditionFailed(lock_key)
+                self.client.delete(lock_key, if_match=lease_etag[0])
+            except PreconditionFailed:
+                raise LockLost(f"Lock on {key} expired and was taken over while held; "
+                               f"the work done under it may conflict with another writer")
+
+        renewer = threading.Thread(target=renew, name=f"lease {lock_key}", daemon=True)
+        renewer.start()
+        try:
+            yield
+        except BaseException:
+            try:
+                release()
+            except Exception as e:
+                logger.error(f"Releasing {lock_key} after a failure: {e}")
+            raise
+        release()
+
+
+class DirectoryClient:
+    """Object-store client backed by a local directory (stand-in for S3).
+
+    Objects are whole files; ETags change on every put and conditional puts
+    are atomic across processes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def head(self, key):
+        try:
+            st = os.stat(self._path(key))
+        except OSError:
+            return None
+        return {"size": st.st_size, "mtime": st.st_mtime, "etag": f"{st.st_mtime_ns:x}.{st.st_size:x}"}
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            # etag of the bytes read, not of a file that may have been replaced since
+            st = os.fstat(f.fileno())
+            return f.read(), f"{st.st_mtime_ns:x}.{st.st_size:x}"
+
+    def put(self, key, data, if_match=None, if_none_match=False):
+        path = self._path(key)
+        with file_lock(os.path.join(self.root, '.locks', key.replace('/', '%'))):
+            current = self.head(key)
+            if if_none_match and current is not None:
+                raise PreconditionFailed(key)
+            if if_match is not None and (current is None or current['etag'] != if_match):
+                raise PreconditionFailed(key)
+            with atomic_open(path, 'wb') as f:
+                f.write(data)
+            return self.head(key)['etag']
+
+    def delete(self, key, if_match=None):
+        if if_match is not None:
+            with file_lock(os.path.join(self.root, '.locks', key.replace('/', '%'))):
+                current = self.head(key)
+                if current is None or current['etag'] != if_match:
+                    raise PreconditionFailed(key)
+                os.remove(self._path(key))
+            return
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        directory, _, name_prefix = prefix.rpartition('/')
+        base = self._path(directory) if directory else self.root
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames[:] = [d for d in dirnames if d != '.locks']
+            for filename in filenames:
+                if filename.startswith('.') and filename.endswith('.tmp'):
+                    continue  # in-flight atomic writes
+                rel = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                if rel.startswith(prefix):
+                    yield rel
+
+
+class S3Client:
+    """boto3 adapter for ObjectStorage (needs S3 conditional writes)."""
+
+    def __init__(self, bucket, prefix='', **client_kwargs):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND='s3' needs boto3 (pip install boto3)")
+        self.s3 = boto3.client('s3', **client_kwargs)
+        self.ClientError = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def _error_code(self, e):
+        return e.response.get('Error', {}).get('Code', '')
+
+    def head(self, key):
+        try:
+            r = self.s3.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.ClientError as e:
+            if self._error_code(e) in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {"size": r['ContentLength'], "mtime": r['LastModified'].timestamp(), "etag": r['ETag']}
+
+    def get(self, key):
+        try:
+            r = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.ClientError as e:
+            if self._error_code(e) in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(key)
+            raise
+        return r['Body'].read(), r['ETag']
+
+    def put(self, key, data, if_match=None, if_none_match=False):
+        kwargs = {}
+        if if_none_match:
+            kwargs['IfNoneMatch'] = '*'
+        if if_match is not None:
+            kwargs['IfMatch'] = if_match
+        try:
+            r = self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, **kwargs)
+        except self.ClientError as e:
+            if self._error_code(e) in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise PreconditionFailed(key)
+            raise
+        return r['ETag']
+
+    def delete(self, key, if_match=None):
+        kwargs = {'IfMatch': if_match} if if_match is not None else {}
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=self.prefix + key, **kwargs)
+        except self.ClientError as e:
+            if if_match is not None and self._error_code(e) in ('PreconditionFailed', 'NoSuchKey', 'NotFound', '404'):
+                raise PreconditionFailed(key)
+            raise
+
+    def list(self, prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):]
+
+
+def from_config(config):
+    """Storage selected by Config.STORAGE_BACKEND."""
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(config.get('STORAGE_ROOT') or '.')
+
+    if backend == 's3':
+        client = S3Client(config['STORAGE_BUCKET'], config.get('STORAGE_PREFIX', ''),
+                          endpoint_url=config.get('STORAGE_ENDPOINT_URL'))
+    elif backend == 'directory':
+        client = DirectoryClient(config.get('STORAGE_ROOT') or '.')
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'")
+
+    immutable = [config.get(name) for name in ('KNOWN_FACES_FOLDER', 'UPLOAD_FOLDER') if config.get(name)]
+    immutable.append(os.path.join('static', 'annotated'))
+    return ObjectStorage(client, config.get('STORAGE_CACHE_FOLDER', os.path.join('cache', 'storage')),
+                         immutable_prefixes=immutable)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Institution-wide per-student attendance index.
+
+Answers "which students are below 75% across their classes" without
+reading a single session CSV:
+
+    GET /api/student-attendance?below=75&class=CSE-22&class=ECE-22&from=2025-08-01&to=2025-12-15
+
+    python student_index.py --below 75 --from 2025-08-01 -o flagged.csv
+    python student_index.py --rebuild
+
+The index is a SQLite file of running present/total counts per student,
+class and day, so any date range costs two rows per student and class
+(see SCHEMA). It is derived data: each app node keeps its own copy
+(STUDENT_INDEX_PATH) and brings it up to date by applying the change feed
+(changefeed.py) from the last sequence number it has seen, after every
+saved session and before every query. A new file, or a feed cursor that
+has been compacted away, triggers a rebuild from the session history.
+Sessions are recorded by file name, so an event applied twice (e.g. one
+saved during a rebuild) is only counted once. Classes are keyed by their
+safe name, however the URL spelled the class.
+"""
+import os
+import csv
+import sys
+import json
+import sqlite3
+import argparse
+from contextlib import closing
+
+import changefeed
+
+SCHEMA_VERSION = 2  # bump to have existing index files dropped and rebuilt
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS classes (safe_name TEXT PRIMARY KEY, name TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sessions (safe_name TEXT NOT NULL, filename TEXT NOT NULL,
+                                     PRIMARY KEY (safe_name, filename)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS students (student_id TEXT NOT NULL, safe_name TEXT NOT NULL, name TEXT NOT NULL,
+                                     PRIMARY KEY (student_id, safe_name)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS counts (safe_name TEXT NOT NULL, date TEXT NOT NULL, student_id TEXT NOT NULL,
+                                   present INTEGER NOT NULL, total INTEGER NOT NULL,
+                                   PRIMARY KEY (safe_name, date, student_id)) WITHOUT ROWID;
+"""
+TABLES = ('meta', 'classes', 'sessions', 'students', 'counts')
+# counts holds running totals: the row of (class, date, student) counts every
+# session of the class up to and including that date, and every day with a
+# session has a row for everyone who was ever in the class. Any date range
+# is then the difference of two days' rows, so a query reads two rows per
+# student and class however long the history is.
+
+_UPSERT_COUNT = """INSERT INTO counts VALUES (?1, ?2, ?3, ?4, ?5)
+                   ON CONFLICT (safe_name, date, student_id)
+                   DO UPDATE SET present = present + ?4, total = total + ?5"""
+
+
+def connect(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.executescript("".join(f"DROP TABLE IF EXISTS {table};" for table in TABLES)
+                           + f"PRAGMA user_version = {SCHEMA_VERSION};")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _feed_seq(conn):
+    value = _meta(conn, 'feed_seq')
+    return int(value) if value is not None else None
+
+
+def add_session(conn, safe_name, class_name, filename, date, records):
+    """Count one session ((student_id, name, status) records); False if already counted."""
+    if conn.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?)", (safe_name, filename)).rowcount == 0:
+        return False
+    conn.execute("INSERT OR REPLACE INTO classes VALUES (?, ?)", (safe_name, class_name))
+    records = [(student_id, name, int(status == 'present')) for student_id, name, status in records]
+    conn.executemany("INSERT OR REPLACE INTO students VALUES (?, ?, ?)",
+                     [(student_id, safe_name, name) for student_id, name, _ in records])
+
+    # first session on this day: carry everyone's running totals forward
+    previous = conn.execute("SELECT MAX(date) FROM counts WHERE safe_name = ? AND date < ?",
+                            (safe_name, date)).fetchone()[0]
+    if previous and not conn.execute("SELECT 1 FROM counts WHERE safe_name = ? AND date = ? LIMIT 1",
+                                     (safe_name, date)).fetchone():
+        conn.execute("""INSERT INTO counts SELECT safe_name, ?, student_id, present, total
+                        FROM counts WHERE safe_name = ? AND date = ?""", (date, safe_name, previous))
+
+    # a session saved for an earlier day also counts in every later day's totals
+    later = [row[0] for row in conn.execute("SELECT DISTINCT date FROM counts WHERE safe_name = ? AND date > ?",
+                                            (safe_name, date))]
+    for day in [date] + later:
+        conn.executemany(_UPSERT_COUNT, [(safe_name, day, student_id, present, 1)
+                                         for student_id, _, present in records])
+    return True
+
+
+def remove_class(conn, safe_name):
+    for table in ('classes', 'sessions', 'students', 'counts'):
+        conn.execute(f"DELETE FROM {table} WHERE safe_name = ?", (safe_name,))
+
+
+def apply_changes(conn, changes):
+    """Apply change feed events; returns how many sessions were counted."""
+    counted = 0
+    for event in changes:
+        if event['type'] == 'attendance.saved':
+            session = event['session']
+            counted += add_session(conn, event['safe_name'], event['class_name'], session['filename'], session['date'],
+                                   [(r['student_id'], r['name'], r['status']) for r in event['records']])
+        elif event['type'] == 'class.deleted':
+            remove_class(conn, event['safe_name'])
+    return counted
+
+
+def _insert_class(conn, safe_name, class_name, days, names):
+    """Write the running totals of one class from {date: {student_id: [present, total]}}."""
+    running = {}
+    for day in sorted(days):
+        for student_id, (present, total) in days[day].items():
+            counts = running.setdefault(student_id, [0, 0])
+            counts[0] += present
+            counts[1] += total
+        conn.executemany("INSERT INTO counts VALUES (?, ?, ?, ?, ?)",
+                         [(safe_name, day, student_id, present, total)
+                          for student_id, (present, total) in running.items()])
+    conn.execute("INSERT OR REPLACE INTO classes VALUES (?, ?)", (safe_name, class_name))
+    conn.executemany("INSERT OR REPLACE INTO students VALUES (?, ?, ?)",
+                     [(student_id, safe_name, name) for student_id, name in names.items()])
+
+
+def rebuild(conn, sessions, feed_seq, feed_lost="0"):
+    """Replace the index with sessions, class by class.
+
+    sessions yields (safe_name, class_name, filename, date, records).
+    feed_seq and feed_lost (changefeed.lost_version) must be read before
+    the sessions are, so nothing saved in between is missed by the next
+    sync.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        count = 0
+        current, class_name, days, names = None, None, {}, {}
+        for safe_name, name, filename, date, records in sessions:
+            if safe_name != current:
+                if current is not None:
+                    _insert_class(conn, current, class_name, days, names)
+                current, class_name, days, names = safe_name, name, {}, {}
+            if conn.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?)", (safe_name, filename)).rowcount == 0:
+                continue
+            count += 1
+            day = days.setdefault(date, {})
+            for student_id, name, status in records:
+                counts = day.setdefault(student_id, [0, 0])
+                counts[0] += status == 'present'
+                counts[1] += 1
+                names[student_id] = name
+        if current is not None:
+            _insert_class(conn, current, class_name, days, names)
+        conn.execute("INSERT INTO meta VALUES ('feed_seq', ?)", (str(feed_seq),))
+        conn.execute("INSERT INTO meta VALUES ('feed_lost', ?)", (feed_lost,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return count
+
+
+def sync(conn, store, feed_folder, history, page_size=1000):
+    """Apply the change feed since the last sync; rebuild from history() if that is impossible.
+
+    Returns the number of sessions counted. When the feed head is the one
+    seen at the end of the last sync, nothing is read at all. Events the
+    app could not append (changefeed.mark_lost) also trigger a rebuild.
+    """
+    feed_lost = changefeed.lost_version(store, feed_folder)
+    if _feed_seq(conn) is not None and (_meta(conn, 'feed_lost') or "0") != feed_lost:
+        return rebuild(conn, history(), changefeed.latest_seq(store, feed_folder), feed_lost)
+    feed_head = changefeed.head(store, feed_folder)  # taken first: an append after it only costs a re-read
+    if feed_head is not None and _feed_seq(conn) is not None and _meta(conn, 'feed_head') == feed_head:
+        return 0
+    counted = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")  # one node's workers sync one at a time
+        try:
+            since = _feed_seq(conn)
+            page = None
+            if since is not None:
+                try:
+                    page = changefeed.read_changes(store, feed_folder, since, page_size)
+                except changefeed.CursorExpired:
+                    pass
+            if page is None:
+                conn.execute("ROLLBACK")
+                return rebuild(conn, history(), changefeed.latest_seq(store, feed_folder), feed_lost)
+            counted += apply_changes(conn, page['changes'])
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('feed_seq', ?)", (str(page['next']),))
+            if not page['more'] and feed_head is not None:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('feed_head', ?)", (feed_head,))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        if not page['more']:
+            return counted
+
+
+def below_threshold(conn, threshold, classes=None, date_from=None, date_to=None):
+    """Students whose attendance over the selected classes (safe names) and days is below threshold percent.
+
+    Returns dicts with the overall present/total/rate and the same per
+    class, lowest rate first.
+    """
+    if classes:
+        class_rows = "SELECT value AS safe_name FROM json_each(?)"
+        params = [json.dumps(classes)]
+    else:
+        class_rows = "SELECT safe_name FROM classes"
+        params = []
+    # '~' sorts after every YYYY-MM-DD, so an open end means "up to the last day"
+    sql = f"""
+        WITH bounds AS (
+            SELECT safe_name,
+                   (SELECT MAX(date) FROM counts c WHERE c.safe_name = k.safe_name AND c.date <= ?) AS last_day,
+                   (SELECT MAX(date) FROM counts c WHERE c.safe_name = k.safe_name AND c.date < ?) AS day_before
+            FROM ({class_rows}) AS k),
+        per_class AS (
+            SELECT hi.student_id, hi.safe_name,
+                   hi.present - IFNULL(lo.present, 0) AS present, hi.total - IFNULL(lo.total, 0) AS total
+            FROM bounds
+            JOIN counts hi ON hi.safe_name = bounds.safe_name AND hi.date = bounds.last_day
+            LEFT JOIN counts lo ON lo.safe_name = bounds.safe_name AND lo.date = bounds.day_before
+                               AND lo.student_id = hi.student_id),
+        flagged AS (
+            SELECT student_id FROM per_class GROUP BY student_id
+            HAVING SUM(total) > 0 AND SUM(present) * 100.0 < ? * SUM(total))
+        SELECT per_class.student_id, per_class.safe_name, classes.name, per_class.present, per_class.total,
+               students.name
+        FROM per_class JOIN flagged USING (student_id)
+        JOIN students USING (student_id, safe_name)
+        JOIN classes USING (safe_name)
+        WHERE per_class.total > 0
+        ORDER BY per_class.student_id, per_class.safe_name"""
+
+    students = {}
+    for student_id, safe_name, class_name, present, total, name in conn.execute(
+            sql, [date_to or '~', date_from or ''] + params + [threshold]):
+        student = students.setdefault(student_id, {"student_id": student_id, "name": name,
+                                                   "present": 0, "total": 0, "classes": []})
+        student['present'] += present
+        student['total'] += total
+        student['classes'].append({"class_name": class_name, "safe_name": safe_name, "present": present,
+                                   "total": total, "rate": round(present * 100.0 / total, 1)})
+    for student in students.values():
+        student['rate'] = round(student['present'] * 100.0 / student['total'], 1)
+    return sorted(students.values(), key=lambda s: (s['present'] / s['total'], s['student_id']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--below', type=float, default=None, help="threshold percent (default STUDENT_INDEX_THRESHOLD)")
+    parser.add_argument('--class', dest='classes', action='append', default=[], help="limit to a class (repeatable)")
+    parser.add_argument('--from', dest='start', help="first day (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', help="last day (YYYY-MM-DD), inclusive")
+    parser.add_argument('--rebuild', action='store_true', help="rebuild the index from the session history first")
+    parser.add_argument('-o', '--output', default='-', help="CSV with an overall row (empty class_name) and one row per class for each flagged student (default: stdout)")
+    args = parser.parse_args(argv)
+
+    import app as webapp
+
+    if args.rebuild:
+        print(f"Counted {webapp.rebuild_student_index()} sessions", file=sys.stderr)
+    webapp.sync_student_index()
+    threshold = args.below if args.below is not None else webapp.STUDENT_INDEX_THRESHOLD
+    with closing(connect(webapp.STUDENT_INDEX_PATH)) as conn:
+        students = below_threshold(conn, threshold, [webapp.get_safe_name(name) for name in args.classes],
+                                   args.start, args.end)
+
+    out = open(args.output, 'w', newline='') if args.output != '-' else os.fdopen(os.dup(1), 'w', newline='')
+    with out:
+        writer = csv.writer(out)
+        writer.writerow(["student_id", "name", "class_name", "present", "total", "rate"])
+        for student in students:
+            writer.writerow([student['student_id'], student['name'], '', student['present'], student['total'],
+                             student['rate']])
+            for row in student['classes']:
+                writer.writerow([student['student_id'], student['name'], row['class_name'], row['present'],
+                                 row['total'], row['rate']])
+    print(f"{len(students)} students below {threshold}%", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def webapp(tmp_path, monkeypatch):
+    """The app module with all state (data, attendance, uploads, caches) under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    import app as webapp
+    webapp._api_cache.clear()
+    webapp._session_index_cache.clear()
+    webapp._manifest_cache.update(version=None, classes={})
+    webapp.app.config['TESTING'] = True
+    return webapp
+
+
+@pytest.fixture
+def client(webapp):
+    return webapp.app.test_client()
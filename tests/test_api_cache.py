@@ -0,0 +1,37 @@
+def test_unchanged_data_is_answered_with_304(webapp, client):
+    webapp.create_class('Api A')
+    response = client.get('/api/attendance-stats/Api A')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and response.get_json()['labels'] == ['No Data']
+
+    response = client.get('/api/attendance-stats/Api A', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_writes_only_drop_their_own_class(webapp, client):
+    webapp.create_class('Api A')
+    webapp.create_class('Api B')
+    stats = client.get('/api/attendance-stats/Api B').headers['ETag']
+    roster = client.get('/api/class-roster/Api B').headers['ETag']
+    client.get('/api/class-roster/Api A')
+    client.get('/api/class-overview')
+    assert len(webapp._api_cache) == 4
+
+    webapp.add_students('Api A', [{'student_id': 'S1', 'name': 'One'}])
+    assert sorted(key[:2] for key in webapp._api_cache) == [('attendance-stats', 'Api_B'), ('class-roster', 'Api_B')]
+    assert client.get('/api/attendance-stats/Api B').headers['ETag'] == stats
+    assert client.get('/api/class-roster/Api B').headers['ETag'] == roster
+
+    webapp.add_students('Api B', [{'student_id': 'S1', 'name': 'One'}])
+    assert client.get('/api/class-roster/Api B').get_json()['students'][0]['name'] == 'One'
+    assert client.get('/api/attendance-stats/Api B').headers['ETag'] != stats
+
+
+def test_the_shared_ledger_changes_every_class_stats_etag(webapp, client):
+    webapp.create_class('Api A')
+    webapp.create_class('Api B')
+    stats = client.get('/api/attendance-stats/Api B').headers['ETag']
+    webapp.log_attendance('Api A', 10, 7)
+    assert client.get('/api/attendance-stats/Api B').headers['ETag'] != stats
+    assert client.get('/api/attendance-stats/Api A').get_json()['datasets'][0]['data'] == [70.0]
@@ -0,0 +1,77 @@
+import os
+import time
+
+import pytest
+
+import changefeed
+from storage import LocalStorage
+
+
+@pytest.fixture
+def feed(tmp_path):
+    return LocalStorage(str(tmp_path)), 'changes'
+
+
+def add(store, folder, count, segment_events=4):
+    """Append count events one commit at a time; a commit never spans segments."""
+    return [seq for n in range(count)
+            for seq in changefeed.append(store, folder, [{"type": "test.event", "n": n}], segment_events)]
+
+
+def segments(store, folder):
+    return [name for name in store.list(folder) if name.endswith('.jsonl')]
+
+
+def test_pages_never_repeat_or_skip_events(feed):
+    store, folder = feed
+    assert add(*feed, 3) == [1, 2, 3]
+    assert add(*feed, 7) == list(range(4, 11))
+    assert segments(store, folder) == ['000000000001.jsonl', '000000000005.jsonl', '000000000009.jsonl']
+
+    seen, since = [], 0
+    while True:
+        page = changefeed.read_changes(store, folder, since, limit=3)
+        seen += [event['seq'] for event in page['changes']]
+        since = page['next']
+        if not page['more']:
+            break
+    assert seen == list(range(1, 11))
+    assert changefeed.read_changes(store, folder, since) == {"changes": [], "next": 10, "more": False}
+    assert changefeed.latest_seq(store, folder) == 10
+
+
+def test_torn_tail_is_dropped_before_the_next_append(feed):
+    store, folder = feed
+    add(*feed, 2)
+    store.append_bytes(os.path.join(folder, '000000000001.jsonl'), b'{"seq": 3, "type": "te')
+
+    assert [e['seq'] for e in changefeed.read_changes(store, folder)['changes']] == [1, 2]
+    assert add(*feed, 1) == [3]
+    assert [e['seq'] for e in changefeed.read_changes(store, folder)['changes']] == [1, 2, 3]
+
+
+def test_compaction_keeps_a_contiguous_tail_and_expires_old_cursors(feed):
+    store, folder = feed
+    add(*feed, 10)
+    assert changefeed.compact(store, folder, before_seq=6) == 1  # 5..8 still holds 6..8
+    assert changefeed.read_changes(store, folder, since=4)['changes'][0]['seq'] == 5
+    with pytest.raises(changefeed.CursorExpired):
+        changefeed.read_changes(store, folder, since=2)
+
+    # age-based compaction never removes the segment being appended to
+    assert changefeed.compact(store, folder, older_than=time.time() + 60) == 1
+    assert segments(store, folder) == ['000000000009.jsonl']
+    assert add(*feed, 1) == [11]
+
+
+def test_expired_cursor_is_answered_with_410(webapp, client):
+    for name in ('Feed A', 'Feed B', 'Feed C'):
+        webapp.create_class(name)
+    assert client.get('/api/changes?since=0&limit=2').get_json()['next'] == 2
+
+    add(webapp.storage, webapp.CHANGE_FEED_FOLDER, 3, segment_events=3)
+    changefeed.compact(webapp.storage, webapp.CHANGE_FEED_FOLDER, before_seq=4)
+    response = client.get('/api/changes?since=1')
+    assert response.status_code == 410
+    assert response.get_json()['latest'] == 6
+    assert [e['seq'] for e in client.get('/api/changes?since=3').get_json()['changes']] == [4, 5, 6]
@@ -0,0 +1,72 @@
+import os
+
+import chunked_upload
+
+DATA = bytes(range(256)) * 4  # 1 KB
+
+
+def start(client, data=DATA, filename='photo.jpg'):
+    response = client.post('/uploads', json={'filename': filename, 'size': len(data), 'kind': 'image'})
+    assert response.status_code == 201
+    return response.get_json()['upload_id']
+
+
+def put(client, upload_id, offset, data):
+    return client.put(f'/uploads/{upload_id}?offset={offset}', data=data)
+
+
+def test_chunks_are_only_accepted_at_the_current_offset(webapp, client, monkeypatch):
+    monkeypatch.setattr(webapp, 'CHUNKED_UPLOAD_CHUNK_SIZE', 300)
+    upload_id = start(client)
+
+    assert put(client, upload_id, 0, DATA[:300]).get_json()['offset'] == 300
+    # the connection dropped before the answer arrived: the client resends the same chunk
+    response = put(client, upload_id, 0, DATA[:300])
+    assert response.status_code == 409 and response.get_json()['offset'] == 300
+    # a chunk from the future is refused as well
+    response = put(client, upload_id, 600, DATA[600:900])
+    assert response.status_code == 409 and response.get_json()['offset'] == 300
+
+    # resume from what the server has
+    offset = client.get(f'/uploads/{upload_id}').get_json()['offset']
+    while offset < len(DATA):
+        offset = put(client, upload_id, offset, DATA[offset:offset + 300]).get_json()['offset']
+    assert client.get(f'/uploads/{upload_id}').get_json() == {
+        'upload_id': upload_id, 'filename': 'photo.jpg', 'offset': len(DATA), 'size': len(DATA), 'complete': True}
+
+    upload = chunked_upload.open_upload(webapp.storage, webapp.CHUNKED_UPLOAD_FOLDER, upload_id)
+    assert upload.filename == 'photo.jpg' and upload.read() == DATA
+    assert client.get(f'/uploads/{upload_id}').status_code == 404  # handed over once
+
+
+def test_bad_chunks_are_refused(webapp, client, monkeypatch):
+    monkeypatch.setattr(webapp, 'CHUNKED_UPLOAD_CHUNK_SIZE', 300)
+    upload_id = start(client, DATA[:500])
+
+    assert put(client, upload_id, 0, DATA[:301]).status_code == 400  # larger than a chunk
+    assert put(client, upload_id, 0, b'').status_code == 409
+    assert put(client, upload_id, 300, DATA[:300]).status_code == 409
+    assert put(client, upload_id, 0, DATA[:300]).status_code == 200
+    response = put(client, upload_id, 300, DATA[:300])  # past the announced size
+    assert response.status_code == 409 and response.get_json()['offset'] == 300
+    assert put(client, 'f' * 32, 0, DATA[:10]).status_code == 404
+    assert put(client, '../../etc', 0, DATA[:10]).status_code == 404
+
+    # an unfinished upload is never handed to a form
+    assert chunked_upload.open_upload(webapp.storage, webapp.CHUNKED_UPLOAD_FOLDER, upload_id) is None
+    assert client.get(f'/uploads/{upload_id}').get_json()['offset'] == 300
+
+
+def test_uploads_are_checked_when_started(client):
+    assert client.post('/uploads', json={'filename': 'notes.txt', 'size': 10}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'photo.jpg', 'size': 0}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'photo.jpg', 'size': 17 * 1024 * 1024}).status_code == 400
+
+
+def test_stale_uploads_are_purged(webapp, client):
+    stale, fresh = start(client), start(client)
+    meta = os.path.join(webapp.CHUNKED_UPLOAD_FOLDER, stale, 'meta.json')
+    os.utime(meta, (0, 0))
+    chunked_upload.purge_uploads(webapp.storage, webapp.CHUNKED_UPLOAD_FOLDER, max_age=3600)
+    assert client.get(f'/uploads/{stale}').status_code == 404
+    assert client.get(f'/uploads/{fresh}').status_code == 200
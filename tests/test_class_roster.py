@@ -0,0 +1,35 @@
+def test_roster_pages_come_from_the_projection(webapp, client, monkeypatch):
+    webapp.create_class('Ros A')
+    webapp.add_students('Ros A', [{'student_id': f'S{i:03d}', 'name': f'Student {i}'} for i in range(120)])
+
+    def no_class_files(class_name):
+        raise AssertionError("roster pages must not load the class file")
+    monkeypatch.setattr(webapp, 'get_class', no_class_files)
+
+    page = client.get('/api/class-roster/Ros A?page=3&per_page=50').get_json()
+    assert page['total'] == 120 and page['next_page'] is None
+    assert [s['student_id'] for s in page['students']] == [f'S{i:03d}' for i in range(100, 120)]
+    assert page['students'][0] == {'student_id': 'S100', 'name': 'Student 100', 'photo_count': 0,
+                                   'encoding_count': 0, 'thumbnail': None}
+
+    page = client.get('/api/class-roster/Ros A?q=student 11').get_json()
+    assert [s['student_id'] for s in page['students']] == ['S011'] + [f'S{i}' for i in range(110, 120)]
+
+
+def test_missing_or_stale_projection_is_rebuilt(webapp, client):
+    webapp.create_class('Ros B')
+    webapp.add_students('Ros B', [{'student_id': 'S1', 'name': 'One'}])
+    webapp.storage.delete(webapp.roster_path('Ros_B'))
+    assert client.get('/api/class-roster/Ros B').get_json()['total'] == 1
+
+    # a class file saved by something that does not know about projections
+    class_data = webapp.get_class('Ros B')
+    class_data['students'].append({'student_id': 'S2', 'name': 'Two', 'photos': ['S2_a.jpg'], 'encodings': [[0.0]]})
+    webapp.storage.write_json(webapp.class_file_path('Ros B'), class_data)
+    students = client.get('/api/class-roster/Ros B').get_json()['students']
+    assert students[1] == {'student_id': 'S2', 'name': 'Two', 'photo_count': 1, 'encoding_count': 1,
+                           'thumbnail': '/thumbnails/128/Ros_B/S2_a.jpg'}
+
+    webapp.delete_class('Ros B')
+    assert not webapp.storage.exists(webapp.roster_path('Ros_B'))
+    assert client.get('/api/class-roster/Ros B').status_code == 404
@@ -0,0 +1,73 @@
+import time
+import threading
+
+
+def bump_version(webapp, class_name, save_class=None):
+    """Save the class from "another worker", so a copy read earlier is stale."""
+    class_data = webapp.get_class(class_name)
+    class_data['total_students'] += 1
+    (save_class or webapp.save_class)(class_data)
+
+
+def test_update_class_retries_after_a_concurrent_save(webapp):
+    webapp.create_class('Upd A')
+    calls = []
+
+    def add(class_data):
+        calls.append(class_data['version'])
+        if len(calls) == 1:
+            bump_version(webapp, 'Upd A')
+        class_data['students'].append({'student_id': 'S1', 'name': 'One', 'photos': [], 'encodings': []})
+
+    class_data = webapp.update_class('Upd A', add)
+
+    assert calls == [1, 2]
+    assert [s['student_id'] for s in class_data['students']] == ['S1']
+    saved = webapp.get_class('Upd A')
+    assert saved['version'] == 3
+    assert saved['total_students'] == 1 and len(saved['students']) == 1
+
+
+def test_lost_retries_are_reported_not_raised(webapp, client, monkeypatch):
+    webapp.create_class('Upd B')
+    webapp.add_students('Upd B', [{'student_id': 'S1', 'name': 'One'}])
+    save_class = webapp.save_class
+
+    def always_stale(class_data, changes=()):
+        bump_version(webapp, 'Upd B', save_class)
+        return save_class(class_data, changes)
+
+    monkeypatch.setattr(webapp, 'save_class', always_stale)
+    assert webapp.add_students('Upd B', [{'student_id': 'S2', 'name': 'Two'}]) == (False, webapp.CLASS_BUSY_MESSAGE)
+    response = client.post('/class/Upd B/delete_student/S1')
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert ('error', f'❌ {webapp.CLASS_BUSY_MESSAGE}') in session['_flashes']
+
+    assert [s['student_id'] for s in webapp.get_class('Upd B')['students']] == ['S1']
+
+
+def test_feed_lists_concurrent_renames_in_save_order(webapp, monkeypatch):
+    webapp.create_class('Upd C')
+    webapp.add_students('Upd C', [{'student_id': 'S1', 'name': 'Name 0'}])
+    record_changes = webapp.record_changes
+
+    def slow_first_rename(events):
+        if any(event.get('name') == 'Name 1' for event in events):
+            time.sleep(0.3)  # the second rename saves meanwhile unless the class stays locked
+        record_changes(events)
+    monkeypatch.setattr(webapp, 'record_changes', slow_first_rename)
+
+    def rename(i):
+        webapp.add_students('Upd C', [{'student_id': 'S1', 'name': f'Name {i}'}])
+    threads = [threading.Thread(target=rename, args=(i,)) for i in (1, 2)]
+    threads[0].start()
+    time.sleep(0.1)
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    changes = webapp.changefeed.read_changes(webapp.storage, webapp.CHANGE_FEED_FOLDER)['changes']
+    renames = [c['name'] for c in changes if c['type'] == 'student.updated']
+    assert renames == ['Name 1', 'Name 2']
+    assert webapp.get_class('Upd C')['students'][0]['name'] == 'Name 2'
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import gallery
+from gallery import Gallery, select_templates, reference_nearest
+
+
+def unit(rng, n):
+    vectors = rng.normal(size=(n, 128))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_templates_start_at_the_medoid_and_skip_outliers():
+    rng = np.random.default_rng(1)
+    centre = unit(rng, 1)[0]
+    shots = [centre + 0.05 * v for v in unit(rng, 4)]
+    outlier = centre + 2.0 * unit(rng, 1)[0]
+    encodings = shots + [outlier, shots[0]]  # a bad shot and an exact duplicate
+
+    chosen = select_templates(encodings, k=6, max_spread=0.5)
+    pairwise = np.linalg.norm(np.array(encodings)[:, None] - np.array(encodings)[None], axis=2)
+    assert chosen[0] == int(pairwise.sum(axis=1).argmin())
+    assert 4 not in chosen
+    assert sorted(chosen) == [0, 1, 2, 3]  # the duplicate adds nothing
+
+    # without a spread limit the outlier is the farthest pick
+    assert select_templates(encodings, k=2)[1] == 4
+    assert select_templates(encodings, k=0) == [] and select_templates([], k=3) == []
+
+
+@pytest.mark.parametrize('mode', gallery.MODES)
+def test_compact_gallery_matches_the_exact_one_after_rerank(mode, tmp_path):
+    rng = np.random.default_rng(7)
+    students = [(f'S{i}', f'Student {i}', 'small', list(unit(rng, 1 + i % 3))) for i in range(40)]
+    # near-duplicate students, where quantization alone could swap the order
+    students.append(('T', 'Twin', 'small', [students[0][3][0] + 0.002 * unit(rng, 1)[0]]))
+    queries = np.array([e + 0.02 * unit(rng, 1)[0] for s in students for e in s[3]])
+
+    exact = Gallery(students)
+    compact = Gallery(students, mode=mode, exact_dir=str(tmp_path), rerank=4)
+    assert compact.nbytes < exact.nbytes
+    for query, got, want in zip(queries, compact.nearest({'small': queries}), exact.nearest({'small': queries})):
+        assert got[0] == want[0]
+        assert got[1:] == pytest.approx(want[1:], abs=1e-5)
+        sid, best, second = reference_nearest(students, query)
+        assert compact.student_ids[got[0]] == sid
+        assert (got[1], got[2]) == pytest.approx((best, second), abs=1e-5)
+
+
+def test_gallery_is_cached_per_class_version():
+    class_data = {'safe_name': 'Gallery_A', 'version': 1, 'students': [
+        {'student_id': 'S1', 'name': 'One', 'encodings': [list(np.ones(128) / np.sqrt(128))]}]}
+    first = gallery.get_gallery(class_data)
+    assert gallery.get_gallery(dict(class_data)) is first
+
+    class_data['version'] = 2
+    second = gallery.get_gallery(class_data)
+    assert second is not first
+    assert [k for k in gallery._galleries if k[0] == 'Gallery_A'] == [('Gallery_A', 2, None, None, gallery.DEFAULT_RERANK)]
+    assert Gallery([]).nearest({'small': np.zeros((2, 128))}) == [(None, None, None)] * 2
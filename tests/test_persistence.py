@@ -0,0 +1,59 @@
+import os
+import multiprocessing
+
+import pytest
+
+from persistence import file_lock, atomic_open, atomic_write_csv
+
+fork = multiprocessing.get_context('fork')
+
+
+def increment(path, times):
+    for _ in range(times):
+        with file_lock(path):
+            with open(path) as f:
+                value = int(f.read())
+            with atomic_open(path) as f:
+                f.write(str(value + 1))
+
+
+def test_file_lock_serializes_processes(tmp_path):
+    path = str(tmp_path / 'counter')
+    with open(path, 'w') as f:
+        f.write('0')
+    workers = [fork.Process(target=increment, args=(path, 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    with open(path) as f:
+        assert f.read() == '200'
+
+
+def test_atomic_open_keeps_the_old_file_on_failure(tmp_path):
+    path = str(tmp_path / 'ledger.csv')
+    atomic_write_csv(path, [['date', 'present'], ['2025-09-01', '7']])
+
+    with pytest.raises(RuntimeError):
+        with atomic_open(path) as f:
+            f.write('date,present\n')
+            raise RuntimeError("crashed mid-write")
+
+    with open(path) as f:
+        assert f.read().splitlines() == ['date,present', '2025-09-01,7']
+    assert os.listdir(tmp_path) == ['ledger.csv']
+
+
+def log_attendance(webapp, class_name):
+    webapp.log_attendance(class_name, 30, 20)
+
+
+def test_ledger_keeps_rows_logged_by_concurrent_workers(webapp):
+    webapp.ensure_attendance_csv_exists()
+    workers = [fork.Process(target=log_attendance, args=(webapp, f'Class {i}')) for i in range(6)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    rows = webapp.storage.read_text(webapp.OVERALL_ATTENDANCE_CSV).splitlines()
+    assert sorted(row.split(',')[1] for row in rows[1:]) == [f'Class {i}' for i in range(6)]
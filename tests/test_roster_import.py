@@ -0,0 +1,69 @@
+import io
+import csv
+import zipfile
+
+from PIL import Image
+
+
+def png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def chunked_upload(client, filename, data, kind):
+    """Send a file the way static/js/upload.js does; returns the upload id."""
+    response = client.post('/uploads', json={'filename': filename, 'size': len(data), 'kind': kind})
+    assert response.status_code == 201, response.get_json()
+    upload_id = response.get_json()['upload_id']
+    chunk_size = response.get_json()['chunk_size']
+    for offset in range(0, len(data), chunk_size):
+        response = client.put(f'/uploads/{upload_id}?offset={offset}', data=data[offset:offset + chunk_size])
+        assert response.status_code == 200
+    return upload_id
+
+
+def test_import_form_with_chunked_roster_and_photos(webapp, client, monkeypatch):
+    webapp.create_class('Imp A')
+    monkeypatch.setattr(webapp.recognition, 'encode_photos',
+                        lambda photos, profile, workers: [([0.1] * 128, None) for _ in photos])
+
+    roster = io.StringIO()
+    csv.writer(roster).writerows([['student_id', 'name'], ['22CS001', 'Asha Verma'], ['22CS002', 'Ravi Kumar']])
+    photos = io.BytesIO()
+    with zipfile.ZipFile(photos, 'w') as archive:
+        archive.writestr('22CS001.png', png_bytes('red'))
+        archive.writestr('22CS002.png', png_bytes('blue'))
+
+    form = {'roster_upload': chunked_upload(client, 'roster.csv', roster.getvalue().encode(), 'roster'),
+            'photos_upload': chunked_upload(client, 'photos.zip', photos.getvalue(), 'roster')}
+    response = client.post('/class/Imp A/import', data=form)
+
+    assert response.status_code == 200
+    assert b'Roster Import' in response.data
+    students = {s['student_id']: s for s in webapp.get_class('Imp A')['students']}
+    assert sorted(students) == ['22CS001', '22CS002']
+    assert all(len(s['photos']) == 1 for s in students.values())
+
+
+def test_import_form_posted_directly(webapp, client, monkeypatch):
+    webapp.create_class('Imp B')
+    roster = b'student_id,name\n22CS001,Asha Verma\n'
+    response = client.post('/class/Imp B/import', data={'roster': (io.BytesIO(roster), 'roster.csv')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert [s['student_id'] for s in webapp.get_class('Imp B')['students']] == ['22CS001']
+
+
+def test_upload_kinds_keep_their_extensions(client):
+    assert client.post('/uploads', json={'filename': 'roster.csv', 'size': 10}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'face.jpg', 'size': 10, 'kind': 'roster'}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'photos.zip', 'size': 10, 'kind': 'roster'}).status_code == 201
+    assert client.post('/uploads', json={'filename': 'x.csv', 'size': 10, 'kind': 'other'}).status_code == 400
+
+
+def test_roster_uploads_may_exceed_the_request_limit(webapp, client):
+    size = webapp.app.config['MAX_CONTENT_LENGTH'] + 1
+    assert client.post('/uploads', json={'filename': 'face.jpg', 'size': size}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'photos.zip', 'size': size, 'kind': 'roster'}).status_code == 201
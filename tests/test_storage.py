@@ -0,0 +1,105 @@
+import time
+import threading
+
+import pytest
+
+from persistence import VersionConflict
+from storage import LocalStorage, DirectoryClient, ObjectStorage, LockLost
+
+
+@pytest.fixture(params=['local', 'object'])
+def store(request, tmp_path):
+    if request.param == 'local':
+        return LocalStorage(str(tmp_path))
+    return ObjectStorage(DirectoryClient(str(tmp_path / 'bucket')), str(tmp_path / 'cache'), lock_ttl=0.6)
+
+
+@pytest.fixture
+def object_stores(tmp_path):
+    """Two nodes sharing one bucket, with short leases."""
+    client = DirectoryClient(str(tmp_path / 'bucket'))
+    return client, [ObjectStorage(client, str(tmp_path / f'cache{i}'), lock_ttl=0.6, lock_timeout=0.3)
+                    for i in range(2)]
+
+
+def take_over(client, key):
+    """Overwrite a held lease, as another node does once it looks stale."""
+    client.put(key, b'{"owner": "other"}', if_match=client.head(key)['etag'])
+
+
+def test_stale_copy_is_not_saved(store):
+    with store.lock('data/A.json'):
+        store.save_versioned_json('data/A.json', {'students': []})
+    first, second = store.read_json('data/A.json'), store.read_json('data/A.json')
+    first['students'].append('S1')
+    second['students'].append('S2')
+    with store.lock('data/A.json'):
+        store.save_versioned_json('data/A.json', first)
+        with pytest.raises(VersionConflict):
+            store.save_versioned_json('data/A.json', second)
+    assert store.read_json('data/A.json') == {'students': ['S1'], 'version': 2}
+    assert second['version'] == 1  # unchanged, so a retry re-reads
+
+
+def test_lock_excludes_other_holders(store):
+    events = []
+
+    def contender():
+        with store.lock('ledger.csv'):
+            events.append('contender')
+    with store.lock('ledger.csv'):
+        thread = threading.Thread(target=contender)
+        thread.start()
+        time.sleep(0.2)
+        events.append('holder done')
+    thread.join()
+    assert events == ['holder done', 'contender']
+
+
+def test_reads_see_writes_from_other_nodes(object_stores):
+    _, (a, b) = object_stores
+    a.write_json('data/A.json', {'v': 1})
+    assert b.read_json('data/A.json') == {'v': 1}
+    a.write_json('data/A.json', {'v': 22})
+    assert b.read_json('data/A.json') == {'v': 22}
+    a.delete('data/A.json')
+    with pytest.raises(FileNotFoundError):
+        b.read_json('data/A.json')
+
+
+def test_lease_of_a_dead_holder_is_taken_over(object_stores):
+    client, (a, _) = object_stores
+    client.put('k.lock', b'{"owner": "crashed"}', if_none_match=True)
+    started = time.time()
+    a.lock_timeout = 2
+    with a.lock('k'):
+        assert time.time() - started >= 0.5
+    assert client.head('k.lock') is None
+
+
+def test_lease_is_renewed_while_held(object_stores):
+    client, (a, b) = object_stores
+    with a.lock('k'):
+        time.sleep(1.2)  # twice the TTL
+        with pytest.raises(TimeoutError):
+            with b.lock('k'):
+                pass
+    assert client.head('k.lock') is None
+
+
+def test_lost_lease_raises_and_keeps_the_new_owners_lock(object_stores):
+    client, (a, _) = object_stores
+    with pytest.raises(LockLost):
+        with a.lock('k'):
+            take_over(client, 'k.lock')
+    assert client.get('k.lock')[0] == b'{"owner": "other"}'
+
+
+def test_lost_lease_does_not_hide_the_error_of_the_locked_block(object_stores, caplog):
+    client, (a, _) = object_stores
+    with pytest.raises(ValueError, match="bad row"):
+        with a.lock('k'):
+            take_over(client, 'k.lock')
+            raise ValueError("bad row")
+    assert client.get('k.lock')[0] == b'{"owner": "other"}'
+    assert 'Releasing k.lock after a failure' in caplog.text
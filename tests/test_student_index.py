@@ -0,0 +1,149 @@
+import random
+from datetime import datetime, timedelta
+
+import changefeed
+import student_index
+from storage import LocalStorage
+
+
+class Clock(datetime):
+    """datetime whose now() moves a minute per call, so every save gets its own file."""
+    current = datetime(2025, 9, 1, 9, 0, 0)
+
+    @classmethod
+    def now(cls, tz=None):
+        cls.current += timedelta(minutes=1)
+        return cls.current
+
+
+def below(client, *classes):
+    query = '&'.join(['below=75'] + [f'class={name}' for name in classes])
+    response = client.get(f'/api/student-attendance?{query}')
+    assert response.status_code == 200
+    return response.get_json()['students']
+
+
+def test_both_url_spellings_count_as_one_class(webapp, client, monkeypatch):
+    monkeypatch.setattr(webapp, 'datetime', Clock)
+    webapp.create_class('Math 101')
+    webapp.add_students('Math 101', [{'student_id': '22CS001', 'name': 'Asha Verma'},
+                                     {'student_id': '22CS002', 'name': 'Ravi Kumar'}])
+
+    for url, ravi in [('/attendance/Math_101/save', 'absent'), ('/attendance/Math 101/save', 'absent'),
+                      ('/attendance/Math_101/save', 'present'), ('/attendance/Math 101/save', 'absent')]:
+        response = client.post(url, data={'status_22CS001': 'present', 'status_22CS002': ravi})
+        assert response.status_code == 302
+
+    expected = [{'student_id': '22CS002', 'name': 'Ravi Kumar', 'present': 1, 'total': 4, 'rate': 25.0,
+                 'classes': [{'class_name': 'Math 101', 'safe_name': 'Math_101',
+                              'present': 1, 'total': 4, 'rate': 25.0}]}]
+    assert below(client) == expected
+    assert below(client, 'Math 101') == expected
+    assert below(client, 'Math_101') == expected
+
+    assert webapp.rebuild_student_index() == 4
+    assert below(client) == expected
+    assert below(client, 'Math 101') == expected
+    assert below(client, 'Math_101') == expected
+
+
+def random_sessions(seed=7, count=300):
+    """(safe_name, class_name, filename, date, records) tuples over three classes and four weeks."""
+    rng = random.Random(seed)
+    sessions = []
+    for k in range(count):
+        safe_name = rng.choice(['Class_A', 'Class_B', 'Class_C'])
+        day = f"2025-09-{rng.randint(1, 28):02d}"
+        ids = rng.sample([f"S{i:02d}" for i in range(12)], rng.randint(3, 12))
+        records = [(student_id, student_id.lower(), rng.choice(['present', 'absent', 'late'])) for student_id in ids]
+        sessions.append((safe_name, safe_name.replace('_', ' '), f"{safe_name}_{k}.csv", day, records))
+    return rng, sessions
+
+
+def brute_force(sessions, threshold, classes, date_from, date_to):
+    totals = {}
+    for safe_name, _, _, day, records in sessions:
+        if (classes and safe_name not in classes) or (date_from and day < date_from) or (date_to and day > date_to):
+            continue
+        for student_id, _, status in records:
+            counts = totals.setdefault(student_id, {}).setdefault(safe_name, [0, 0])
+            counts[0] += status == 'present'
+            counts[1] += 1
+    flagged = []
+    for student_id, per_class in totals.items():
+        present = sum(c[0] for c in per_class.values())
+        total = sum(c[1] for c in per_class.values())
+        if total and present * 100.0 < threshold * total:
+            flagged.append((student_id, present, total, sorted((name, *c) for name, c in per_class.items())))
+    return sorted(flagged)
+
+
+def test_counts_match_brute_force(tmp_path):
+    rng, sessions = random_sessions()
+    store, folder = LocalStorage(str(tmp_path)), 'changes'
+    changefeed.append(store, folder, [
+        {"type": "attendance.saved", "class_name": name, "safe_name": safe_name,
+         "session": {"filename": filename, "date": day},
+         "records": [{"student_id": i, "name": n, "status": s} for i, n, s in records]}
+        for safe_name, name, filename, day, records in sessions + sessions[:5]], segment_events=64)
+
+    incremental = student_index.connect(str(tmp_path / 'incremental.sqlite3'))
+    incremental.execute("INSERT INTO meta VALUES ('feed_seq', '0')")
+    assert student_index.sync(incremental, store, folder, lambda: iter(()), page_size=50) == len(sessions)
+    rebuilt = student_index.connect(str(tmp_path / 'rebuilt.sqlite3'))
+    assert student_index.rebuild(rebuilt, iter(sorted(sessions, key=lambda s: s[0])), 0) == len(sessions)
+
+    for _ in range(200):
+        threshold = rng.choice([20, 33.4, 50, 75, 101])
+        classes = rng.choice([None, ['Class_A'], ['Class_B', 'Class_C'], ['Class_A', 'Class_Z']])
+        date_from = rng.choice([None, f"2025-09-{rng.randint(1, 28):02d}"])
+        date_to = rng.choice([None, f"2025-09-{rng.randint(1, 28):02d}"])
+        expected = brute_force(sessions, threshold, classes, date_from, date_to)
+        for conn in (incremental, rebuilt):
+            students = student_index.below_threshold(conn, threshold, classes, date_from, date_to)
+            assert sorted((s['student_id'], s['present'], s['total'],
+                           sorted((c['safe_name'], c['present'], c['total']) for c in s['classes']))
+                          for s in students) == expected
+
+
+def test_sync_reads_nothing_when_the_feed_is_unchanged(tmp_path, monkeypatch):
+    store, folder = LocalStorage(str(tmp_path)), 'changes'
+    event = {"type": "attendance.saved", "class_name": "Class A", "safe_name": "Class_A",
+             "records": [{"student_id": "S01", "name": "s01", "status": "absent"}]}
+    changefeed.append(store, folder, [dict(event, session={"filename": "a1.csv", "date": "2025-09-01"})])
+    conn = student_index.connect(str(tmp_path / 'index.sqlite3'))
+    conn.execute("INSERT INTO meta VALUES ('feed_seq', '0')")
+    assert student_index.sync(conn, store, folder, lambda: iter(())) == 1
+
+    read_changes = changefeed.read_changes
+    reads = []
+    monkeypatch.setattr(changefeed, 'read_changes', lambda *args: reads.append(args) or read_changes(*args))
+    assert student_index.sync(conn, store, folder, lambda: iter(())) == 0
+    assert reads == []
+
+    changefeed.append(store, folder, [dict(event, session={"filename": "a2.csv", "date": "2025-09-02"})])
+    assert student_index.sync(conn, store, folder, lambda: iter(())) == 1
+    assert len(reads) == 1
+    assert student_index.below_threshold(conn, 75)[0]['total'] == 2
+
+
+def test_a_session_missing_from_the_feed_is_counted_by_a_rebuild(webapp, client, monkeypatch):
+    monkeypatch.setattr(webapp, 'datetime', Clock)
+    webapp.create_class('Lost 1')
+    webapp.add_students('Lost 1', [{'student_id': '22CS001', 'name': 'Asha Verma'}])
+    client.post('/attendance/Lost_1/save', data={'status_22CS001': 'absent'})
+    assert below(client)[0]['total'] == 1
+
+    append = changefeed.append
+
+    def failing_append(store, folder, events, *args):
+        if any(event['type'] == 'attendance.saved' for event in events):
+            raise OSError("storage unavailable")
+        return append(store, folder, events, *args)
+    monkeypatch.setattr(changefeed, 'append', failing_append)
+    client.post('/attendance/Lost_1/save', data={'status_22CS001': 'absent'})
+    monkeypatch.setattr(changefeed, 'append', append)
+
+    assert below(client)[0]['total'] == 2
+    client.post('/attendance/Lost_1/save', data={'status_22CS001': 'present'})
+    assert below(client)[0]['total'] == 3
@@ -0,0 +1,59 @@
+import io
+
+from PIL import Image
+
+
+def enroll_photo(webapp, class_name, student_id, filename):
+    """A student whose template photo was enrolled before face thumbnails existed."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 400), 'gray').save(buffer, 'JPEG')
+    webapp.storage.write_bytes(f"known_faces/{webapp.get_safe_name(class_name)}/{filename}", buffer.getvalue())
+    webapp.add_students(class_name, [{'student_id': student_id, 'name': student_id}])
+
+    def set_photo(class_data):
+        student = next(s for s in class_data['students'] if s['student_id'] == student_id)
+        student['photos'], student['encodings'] = [filename], [[0.0] * 128]
+    webapp.update_class(class_name, set_photo)
+
+
+def test_prerender_command_face_crops_old_photos(webapp, client, monkeypatch, tmp_path):
+    # send_file resolves relative paths against the app root, not the test's working directory
+    monkeypatch.setattr(webapp, 'THUMBNAIL_CACHE_FOLDER', str(tmp_path / 'cache' / 'thumbnails'))
+    webapp.create_class('Thumb A')
+    enroll_photo(webapp, 'Thumb A', 'S1', 'S1_old.jpg')
+
+    response = client.get('/thumbnails/128/Thumb_A/S1_old.jpg', headers={'Accept': 'image/jpeg'})
+    assert response.status_code == 200
+    assert response.headers['ETag'].endswith('-center"')
+
+    monkeypatch.setattr(webapp.thumbnails, '_find_face_box', lambda image: (100, 100, 200, 200))
+    runner = webapp.app.test_cli_runner()
+    result = runner.invoke(args=['prerender-thumbnails'])
+    assert 'Rendered thumbnails for 1 of 1 photos' in result.output
+
+    response = client.get('/thumbnails/128/Thumb_A/S1_old.jpg', headers={'Accept': 'image/jpeg'})
+    assert response.headers['ETag'].endswith('-face"')
+    assert response.cache_control.max_age == webapp.THUMBNAIL_MAX_AGE
+
+    result = runner.invoke(args=['prerender-thumbnails', 'Thumb A'])
+    assert 'Rendered thumbnails for 0 of 1 photos' in result.output
+
+
+def test_adding_a_photo_renders_only_its_own_thumbnails(webapp, monkeypatch):
+    webapp.create_class('Thumb B')
+    enroll_photo(webapp, 'Thumb B', 'S1', 'S1_old.jpg')
+    monkeypatch.setattr(webapp.recognition, 'load', lambda: type('FR', (), {'load_image_file': staticmethod(Image.open)}))
+    monkeypatch.setattr(webapp, 'encode_enrollment_photo', lambda image: [0.01] * 128)
+    rendered = []
+    monkeypatch.setattr(webapp, 'prerender_thumbnails', rendered.append)
+
+    photo = io.BytesIO()
+    Image.new('RGB', (300, 400), 'white').save(photo, 'JPEG')
+    photo.seek(0)
+    photo.filename = 'new.jpg'
+    success, _ = webapp.add_student_photo('Thumb B', 'S1', [photo])
+
+    assert success
+    photos = webapp.get_class('Thumb B')['students'][0]['photos']
+    assert 'S1_old.jpg' in photos and len(photos) == 2
+    assert rendered == [f"known_faces/Thumb_B/{p}" for p in photos if p != 'S1_old.jpg']
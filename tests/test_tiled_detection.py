@@ -0,0 +1,47 @@
+import numpy as np
+
+import recognition
+from recognition import non_max_suppression, detect_faces_tiled
+
+TILE = 128
+
+
+class PaintedFaces:
+    """Stand-in detector: every non-zero pixel value is one face.
+
+    Faces are found only in tile-sized crops, so the whole-image coarse
+    pass sees nothing and the result comes from merging the tiles.
+    """
+
+    def face_locations(self, image, number_of_times_to_upsample=1, model='hog'):
+        if max(image.shape[:2]) > TILE:
+            return []
+        boxes = []
+        for value in np.unique(image[..., 0]):
+            if value:
+                rows, cols = np.nonzero(image[..., 0] == value)
+                boxes.append((rows.min(), cols.max() + 1, rows.max() + 1, cols.min()))
+        return boxes
+
+
+def test_nms_drops_overlapping_and_truncated_duplicates():
+    full = (100, 140, 140, 100)
+    boxes = [full, (102, 141, 141, 101), (100, 108, 140, 100), (300, 340, 340, 300)]
+    scores = [0.9, 0.5, 1.0, 0.8]
+    # a seam-truncated box has a low IoU with the full one but lies inside it
+    assert non_max_suppression(boxes, scores) == [(100, 108, 140, 100), (300, 340, 340, 300)]
+    assert non_max_suppression(boxes, [1.0, 0.5, 0.2, 0.8]) == [full, (300, 340, 340, 300)]
+    assert non_max_suppression([], []) == []
+
+
+def test_faces_on_tile_seams_are_found_once_and_whole(monkeypatch):
+    monkeypatch.setattr(recognition, 'load', lambda: PaintedFaces())
+    image = np.zeros((300, 300, 3), dtype=np.uint8)
+    faces = [(60, 94, 94, 60),     # crosses the first horizontal and vertical seams
+             (10, 150, 40, 120),   # crosses a vertical seam at the top border
+             (230, 290, 260, 260)] # inside the last tiles only
+    for value, (top, right, bottom, left) in enumerate(faces, start=1):
+        image[top:bottom, left:right] = value
+
+    boxes = detect_faces_tiled(image, tile_size=TILE, coarse_dim=1600, max_upsample=0, workers=1)
+    assert sorted(tuple(int(v) for v in box) for box in boxes) == sorted(faces)
@@ -0,0 +1,178 @@
+"""
+Thumbnails for enrollment photos in known_faces/.
+
+Thumbnails are square, resized copies of the original photos, cached on disk
+under a key derived from the content hash of the source photo, so replacing
+a photo produces a new cache entry (and a new ETag) instead of a stale crop.
+
+Two variants exist per photo and size: a face-cropped one, rendered by the
+enrollment paths that already have the recognition models loaded, and a
+centre-cropped fallback that the thumbnail route can render without ever
+loading dlib. The face variant is preferred whenever it exists; photos
+enrolled before face variants existed get them from
+`flask --app app prerender-thumbnails`.
+"""
+import os
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+# path -> ((mtime_ns, size), sha1 hexdigest); avoids re-hashing multi-MB photos
+_hash_cache = {}
+_hash_lock = threading.Lock()
+_webp_supported = None
+
+
+def webp_supported():
+    global _webp_supported
+    if _webp_supported is None:
+        from PIL import features
+        _webp_supported = bool(features.check('webp'))
+    return _webp_supported
+
+
+def source_hash(path):
+    """Content hash of a source photo, memoized on (mtime, size)."""
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    with _hash_lock:
+        cached = _hash_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _hash_lock:
+        _hash_cache[path] = (key, digest)
+    return digest
+
+
+def thumbnail_etag(digest, size, fmt, variant):
+    return f"{digest[:20]}-{size}-{fmt}-{variant}"
+
+
+def _cache_path(cache_dir, digest, size, fmt, variant):
+    ext = 'jpg' if fmt == 'jpeg' else fmt
+    return os.path.join(cache_dir, digest[:2], f"{digest}_{size}_{variant}.{ext}")
+
+
+def _find_face_box(image):
+    """Return the largest face box (left, top, right, bottom) or None.
+
+    Detection runs on a small copy of the photo; enrollment photos are
+    portraits, so the face is large and a 400px copy is plenty.
+    """
+    import numpy as np
+    import recognition
+
+    detect_dim = 400
+    scale = min(1.0, detect_dim / max(image.size))
+    small = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+
+    try:
+        locations = recognition.load().face_locations(np.asarray(small))
+    except Exception as e:
+        logger.warning(f"Face detection for thumbnail failed: {e}")
+        return None
+    if not locations:
+        return None
+
+    top, right, bottom, left = max(locations, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+    return (left / scale, top / scale, right / scale, bottom / scale)
+
+
+def crop_box(image, face_box, padding=0.6):
+    """Square crop around the face (or the image centre when no face was found)."""
+    width, height = image.size
+    if face_box:
+        left, top, right, bottom = face_box
+        cx, cy = (left + right) / 2, (top + bottom) / 2
+        side = max(right - left, bottom - top) * (1 + padding)
+    else:
+        cx, cy = width / 2, height / 2
+        side = min(width, height)
+
+    side = min(side, width, height)
+    left = min(max(0, cx - side / 2), width - side)
+    top = min(max(0, cy - side / 2), height - side)
+    return (int(left), int(top), int(left + side), int(top + side))
+
+
+def _open_source(source_path):
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as img:
+        # Let the JPEG decoder downscale while decoding; originals are multi-MB
+        img.draft('RGB', (1024, 1024))
+        return ImageOps.exif_transpose(img).convert('RGB')
+
+
+def _save(image, path, fmt):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    image.save(tmp_path, FORMATS[fmt][0], quality=82)
+    os.replace(tmp_path, path)
+
+
+def lookup_thumbnail(source_path, size, fmt, cache_dir):
+    """Return (path, etag) of the best cached variant, or (None, etag) of the
+    centre-cropped variant that would be rendered now."""
+    digest = source_hash(source_path)
+    for variant in ('face', 'center'):
+        path = _cache_path(cache_dir, digest, size, fmt, variant)
+        if os.path.exists(path):
+            return path, thumbnail_etag(digest, size, fmt, variant)
+    return None, thumbnail_etag(digest, size, fmt, 'center')
+
+
+def has_face_variant(source_path, size, cache_dir):
+    """Whether a face-cropped thumbnail of this size was rendered for the photo."""
+    return os.path.exists(_cache_path(cache_dir, source_hash(source_path), size, 'jpeg', 'face'))
+
+
+def get_thumbnail(source_path, size, fmt, cache_dir):
+    """Return (path, etag) of a cached thumbnail, rendering the centre-cropped
+    variant if nothing is cached yet. Never loads the recognition models."""
+    path, etag = lookup_thumbnail(source_path, size, fmt, cache_dir)
+    if path:
+        return path, etag
+
+    from PIL import Image
+
+    digest = source_hash(source_path)
+    img = _open_source(source_path)
+    path = _cache_path(cache_dir, digest, size, fmt, 'center')
+    _save(img.crop(crop_box(img, None)).resize((size, size), Image.LANCZOS), path, fmt)
+    return path, thumbnail_etag(digest, size, fmt, 'center')
+
+
+def prerender_thumbnails(source_path, cache_dir, sizes):
+    """Render face-cropped thumbnails for every size and format.
+
+    Called from enrollment, where the recognition models are already loaded.
+    Falls back to the centre crop when no face is found.
+    """
+    from PIL import Image
+
+    digest = source_hash(source_path)
+    img = _open_source(source_path)
+    face_box = _find_face_box(img)
+    variant = 'face' if face_box else 'center'
+    crop = img.crop(crop_box(img, face_box))
+
+    formats = [fmt for fmt in FORMATS if fmt != 'webp' or webp_supported()]
+    for size in sizes:
+        thumb = crop.resize((size, size), Image.LANCZOS)
+        for fmt in formats:
+            _save(thumb, _cache_path(cache_dir, digest, size, fmt, variant), fmt)